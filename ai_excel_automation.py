@@ -15,13 +15,186 @@ import os
 from datetime import datetime
 import re
 
+from code_cache import CompiledCodeCache, GeneratedCodeCache
+from command_registry import Command, CommandRegistry
+from instruction_parsing import extract_dates, extract_filter, extract_number
+from sheet_stats import StatsCache, same_frame
+from insurance_normalizer import normalize_column, format_basic_insurance_name
+from workbook_loader import load_excel
+from export_formats import EXPORT_FORMATS, export_filename, get_export_format, write_export
+from request_metrics import stage
+from instruction_profiler import PROFILE_FORMATS, profiled
+
+COMMANDS = CommandRegistry()
+
+# Copy-on-write lets instructions share column data with the stored sheets
+pd.set_option('mode.copy_on_write', True)
+
+# Process-wide caches for AI-generated code
+COMPILED_CODE = CompiledCodeCache()
+GENERATED_CODE = GeneratedCodeCache()
+
+
+@COMMANDS.register('show_head')
+def show_head(current_df, params):
+    print(current_df.head(params['n']))
+
+
+@COMMANDS.register('show_tail')
+def show_tail(current_df, params):
+    print(current_df.tail(params['n']))
+
+
+@COMMANDS.register('data_info', uses_stats=True)
+def data_info(current_df, params, stats):
+    print("=== DATA INFO ===")
+    print(f"Shape: {current_df.shape}")
+    print(f"Columns: {list(current_df.columns)}")
+    print("\nData types:")
+    print(current_df.dtypes)
+    print("\nMissing values:")
+    print(stats.null_counts())
+    print("\nBasic statistics:")
+    print(stats.describe())
+
+
+@COMMANDS.register('filter_no_insurance')
+def filter_no_insurance(current_df, params):
+    filtered_df = current_df[current_df['Insurance'] == 'No Insurance']
+    print(f'Filtered {len(filtered_df)} rows')
+    print(filtered_df.head())
+
+
+@COMMANDS.register('date_range', uses_stats=True)
+def date_range(current_df, params, stats):
+    print('Date range:')
+    print(f'From: {stats.min("Appoinment Date")}')
+    print(f'To: {stats.max("Appoinment Date")}')
+
+
+@COMMANDS.register('list_columns')
+def list_columns(current_df, params):
+    print('Available columns for filtering:')
+    print(list(current_df.columns))
+
+
+@COMMANDS.register('value_counts', uses_stats=True)
+def value_counts(current_df, params, stats):
+    print(params['title'])
+    counts = stats.value_counts(params['column'])
+    print(counts.head(params['top']) if params.get('top') else counts)
+
+
+@COMMANDS.register('filter_rows', uses_stats=True)
+def filter_rows(current_df, params, stats):
+    column = params['column']
+    if column not in current_df.columns:
+        print(f"Column '{column}' not found. Available columns:", list(current_df.columns))
+        return
+    values, rows = stats.row_index(column).lookup(params['value'])
+    if not values:
+        if params.get('explicit', True):
+            print(f"No rows where {column} is '{params['value']}'. Available values:")
+        else:
+            # Not a value, just more words, e.g. "filter insurance types"
+            print(f"Available {column} values:")
+        print(stats.value_counts(column).head(10))
+        return
+    print(f"Filtered {len(rows)} rows where {column} is {' / '.join(map(str, values))}")
+    print(current_df.take(rows).head(params['n']))
+
+
+@COMMANDS.register('filter_dates', uses_stats=True)
+def filter_dates(current_df, params, stats):
+    column = params['column']
+    if column not in current_df.columns or current_df[column].dtype.kind != 'M':
+        print(f"'{column}' is not a date column. Available columns:", list(current_df.columns))
+        return
+    start = params['start'].normalize()
+    end = params['end'].normalize()
+    rows = stats.date_index(column).between(start, end + pd.Timedelta(days=1))
+    print(f"Filtered {len(rows)} rows with {column} from {start.date()} to {end.date()}")
+    print(current_df.take(rows).head(params['n']))
+
+
+@COMMANDS.register('date_buckets', uses_stats=True)
+def date_buckets(current_df, params, stats):
+    column = params['column']
+    if column not in current_df.columns or current_df[column].dtype.kind != 'M':
+        print(f"'{column}' is not a date column. Available columns:", list(current_df.columns))
+        return
+    print(params['title'])
+    print(stats.date_index(column).buckets(params['freq']))
+
+
+@COMMANDS.register('count_records')
+def count_records(current_df, params):
+    print(f'Total records: {len(current_df)}')
+
+
+@COMMANDS.register('summary_report', uses_stats=True)
+def summary_report(current_df, params, stats):
+    print("=== SUMMARY REPORT ===")
+    print(f"Total appointments: {len(current_df)}")
+    print(f"Date range: {stats.min('Appoinment Date')} to {stats.max('Appoinment Date')}")
+    print(f"Unique offices: {stats.nunique('Office Name')}")
+    print(f"Unique providers: {stats.nunique('Provider Name')}")
+    print(f"Unique patients: {stats.nunique('Patient ID')}")
+    print("\nTop 5 Insurance types:")
+    print(stats.value_counts('Insurance').head())
+    print("\nTop 5 Offices:")
+    print(stats.value_counts('Office Name').head())
+
+
+@COMMANDS.register('reformat_insurance', mutates=True)
+def reformat_insurance(current_df, params):
+    # Apply the reformatting once per distinct value
+    current_df['Insurance New'] = normalize_column(current_df['Insurance'], format_basic_insurance_name)
+
+    print("✅ Insurance column reformatted to match expected format!")
+    print("Sample of original vs reformatted:")
+    sample_df = current_df[['Insurance', 'Insurance New']].head(15)
+    print(sample_df.to_string(index=False))
+    print(f"\nTotal reformatted entries: {current_df['Insurance New'].notna().sum()}")
+    print("\nUnique reformatted values:")
+    print(current_df['Insurance New'].value_counts().head(25))
+
+
+@COMMANDS.register('export_sheet')
+def export_sheet(current_df, params):
+    # Export current data
+    output_file = f'processed_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+    current_df.to_excel(output_file, index=False)
+    print(f'Data exported to {output_file}')
+
+
+@COMMANDS.register('list_commands')
+def list_commands(current_df, params):
+    print("Available commands:")
+    print("- show/display: Show data")
+    print("- info/describe: Show data information")
+    print("- filter: Filter data")
+    print("- count: Count records")
+    print("- summary/report: Generate summary")
+    print("- export/save: Export data")
+    print(f"\nYour instruction: {params['instruction']}")
+
+
 class AIExcelAutomation:
-    def __init__(self, excel_file_path, api_key=None):
+    def __init__(self, excel_file_path, api_key=None, track_memory=False, optimize_dtypes=False):
         self.excel_file_path = excel_file_path
         self.api_key = api_key
+        self.track_memory = track_memory
+        # Off by default: generated code writes new values into columns
+        # like Insurance, which raises on categoricals
+        self.optimize_dtypes = optimize_dtypes
         self.data = {}
         self.current_sheet = None
         self.conversation_history = []
+        # Sheets changed since loading; export re-encodes only these
+        self.modified_sheets = set()
+        # Statistics reused by summary/count/info until a sheet changes
+        self.statistics = StatsCache()
         
         # Load the Excel file
         self.load_excel_file()
@@ -30,10 +203,14 @@ class AIExcelAutomation:
         """Load all sheets from the Excel file"""
         try:
             # Load all sheets
-            self.data = pd.read_excel(self.excel_file_path, sheet_name=None)
+            with stage('load'):
+                self.data, reports = load_excel(self.excel_file_path, track_memory=self.track_memory,
+                                                 optimize=self.optimize_dtypes)
+            self.modified_sheets = set()
+            self.statistics = StatsCache()
             print(f"✅ Loaded Excel file with {len(self.data)} sheets:")
-            for sheet_name in self.data.keys():
-                print(f"   - {sheet_name}: {self.data[sheet_name].shape}")
+            for report in reports:
+                print(f"   - {report}")
             
             # Set the main sheet (Consolidated) as current by default
             if 'Consolidated' in self.data:
@@ -48,13 +225,19 @@ class AIExcelAutomation:
             raise
     
     def ask_ai(self, instruction):
-        """Ask AI for code to execute the instruction"""
+        """Ask AI for code (or a built-in command) to execute the instruction"""
         if not self.api_key:
             return self.get_basic_instruction_code(instruction)
         
         try:
-            # Prepare the context
             current_df = self.data[self.current_sheet]
+            
+            # Reuse code generated for the same instruction on the same schema
+            cached_code = GENERATED_CODE.get(instruction, current_df)
+            if cached_code is not None:
+                return cached_code
+            
+            # Prepare the context
             context = f"""
             You are an Excel automation expert. You have access to a pandas DataFrame called 'current_df' with the following structure:
             
@@ -78,6 +261,8 @@ class AIExcelAutomation:
             
             # Call AI API (using a simple approach - you can replace with your preferred AI service)
             response = self.call_ai_api(context)
+            if isinstance(response, str):
+                GENERATED_CODE.put(instruction, current_df, response)
             return response
             
         except Exception as e:
@@ -91,279 +276,63 @@ class AIExcelAutomation:
         return self.get_basic_instruction_code(prompt.split("User instruction: ")[-1])
     
     def get_basic_instruction_code(self, instruction):
-        """Generate basic code for common instructions without AI"""
+        """Resolve common instructions to built-in commands without AI"""
         instruction = instruction.lower().strip()
         
         if "show" in instruction or "display" in instruction:
             if "first" in instruction:
-                num = self.extract_number(instruction) or 5
-                return f"print(current_df.head({num}))"
+                num = extract_number(instruction) or 5
+                return COMMANDS.command('show_head', n=num)
             elif "last" in instruction:
-                num = self.extract_number(instruction) or 5
-                return f"print(current_df.tail({num}))"
+                num = extract_number(instruction) or 5
+                return COMMANDS.command('show_tail', n=num)
             else:
-                return "print(current_df.head(10))"
+                return COMMANDS.command('show_head', n=10)
         
         elif "info" in instruction or "describe" in instruction:
-            return """
-print("=== DATA INFO ===")
-print(f"Shape: {current_df.shape}")
-print(f"Columns: {list(current_df.columns)}")
-print("\\nData types:")
-print(current_df.dtypes)
-print("\\nMissing values:")
-print(current_df.isnull().sum())
-print("\\nBasic statistics:")
-print(current_df.describe())
-"""
+            return COMMANDS.command('data_info')
         
         elif "filter" in instruction:
-            if "insurance" in instruction:
-                if "no insurance" in instruction:
-                    return "filtered_df = current_df[current_df['Insurance'] == 'No Insurance']\nprint(f'Filtered {len(filtered_df)} rows')\nprint(filtered_df.head())"
-                else:
-                    return "print('Available insurance types:')\nprint(current_df['Insurance'].value_counts().head(10))"
+            column, value, explicit = extract_filter(instruction)
+            dates = extract_dates(instruction)
+            if "no insurance" in instruction:
+                return COMMANDS.command('filter_no_insurance')
+            elif "date" in instruction and dates:
+                return COMMANDS.command('filter_dates', column='Appoinment Date', start=dates[0], end=dates[-1], n=5)
+            elif value:
+                return COMMANDS.command('filter_rows', column=column, value=value, explicit=explicit, n=5)
+            elif "insurance" in instruction:
+                return COMMANDS.command('value_counts', column='Insurance', title='Available insurance types:', top=10)
             elif "date" in instruction:
-                return "print('Date range:')\nprint(f'From: {current_df[\"Appoinment Date\"].min()}')\nprint(f'To: {current_df[\"Appoinment Date\"].max()}')"
+                return COMMANDS.command('date_range')
             else:
-                return "print('Available columns for filtering:')\nprint(list(current_df.columns))"
+                return COMMANDS.command('list_columns')
         
         elif "count" in instruction:
             if "insurance" in instruction:
-                return "print('Insurance counts:')\nprint(current_df['Insurance'].value_counts())"
+                return COMMANDS.command('value_counts', column='Insurance', title='Insurance counts:')
             elif "office" in instruction:
-                return "print('Office counts:')\nprint(current_df['Office Name'].value_counts())"
+                return COMMANDS.command('value_counts', column='Office Name', title='Office counts:')
             elif "provider" in instruction:
-                return "print('Provider counts:')\nprint(current_df['Provider Name'].value_counts())"
+                return COMMANDS.command('value_counts', column='Provider Name', title='Provider counts:')
+            elif "month" in instruction:
+                return COMMANDS.command('date_buckets', column='Appoinment Date', freq='M', title='Appointments per month:')
+            elif "day" in instruction or "daily" in instruction:
+                return COMMANDS.command('date_buckets', column='Appoinment Date', freq='D', title='Appointments per day:')
             else:
-                return "print(f'Total records: {len(current_df)}')"
+                return COMMANDS.command('count_records')
         
         elif "summary" in instruction or "report" in instruction:
-            return """
-print("=== SUMMARY REPORT ===")
-print(f"Total appointments: {len(current_df)}")
-print(f"Date range: {current_df['Appoinment Date'].min()} to {current_df['Appoinment Date'].max()}")
-print(f"Unique offices: {current_df['Office Name'].nunique()}")
-print(f"Unique providers: {current_df['Provider Name'].nunique()}")
-print(f"Unique patients: {current_df['Patient ID'].nunique()}")
-print("\\nTop 5 Insurance types:")
-print(current_df['Insurance'].value_counts().head())
-print("\\nTop 5 Offices:")
-print(current_df['Office Name'].value_counts().head())
-"""
+            return COMMANDS.command('summary_report')
         
         elif "reformat" in instruction and "insurance" in instruction:
-            return """
-import re
-
-# State abbreviations mapping
-STATE_ABBREVIATIONS = {
-    'AL': 'Alabama', 'AK': 'Alaska', 'AR': 'Arkansas', 'AZ': 'Arizona',
-    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
-    'DC': 'District of Columbia', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
-    'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
-    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine',
-    'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
-    'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska',
-    'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico',
-    'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
-    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island',
-    'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas',
-    'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
-    'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'
-}
-
-def expand_state_abbreviations(text):
-    \"\"\"Expand state abbreviations to full state names\"\"\"
-    if pd.isna(text):
-        return text
-    
-    text_str = str(text)
-    
-    # Look for state abbreviations (2 letters, possibly with spaces around them)
-    for abbr, full_name in STATE_ABBREVIATIONS.items():
-        # Match abbreviation at word boundaries
-        pattern = r'\\b' + abbr + r'\\b'
-        text_str = re.sub(pattern, full_name, text_str, flags=re.IGNORECASE)
-    
-    return text_str
-
-# Reformat Insurance column to match the expected format
-def format_insurance_name(insurance_text):
-    if pd.isna(insurance_text):
-        return insurance_text
-    
-    insurance_str = str(insurance_text).strip()
-    
-    # Handle special cases first
-    if insurance_str.upper() == 'NO INSURANCE':
-        return 'No Insurance'
-    elif insurance_str.upper() == 'PATIENT NOT FOUND':
-        return 'PATIENT NOT FOUND'
-    elif insurance_str.upper() == 'DUPLICATE':
-        return 'DUPLICATE'
-    
-    # Extract company name before "Ph#"
-    if "Ph#" in insurance_str:
-        company_name = insurance_str.split("Ph#")[0].strip()
-    else:
-        company_name = insurance_str
-    
-    # Remove "Primary" and "Secondary" text
-    company_name = re.sub(r'\s*\(Primary\)', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*\(Secondary\)', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*Primary', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*Secondary', '', company_name, flags=re.IGNORECASE)
-    
-    # Handle Delta Dental variations
-    if re.search(r'delta\s+dental', company_name, re.IGNORECASE):
-        # Extract state from Delta Dental
-        delta_match = re.search(r'delta\s+dental\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-        if delta_match:
-            state = delta_match.group(1).strip()
-            # Expand state abbreviations
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        else:
-            return "DD"
-    
-    # Handle BCBS variations
-    if re.search(r'bcbs|blue\s+cross|blue\s+shield', company_name, re.IGNORECASE):
-        # Extract state from BCBS
-        bcbs_match = re.search(r'(?:bcbs|blue\s+cross\s+blue\s+shield|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-        if bcbs_match:
-            state = bcbs_match.group(1).strip()
-            # Expand state abbreviations
-            state = expand_state_abbreviations(state)
-            return f"BCBS {state}"
-        else:
-            return "BCBS"
-    
-    # Handle other specific companies
-    if re.search(r'metlife|met\s+life', company_name, re.IGNORECASE):
-        return "Metlife"
-    elif re.search(r'cigna', company_name, re.IGNORECASE):
-        return "Cigna"
-    elif re.search(r'aarp', company_name, re.IGNORECASE):
-        return "AARP"
-    elif re.search(r'uhc|united\s*healthcare|united\s*health\s*care', company_name, re.IGNORECASE):
-        return "UHC"
-    elif re.search(r'teamcare', company_name, re.IGNORECASE):
-        return "Teamcare"
-    elif re.search(r'humana', company_name, re.IGNORECASE):
-        return "Humana"
-    elif re.search(r'aetna', company_name, re.IGNORECASE):
-        return "Aetna"
-    elif re.search(r'guardian', company_name, re.IGNORECASE):
-        return "Guardian"
-    elif re.search(r'anthem', company_name, re.IGNORECASE):
-        return "Anthem"
-    elif re.search(r'g\s*e\s*h\s*a', company_name, re.IGNORECASE):
-        return "GEHA"
-    elif re.search(r'principal', company_name, re.IGNORECASE):
-        return "Principal"
-    elif re.search(r'ameritas', company_name, re.IGNORECASE):
-        return "Ameritas"
-    elif re.search(r'physicians\s+mutual', company_name, re.IGNORECASE):
-        return "Physicians Mutual"
-    elif re.search(r'mutual\s+of\s+omaha', company_name, re.IGNORECASE):
-        return "Mutual Omaha"
-    elif re.search(r'sunlife|sun\s+life', company_name, re.IGNORECASE):
-        return "Sunlife"
-    elif re.search(r'liberty\s+dental', company_name, re.IGNORECASE):
-        return "Liberty Dental Plan"
-    elif re.search(r'careington', company_name, re.IGNORECASE):
-        return "Careington Benefit Solutions"
-    elif re.search(r'automated\s+benefit', company_name, re.IGNORECASE):
-        return "Automated Benefit Services Inc"
-    elif re.search(r'network\s+health', company_name, re.IGNORECASE):
-        return "Network Health Wisconsin"
-    elif re.search(r'regence', company_name, re.IGNORECASE):
-        return "REGENCE BCBS"
-    elif re.search(r'united\s+concordia', company_name, re.IGNORECASE):
-        return "United Concordia"
-    elif re.search(r'medical\s+mutual', company_name, re.IGNORECASE):
-        return "Medical Mutual"
-    elif re.search(r'blue\s+care\s+dental', company_name, re.IGNORECASE):
-        return "Blue Care Dental"
-    elif re.search(r'dominion\s+dental', company_name, re.IGNORECASE):
-        return "Dominion Dental"
-    elif re.search(r'carefirst', company_name, re.IGNORECASE):
-        return "CareFirst BCBS"
-    elif re.search(r'health\s+partners', company_name, re.IGNORECASE):
-        return "Health Partners"
-    elif re.search(r'keenan', company_name, re.IGNORECASE):
-        return "Keenan"
-    elif re.search(r'wilson\s+mcshane', company_name, re.IGNORECASE):
-        return "Wilson McShane- Delta Dental"
-    elif re.search(r'standard\s+(?:life\s+)?insurance', company_name, re.IGNORECASE):
-        return "Standard Life Insurance"
-    elif re.search(r'plan\s+for\s+health', company_name, re.IGNORECASE):
-        return "Plan for Health"
-    elif re.search(r'kansas\s+city', company_name, re.IGNORECASE):
-        return "Kansas City"
-    elif re.search(r'the\s+guardian', company_name, re.IGNORECASE):
-        return "The Guardian"
-    elif re.search(r'community\s+dental', company_name, re.IGNORECASE):
-        return "Community Dental Associates"
-    elif re.search(r'northeast\s+delta\s+dental', company_name, re.IGNORECASE):
-        return "Northeast Delta Dental"
-    elif re.search(r'say\s+cheese\s+dental', company_name, re.IGNORECASE):
-        return "SAY CHEESE DENTAL NETWORK"
-    elif re.search(r'dentaquest', company_name, re.IGNORECASE):
-        return "Dentaquest"
-    elif re.search(r'umr', company_name, re.IGNORECASE):
-        return "UMR"
-    elif re.search(r'mhbp', company_name, re.IGNORECASE):
-        return "MHBP"
-    elif re.search(r'united\s+states\s+army', company_name, re.IGNORECASE):
-        return "United States Army"
-    elif re.search(r'conversion\s+default', company_name, re.IGNORECASE):
-        return "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!"
-    elif re.search(r'equitable', company_name, re.IGNORECASE):
-        return "Equitable"
-    elif re.search(r'manhattan\s+life', company_name, re.IGNORECASE):
-        return "Manhattan Life"
-    
-    # If no specific pattern matches, return the cleaned company name
-    return company_name.strip()
-
-# Apply the reformatting
-current_df['Insurance New'] = current_df['Insurance'].apply(format_insurance_name)
-
-print("✅ Insurance column reformatted to match expected format!")
-print("Sample of original vs reformatted:")
-sample_df = current_df[['Insurance', 'Insurance New']].head(15)
-print(sample_df.to_string(index=False))
-print(f"\\nTotal reformatted entries: {current_df['Insurance New'].notna().sum()}")
-print("\\nUnique reformatted values:")
-print(current_df['Insurance New'].value_counts().head(25))
-"""
+            return COMMANDS.command('reformat_insurance')
         
         elif "export" in instruction or "save" in instruction:
-            return """
-# Export current data
-output_file = f'processed_data_{datetime.now().strftime(\"%Y%m%d_%H%M%S\")}.xlsx'
-current_df.to_excel(output_file, index=False)
-print(f'Data exported to {output_file}')
-"""
+            return COMMANDS.command('export_sheet')
         
         else:
-            return f"""
-print("Available commands:")
-print("- show/display: Show data")
-print("- info/describe: Show data information")
-print("- filter: Filter data")
-print("- count: Count records")
-print("- summary/report: Generate summary")
-print("- export/save: Export data")
-print("\\nYour instruction: {instruction}")
-"""
-    
-    def extract_number(self, text):
-        """Extract number from text"""
-        numbers = re.findall(r'\d+', text)
-        return int(numbers[0]) if numbers else None
+            return COMMANDS.command('list_commands', instruction=instruction)
     
     def execute_instruction(self, instruction):
         """Execute the given instruction"""
@@ -377,32 +346,57 @@ print("\\nYour instruction: {instruction}")
         })
         
         try:
-            # Get code from AI or basic processor
-            code = self.ask_ai(instruction)
-            
-            # Prepare execution environment
-            current_df = self.data[self.current_sheet].copy()
+            # Get a built-in command or AI-generated code
+            with stage('codegen'):
+                code = self.ask_ai(instruction)
             
-            # Create execution context
-            exec_globals = {
-                'pd': pd,
-                'current_df': current_df,
-                'self': self,
-                'datetime': datetime,
-                'print': print
-            }
-            
-            # Execute the code
-            print("📝 Generated code:")
-            print("-" * 40)
-            print(code)
-            print("-" * 40)
-            
-            exec(code, exec_globals)
+            # Prepare execution environment. Read-only commands run on the
+            # live frame; everything else gets a shallow copy, and
+            # copy-on-write duplicates only the columns that are written
+            current_df = self.data[self.current_sheet]
+            if not isinstance(code, Command) or code.mutates:
+                current_df = current_df.copy(deep=False)
             
-            # Update the data if it was modified
-            if 'current_df' in exec_globals:
-                self.data[self.current_sheet] = exec_globals['current_df']
+            if isinstance(code, Command):
+                print(f"📝 Command: {code!r}")
+                if code.mutates:
+                    with stage('exec'):
+                        code(current_df)
+                    self.statistics.update(self.current_sheet, current_df)
+                    self.data[self.current_sheet] = current_df
+                    self.modified_sheets.add(self.current_sheet)
+                else:
+                    with stage('exec'):
+                        code(current_df, self.statistics.get(self.current_sheet, current_df))
+            else:
+                # Create execution context
+                exec_globals = {
+                    'pd': pd,
+                    'current_df': current_df,
+                    'self': self,
+                    'datetime': datetime,
+                    'print': print
+                }
+                
+                # Execute the code
+                print("📝 Generated code:")
+                print("-" * 40)
+                print(code)
+                print("-" * 40)
+                
+                # Generated code may also change other sheets through
+                # self.data, in place or by replacing them; shallow copies
+                # keep each sheet's column buffers as they were before
+                before = {sheet_name: df.copy(deep=False) for sheet_name, df in self.data.items()}
+                try:
+                    with stage('exec'):
+                        exec(COMPILED_CODE.compile(code), exec_globals)
+                    
+                    # Update the data if it was modified
+                    if 'current_df' in exec_globals:
+                        self.data[self.current_sheet] = exec_globals['current_df']
+                finally:
+                    self.mark_changed_sheets(before)
             
             print("✅ Instruction executed successfully!")
             
@@ -410,6 +404,24 @@ print("\\nYour instruction: {instruction}")
             print(f"❌ Error executing instruction: {e}")
             print("💡 Try rephrasing your instruction or use one of the basic commands.")
     
+    def mark_changed_sheets(self, before):
+        """Mark the sheets whose data differs from the frames in before as modified"""
+        for sheet_name, df in self.data.items():
+            previous = before.get(sheet_name)
+            if previous is None or not same_frame(previous, df):
+                self.modified_sheets.add(sheet_name)
+                self.statistics.update(sheet_name, df)
+        self.modified_sheets &= set(self.data)
+    
+    def profile_instruction(self, instruction, profile_format='pstats'):
+        """Execute an instruction under the profiler and save the profile"""
+        path = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}{PROFILE_FORMATS[profile_format]}"
+        with profiled(profile_format, path, name=instruction) as profile:
+            self.execute_instruction(instruction)
+        print(profile)
+        print(profile.summary)
+        return path
+    
     def switch_sheet(self, sheet_name):
         """Switch to a different sheet"""
         if sheet_name in self.data:
@@ -427,17 +439,20 @@ print("\\nYour instruction: {instruction}")
             current = " (current)" if sheet_name == self.current_sheet else ""
             print(f"   {i}. {sheet_name}: {shape[0]} rows × {shape[1]} columns{current}")
     
-    def export_data(self, filename=None):
-        """Export current data to Excel"""
+    def export_data(self, filename=None, export_format='xlsx'):
+        """Export current data as xlsx, csv (gzipped), parquet or arrow"""
         if not filename:
             filename = f"processed_{self.excel_file_path.split('/')[-1].replace('.xlsx', '')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         
         try:
-            with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                for sheet_name, df in self.data.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
+            export_format = get_export_format(export_format)
+            filename = export_filename(filename, export_format, self.data)
+            with stage('export'):
+                report = write_export(self.data, filename, export_format, source_path=self.excel_file_path,
+                                      modified_sheets=sorted(self.modified_sheets))
             
             print(f"✅ Data exported to: {filename}")
+            print(f"📦 {report}")
             return filename
             
         except Exception as e:
@@ -452,7 +467,8 @@ print("\\nYour instruction: {instruction}")
         print("  - Type any instruction (e.g., 'show first 10 rows')")
         print("  - 'switch [sheet_name]' - Switch to different sheet")
         print("  - 'list' - List all sheets")
-        print("  - 'export' - Export current data")
+        print("  - 'profile [instruction]' - Run an instruction under cProfile and save the .pstats file")
+        print(f"  - 'export [{'|'.join(EXPORT_FORMATS)}]' - Export current data (default xlsx)")
         print("  - 'quit' - Exit program")
         print("=" * 50)
         
@@ -465,11 +481,13 @@ print("\\nYour instruction: {instruction}")
                     break
                 elif instruction.lower() == 'list':
                     self.list_sheets()
+                elif instruction.lower().startswith('profile '):
+                    self.profile_instruction(instruction[8:].strip())
                 elif instruction.lower().startswith('switch '):
                     sheet_name = instruction[7:].strip()
                     self.switch_sheet(sheet_name)
-                elif instruction.lower() == 'export':
-                    self.export_data()
+                elif instruction.lower() == 'export' or instruction.lower().startswith('export '):
+                    self.export_data(export_format=instruction[6:].strip() or 'xlsx')
                 elif instruction:
                     self.execute_instruction(instruction)
                 else:
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for insurance normalization on a synthetic Insurance column
+
+Times every normalization path at several column sizes and writes the
+results as JSON, so runs on two commits can be compared:
+
+    python benchmarks/bench_insurance_suite.py --output before.json
+    git checkout <other commit>
+    python benchmarks/bench_insurance_suite.py --output after.json --compare before.json
+
+Paths:
+  apply          Series.apply with the scalar function
+  normalize      normalize_column as the apps call it: the scalar function
+                 once per distinct value, through a cold LRU
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from insurance_corpus import generate_corpus, generate_state_suffixes
+from insurance_normalizer import (clear_normalized_caches, expand_state_abbreviations, format_basic_insurance_name,
+                                  format_insurance_name, normalize_column)
+
+NORMALIZERS = [format_insurance_name, format_basic_insurance_name]
+PATHS = ['apply', 'normalize']
+
+
+def _run_path(path, normalizer):
+    if path == 'apply':
+        return lambda series: series.apply(normalizer)
+    return lambda series: normalize_column(series, normalizer, parallel=False)
+
+
+def best_time(func, series, repeat):
+    """Fastest of repeat runs, each starting from cold normalization caches"""
+    times = []
+    for _ in range(repeat):
+        clear_normalized_caches()
+        start = time.perf_counter()
+        func(series)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    for rows in args.sizes:
+        series = generate_corpus(rows, args.distinct, seed=args.seed, skew=args.skew)
+        distinct = int(series.nunique())
+        for normalizer in NORMALIZERS:
+            for path in args.paths:
+                if path == 'apply' and rows > args.max_apply_rows:
+                    continue
+                seconds = best_time(_run_path(path, normalizer), series, args.repeat)
+                results.append({'benchmark': normalizer.__name__, 'path': path, 'rows': rows,
+                                'distinct': distinct, 'seconds': seconds, 'rows_per_second': rows / seconds})
+                print(f"{normalizer.__name__:28} {path:11} {rows:>9} rows {distinct:>7} distinct "
+                      f"{seconds:9.4f} s")
+
+        if rows <= args.max_apply_rows:
+            suffixes = generate_state_suffixes(rows, seed=args.seed)
+            seconds = best_time(lambda s: s.apply(expand_state_abbreviations), suffixes, args.repeat)
+            results.append({'benchmark': 'expand_state_abbreviations', 'path': 'apply', 'rows': rows,
+                            'distinct': int(suffixes.nunique()), 'seconds': seconds,
+                            'rows_per_second': rows / seconds})
+            print(f"{'expand_state_abbreviations':28} {'apply':11} {rows:>9} rows "
+                  f"{suffixes.nunique():>7} distinct {seconds:9.4f} s")
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r['benchmark'], r['path'], r['rows']): r['seconds'] for r in baseline['results']}
+    print(f"\nCompared with {baseline_path} ({baseline['metadata'].get('commit')}):")
+    for result in results:
+        key = (result['benchmark'], result['path'], result['rows'])
+        if key in before:
+            print(f"{key[0]:28} {key[1]:11} {key[2]:>9} rows {before[key]:9.4f} s -> {result['seconds']:9.4f} s "
+                  f"({before[key] / result['seconds']:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--sizes', type=lambda text: [int(size) for size in text.split(',')],
+                        default=[10000, 100000, 1000000], help='comma-separated column sizes')
+    parser.add_argument('--distinct', type=int, default=5000, help='distinct Insurance values in the corpus')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of value frequencies')
+    parser.add_argument('--paths', type=lambda text: text.split(','), default=PATHS,
+                        help=f"comma-separated paths to time ({','.join(PATHS)})")
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the fastest is kept')
+    parser.add_argument('--max-apply-rows', type=int, default=1000000,
+                        help='skip Series.apply above this many rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    unknown = set(args.paths) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown paths: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    report = {
+        'metadata': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
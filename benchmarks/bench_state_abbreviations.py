@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass state abbreviation expansion vs the old
+per-abbreviation re.sub loop
+
+Usage: python benchmarks/bench_state_abbreviations.py [--number N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insurance_normalizer import STATE_ABBREVIATIONS, expand_state_abbreviations
+
+SAMPLES = [
+    'MI', 'of TX', 'CA', 'New York', 'Of Michigan', 'ny', 'WA Plan', 'co',
+    'Washington', 'IN', 'of WI PPO', 'Blue Plus', 'NJ - Horizon', 'of Tx',
+]
+
+
+def legacy_expand_state_abbreviations(text):
+    """The original implementation: one re.sub per abbreviation"""
+    text_str = str(text)
+    for abbr, full_name in STATE_ABBREVIATIONS.items():
+        pattern = r'\b' + abbr + r'\b'
+        text_str = re.sub(pattern, full_name, text_str, flags=re.IGNORECASE)
+    return text_str
+
+
+def run_samples(func):
+    for sample in SAMPLES:
+        func(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help='iterations over the sample set')
+    args = parser.parse_args()
+
+    for sample in SAMPLES:
+        expected = legacy_expand_state_abbreviations(sample)
+        actual = expand_state_abbreviations(sample)
+        assert actual == expected, f"{sample!r}: {actual!r} != {expected!r}"
+
+    calls = args.number * len(SAMPLES)
+    legacy = min(timeit.repeat(lambda: run_samples(legacy_expand_state_abbreviations), number=args.number, repeat=3))
+    single = min(timeit.repeat(lambda: run_samples(expand_state_abbreviations), number=args.number, repeat=3))
+
+    print(f"Calls per run:      {calls}")
+    print(f"Legacy loop:        {legacy * 1e6 / calls:8.2f} us/call")
+    print(f"Single-pass regex:  {single * 1e6 / calls:8.2f} us/call")
+    print(f"Speedup:            {legacy / single:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
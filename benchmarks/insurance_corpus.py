@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Synthetic Insurance column shaped like real appointment exports: a few
+carriers dominate, Delta Dental and BCBS appear under many spellings and
+state suffixes, and values carry Ph# suffixes and Primary/Secondary markers
+"""
+
+import random
+
+import numpy as np
+import pandas as pd
+
+STATES = [
+    ('CA', 'California'), ('NY', 'New York'), ('TX', 'Texas'), ('MI', 'Michigan'), ('WA', 'Washington'),
+    ('WI', 'Wisconsin'), ('OK', 'Oklahoma'), ('IL', 'Illinois'), ('MN', 'Minnesota'), ('CO', 'Colorado'),
+    ('IN', 'Indiana'), ('NJ', 'New Jersey'), ('PA', 'Pennsylvania'), ('OH', 'Ohio'), ('AZ', 'Arizona'),
+]
+
+DELTA_DENTAL = [
+    'Delta Dental', 'Delta Dental of {state}', 'DELTA DENTAL OF {abbr}', 'delta dental {state}',
+    'Dleta Dental Of {state}', 'Dekta Dental of {abbr}', 'Dektal Dental of {state}', 'Denta Dental of {state}',
+    'Dental Dental Of {abbr}', 'DD of {abbr}', 'DD {abbr}', 'Delta Dental Insurance Co',
+    'Northeast Delta Dental', 'Wilson McShane - Delta Dental',
+]
+BCBS = [
+    'BCBS', 'BCBS of {state}', 'BCBS {abbr}', 'BC/BS', 'BC/BS of {state}', 'BC Of {state}', 'bcbbs',
+    'Blue Cross Blue Shield', 'Blue Cross Blue Shield of {state}', 'Blue Cross of {state}',
+    'Blue Shield of {abbr}', 'Anthem Blue Cross', 'Anthem', 'Regence BlueShield', 'CareFirst BCBS',
+]
+OTHER_CARRIERS = [
+    'MetLife', 'Met Life Dental', 'Cigna', 'Cigna Dental PPO', 'Aetna', 'Aetna Dental', 'UHC',
+    'United Healthcare', 'UnitedHealthcare Dental', 'Guardian', 'The Guardian Life', 'GEHA', 'G E H A',
+    'Humana', 'Principal', 'Ameritas', 'Sun Life', 'Liberty Dental', 'Careington', 'United Concordia',
+    'Dominion Dental', 'Health Partners of {state}', 'HealthPartners', 'Network Health Wisconsin',
+    'Network Health', 'CCPOA', 'C C P O A', 'Equitable', 'Manhattan Life', 'Dentaquest', 'UMR', 'MHBP',
+    'Physicians Mutual', 'Mutual of Omaha', 'Teamcare', 'Keenan', 'Standard Insurance', 'AARP',
+    'ADN Administrators', 'Beam', 'Automated Benefit Services', 'Medical Mutual', 'Blue Care Dental',
+    'Say Cheese Dental', 'Community Dental', 'Plan for Health', 'United States Army', 'UCCI',
+    'Conversion Default (Primary)',
+]
+UNKNOWN_CARRIERS = ['{word} Benefits', '{word} Dental Plan', '{word} Health Inc', '{word} Administrators']
+UNKNOWN_WORDS = ['Acme', 'Summit', 'Pioneer', 'Harbor', 'Keystone', 'Evergreen', 'Lakeshore', 'Frontier']
+SPECIAL_VALUES = ['No Insurance', 'NO INSURANCE', 'PATIENT NOT FOUND', 'patient not found', 'Duplicate',
+                  'No Patient Chart', '']
+
+# (templates, share of distinct names)
+CARRIER_GROUPS = [
+    (DELTA_DENTAL, 0.35),
+    (BCBS, 0.25),
+    (OTHER_CARRIERS, 0.30),
+    (UNKNOWN_CARRIERS, 0.06),
+    (SPECIAL_VALUES, 0.04),
+]
+
+
+def _phone(rng):
+    return f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+
+
+def _decorate(name, rng):
+    """Add the noise seen in real exports to a carrier name"""
+    roll = rng.random()
+    if roll < 0.30:
+        name = f"{name} Ph# {_phone(rng)}"
+    elif roll < 0.35:
+        name = f"{name} Ph#{_phone(rng)}"
+    roll = rng.random()
+    if roll < 0.10:
+        name = f"{name} (Primary)"
+    elif roll < 0.18:
+        name = f"{name} Secondary"
+    elif roll < 0.20:
+        name = f"Primary {name}"
+    roll = rng.random()
+    if roll < 0.05:
+        name = name.upper()
+    elif roll < 0.10:
+        name = name.lower()
+    elif roll < 0.15:
+        name = f" {name}  "
+    return name
+
+
+def generate_names(distinct, seed=0):
+    """distinct different Insurance strings"""
+    rng = random.Random(seed)
+    names = set()
+    attempts = 0
+    while len(names) < distinct and attempts < distinct * 50:
+        attempts += 1
+        templates = rng.choices([group for group, _ in CARRIER_GROUPS],
+                                weights=[share for _, share in CARRIER_GROUPS])[0]
+        abbr, state = rng.choice(STATES)
+        name = rng.choice(templates).format(state=state, abbr=abbr, word=rng.choice(UNKNOWN_WORDS))
+        if templates is not SPECIAL_VALUES:
+            name = _decorate(name, rng)
+        names.add(name)
+    return sorted(names)
+
+
+def generate_corpus(rows, distinct, seed=0, missing=0.01, skew=1.1):
+    """An object Series of rows Insurance values drawn from distinct names
+
+    Names are drawn with Zipf-like frequencies (rank ** -skew), so a few
+    carriers make up most rows as in real data; a missing fraction of rows
+    is NaN.
+    """
+    names = generate_names(distinct, seed)
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(names) + 1) ** skew
+    order = rng.permutation(len(names))
+    values = np.array(names, dtype=object)[order][rng.choice(len(names), size=rows, p=weights / weights.sum())]
+    values[rng.random(rows) < missing] = np.nan
+    return pd.Series(values, name='Insurance', dtype=object)
+
+
+def generate_state_suffixes(rows, seed=0):
+    """Strings like the state suffixes passed to expand_state_abbreviations"""
+    rng = random.Random(seed)
+    forms = ['{abbr}', 'of {abbr}', '{state}', 'of {state}', '{abbr} PPO', '{abbr_lower}', 'Plan {abbr}']
+    values = []
+    for _ in range(rows):
+        abbr, state = rng.choice(STATES)
+        values.append(rng.choice(forms).format(abbr=abbr, state=state, abbr_lower=abbr.lower()))
+    return pd.Series(values, dtype=object)
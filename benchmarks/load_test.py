@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Load test for the web app's /upload, /execute, /switch_sheet and /export routes
+
+Simulated users each upload a generated workbook, run a list of
+instructions, switch between sheets and export, all at the same time.
+Every route is driven as its own phase, so its latency percentiles,
+requests per second and the peak RSS while it ran are reported separately:
+
+    python benchmarks/load_test.py --users 4 --rows 50000 --sheets 3
+    python benchmarks/load_test.py --target server --users 8 --output run.json
+    python benchmarks/load_test.py --url http://localhost:5001 --pid <server pid>
+
+Targets:
+  client   Flask test client in this process (default; no sockets)
+  server   threaded WSGI server on a local port in this process, over HTTP
+  --url    an app already running elsewhere; pass --pid to sample its RSS
+           (child processes included)
+
+Instructions run in the foreground: unless BACKGROUND_JOB_ROWS is already
+set, in-process targets raise it above any sheet size. Workbooks are
+uploaded with the same bytes unless --unique-files is given, so after the
+first upload the workbook cache serves every parse.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from insurance_corpus import generate_corpus
+
+ROUTES = ['upload', 'execute', 'switch_sheet', 'export']
+INSTRUCTIONS = [
+    'show first 10 rows',
+    'show data info',
+    'count insurance types',
+    'filter by office North',
+    'count appointments per month',
+    'generate summary report',
+    'reformat insurance column',
+]
+OFFICES = ['North', 'South', 'East', 'West', 'Downtown', 'Lakeside']
+PROVIDERS = [f"Dr {name}" for name in ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes']]
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def generate_sheet(rows, columns, seed=0):
+    """An appointment export with rows rows and at least 5 columns"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Patient ID': rng.integers(1, max(rows // 3, 2), size=rows),
+        'Appoinment Date': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365, size=rows), unit='D'),
+        'Office Name': rng.choice(OFFICES, size=rows),
+        'Provider Name': rng.choice(PROVIDERS, size=rows),
+        'Insurance': generate_corpus(rows, min(5000, max(rows // 10, 50)), seed=seed).to_numpy(),
+    })
+    for number in range(1, columns - len(df.columns) + 1):
+        df[f'Amount {number}'] = rng.gamma(2.0, 60.0, size=rows).round(2)
+    return df
+
+
+def generate_workbook(rows, sheets, columns, seed=0):
+    """xlsx bytes with sheets sheets of rows rows each"""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for number in range(sheets):
+            generate_sheet(rows, columns, seed=seed + number).to_excel(writer, sheet_name=f'Sheet{number + 1}',
+                                                                       index=False)
+    return buffer.getvalue()
+
+
+def rss_bytes(pid):
+    """Resident memory of pid and all its descendants, or None"""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                try:
+                    with open(f'/proc/{current}/task/{task}/children') as f:
+                        pending.extend(int(child) for child in f.read().split())
+                except OSError:
+                    pass
+    except (OSError, ValueError):
+        return total or None
+    return total
+
+
+class RssSampler:
+    """Polls a process tree's RSS in the background and keeps the peak"""
+
+    def __init__(self, pid, interval=0.01):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = rss_bytes(self.pid)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        rss = rss_bytes(self.pid)
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+
+class TestClientUser:
+    """One browser session driven through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def upload(self, workbook, filename):
+        response = self.client.post('/upload', data={'file': (io.BytesIO(workbook), filename)},
+                                    content_type='multipart/form-data')
+        return response.status_code, len(response.get_data())
+
+    def post_form(self, path, form):
+        response = self.client.post(path, data=form)
+        return response.status_code, len(response.get_data())
+
+    def post_json(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code, len(response.get_data())
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the route itself, not the page it redirects to
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpUser:
+    """One browser session driven over HTTP, with its own cookie jar"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def _send(self, path, body, content_type):
+        request = urllib.request.Request(self.base_url + path, data=body, headers={'Content-Type': content_type})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+    def upload(self, workbook, filename):
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\n'.encode(),
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+            f'Content-Type: {XLSX_MIMETYPE}\r\n\r\n'.encode(),
+            workbook,
+            f'\r\n--{boundary}--\r\n'.encode(),
+        ])
+        return self._send('/upload', body, f'multipart/form-data; boundary={boundary}')
+
+    def post_form(self, path, form):
+        return self._send(path, urllib.parse.urlencode(form).encode(), 'application/x-www-form-urlencoded')
+
+    def post_json(self, path, payload):
+        return self._send(path, json.dumps(payload).encode(), 'application/json')
+
+
+class Recorder:
+    """Latencies of every request, grouped by route and instruction"""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def time(self, route, call, label=None):
+        start = time.perf_counter()
+        try:
+            status, size = call()
+        except Exception as e:
+            status, size = repr(e), 0
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.append((route, label, elapsed, status, size))
+
+
+def summarize(latencies, errors, wall_seconds):
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(latencies) else (np.nan,) * 3
+    return {
+        'requests': int(len(latencies)),
+        'errors': errors,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'requests_per_second': len(latencies) / wall_seconds if wall_seconds else None,
+    }
+
+
+def _user_steps(route, user, number, args, workbooks, sheet_names):
+    """Calls one user makes in a phase, as (label, call) pairs"""
+    if route == 'upload':
+        workbook = workbooks[number % len(workbooks)]
+        return [(None, lambda: user.upload(workbook, f'load_test_{number}.xlsx'))]
+    steps = []
+    for iteration in range(args.iterations):
+        if route == 'execute':
+            steps.extend((instruction, lambda instruction=instruction: user.post_form(
+                '/execute', {'instruction': instruction})) for instruction in args.instructions)
+        elif route == 'switch_sheet':
+            steps.extend((None, lambda sheet=sheet: user.post_json('/switch_sheet', {'sheet': sheet}))
+                         for sheet in sheet_names[1:] + sheet_names[:1])
+        else:
+            steps.append((None, lambda: user.post_form('/export', {'format': args.export_format,
+                                                                   'filename': f'load_test_{number}'})))
+    return steps
+
+
+def run_phase(route, users, args, workbooks, sheet_names, pid, quiet):
+    recorder = Recorder()
+
+    def drive(number, user):
+        with quiet():
+            for label, call in _user_steps(route, user, number, args, workbooks, sheet_names):
+                recorder.time(route, call, label)
+
+    threads = [threading.Thread(target=drive, args=(number, user)) for number, user in enumerate(users)]
+    with RssSampler(pid) as sampler:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+    failed = [sample for sample in recorder.samples if not isinstance(sample[3], int) or sample[3] >= 400]
+    result = summarize([sample[2] for sample in recorder.samples], len(failed), wall)
+    result.update({'route': route, 'seconds': wall, 'peak_rss_mb': sampler.peak / 2 ** 20 if sampler.peak else None,
+                   'response_mb': sum(sample[4] for sample in recorder.samples) / 2 ** 20})
+    if failed:
+        result['first_error'] = str(failed[0][3])
+    if route == 'execute':
+        result['instructions'] = {
+            instruction: summarize([s[2] for s in recorder.samples if s[1] == instruction],
+                                   sum(1 for s in failed if s[1] == instruction), None)
+            for instruction in args.instructions
+        }
+    return result
+
+
+def print_result(result):
+    rss = f"{result['peak_rss_mb']:8.0f} MB" if result['peak_rss_mb'] else '       n/a'
+    print(f"{result['route']:13} {result['requests']:>6} {result['errors']:>6} {result['p50_ms']:9.1f} "
+          f"{result['p95_ms']:9.1f} {result['p99_ms']:9.1f} {result['requests_per_second']:8.2f} {rss}")
+    for instruction, stats in result.get('instructions', {}).items():
+        print(f"  {instruction[:30]:30} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f}")
+    if 'first_error' in result:
+        print(f"  ⚠️ {result['errors']} failed, first: {result['first_error']}")
+
+
+def _import_app(session_root):
+    # Keep this run's sessions and parsed sheets out of the app's defaults
+    os.environ.setdefault('SESSION_DIR', os.path.join(session_root, 'sessions'))
+    os.environ.setdefault('WORKBOOK_CACHE_DIR', os.path.join(session_root, 'workbook_cache'))
+    os.environ.setdefault('BACKGROUND_JOB_ROWS', str(2 ** 62))
+    import web_excel_automation
+    return web_excel_automation.app
+
+
+def _start_server(app, null):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from job_queue import capture_output
+
+    class QuietHandler(WSGIRequestHandler):
+        def handle(self):
+            with capture_output(null):
+                super().handle()
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--target', choices=['client', 'server'], default='client')
+    parser.add_argument('--url', help='base URL of a running app (overrides --target)')
+    parser.add_argument('--pid', type=int, help='process whose RSS to sample with --url')
+    parser.add_argument('--users', type=int, default=4, help='concurrent sessions')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='rounds of instructions, sheet switches and exports per user')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per sheet')
+    parser.add_argument('--sheets', type=int, default=3)
+    parser.add_argument('--columns', type=int, default=8, help='columns per sheet (at least 5)')
+    parser.add_argument('--workbook', help='upload this xlsx file instead of a generated one')
+    parser.add_argument('--unique-files', action='store_true',
+                        help='give every user a different workbook so no upload hits the workbook cache')
+    parser.add_argument('--instruction', dest='instructions', action='append',
+                        help='instruction to run (repeatable; defaults to a mix of read-only and mutating ones)')
+    parser.add_argument('--export-format', default='xlsx')
+    parser.add_argument('--routes', type=lambda text: text.split(','), default=ROUTES,
+                        help=f"comma-separated routes to drive after upload ({','.join(ROUTES[1:])})")
+    parser.add_argument('--timeout', type=float, default=600, help='HTTP timeout in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    args.instructions = args.instructions or INSTRUCTIONS
+
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+    if args.columns < 5:
+        parser.error('--columns must be at least 5')
+
+    start = time.perf_counter()
+    if args.workbook:
+        with open(args.workbook, 'rb') as f:
+            workbooks = [f.read()]
+    else:
+        count = args.users if args.unique_files else 1
+        workbooks = [generate_workbook(args.rows, args.sheets, args.columns, seed=args.seed + number * args.sheets)
+                     for number in range(count)]
+    sheet_names = pd.ExcelFile(io.BytesIO(workbooks[0]), engine='openpyxl').sheet_names
+    print(f"📄 {len(workbooks)} workbook(s), {len(sheet_names)} sheets, {len(workbooks[0]) / 2 ** 20:.1f} MB "
+          f"(generated in {time.perf_counter() - start:.1f} s)")
+
+    with tempfile.TemporaryDirectory(prefix='load_test_') as root, open(os.devnull, 'w') as null:
+        server = None
+        if args.url:
+            target, pid = args.url, args.pid
+            users = [HttpUser(args.url, args.timeout) for _ in range(args.users)]
+            quiet = nullcontext
+        else:
+            app = _import_app(root)
+            from job_queue import capture_output
+            quiet = lambda: capture_output(null)
+            pid = os.getpid()
+            if args.target == 'server':
+                server, target = _start_server(app, null)
+                users = [HttpUser(target, args.timeout) for _ in range(args.users)]
+            else:
+                target = 'test client'
+                users = [TestClientUser(app) for _ in range(args.users)]
+
+        print(f"🚀 {args.users} users against {target}, {args.iterations} iterations\n")
+        print(f"{'route':13} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'req/s':>8} {'peak RSS':>11}")
+        results = []
+        try:
+            for route in ['upload'] + [route for route in ROUTES[1:] if route in args.routes]:
+                result = run_phase(route, users, args, workbooks, sheet_names, pid, quiet)
+                print_result(result)
+                results.append(result)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    if args.output:
+        report = {
+            'metadata': {
+                'commit': git_commit(),
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'target': target,
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'args': {key: value for key, value in vars(args).items() if key != 'output'},
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Caches for dynamically generated instruction code
+"""
+
+import hashlib
+import re
+
+from lru import LRUCache
+
+
+class CompiledCodeCache:
+    """Content-hashed cache of compile()d code objects"""
+
+    def __init__(self, maxsize=256):
+        self._cache = LRUCache(maxsize)
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def compile(self, source, filename='<generated>'):
+        """Return the code object for source, compiling it only on a miss"""
+        key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        return self._cache.get_or_compute(key, lambda _: compile(source, filename, 'exec'))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def normalize_instruction(instruction):
+    """Lowercase and collapse whitespace so equivalent prompts share a key"""
+    return re.sub(r'\s+', ' ', instruction.strip().lower())
+
+
+def schema_fingerprint(df):
+    """Hash of column names and dtypes; generated code depends on these only"""
+    schema = '\x1f'.join(f"{column}\x1e{dtype}" for column, dtype in df.dtypes.items())
+    return hashlib.sha256(schema.encode('utf-8')).hexdigest()
+
+
+class GeneratedCodeCache:
+    """Maps (normalized instruction, schema fingerprint) to AI-generated code"""
+
+    def __init__(self, maxsize=512):
+        self._cache = LRUCache(maxsize)
+
+    @staticmethod
+    def key(instruction, df):
+        return normalize_instruction(instruction), schema_fingerprint(df)
+
+    def get(self, instruction, df):
+        return self._cache.get(self.key(instruction, df))
+
+    def put(self, instruction, df, code):
+        self._cache.put(self.key(instruction, df), code)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Registry of built-in instruction handlers
+Handlers are plain callables taking (df, params), defined once at import
+"""
+
+from sheet_stats import SheetStats
+
+
+class Command:
+    """An instruction resolved to a registered handler and its parameters"""
+
+    def __init__(self, name, handler, params, mutates=False, uses_stats=False, heavy=False):
+        self.name = name
+        self.handler = handler
+        self.params = params
+        self.mutates = mutates
+        self.uses_stats = uses_stats
+        self.heavy = heavy
+
+    def __call__(self, df, stats=None):
+        """Run the handler; stats-using handlers get stats, or fresh ones for df"""
+        if self.uses_stats:
+            return self.handler(df, self.params, stats if stats is not None else SheetStats(df))
+        return self.handler(df, self.params)
+
+    def __repr__(self):
+        params = ', '.join(f"{key}={value!r}" for key, value in self.params.items())
+        return f"{self.name}({params})"
+
+
+class CommandRegistry:
+    """Maps command names to handlers"""
+
+    def __init__(self):
+        self._handlers = {}
+
+    def __contains__(self, name):
+        return name in self._handlers
+
+    def names(self):
+        return list(self._handlers)
+
+    def register(self, name, mutates=False, uses_stats=False, heavy=False):
+        """Decorator registering handler(df, params) under name
+
+        Set mutates=True for handlers that modify the DataFrame they receive,
+        and heavy=True for ones that work through every row of a big sheet.
+        Handlers registered with uses_stats=True are called as
+        handler(df, params, stats) with the sheet's cached SheetStats.
+        """
+        def decorator(handler):
+            if name in self._handlers:
+                raise ValueError(f"Command '{name}' is already registered")
+            self._handlers[name] = (handler, mutates, uses_stats, heavy)
+            return handler
+        return decorator
+
+    def command(self, name, **params):
+        """Bind parameters to the handler registered under name"""
+        handler, mutates, uses_stats, heavy = self._handlers[name]
+        return Command(name, handler, params, mutates, uses_stats, heavy)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Ingest-time dtype optimization
+Low-cardinality text columns become categoricals, integers are downcast and
+known date columns are parsed once, so sheets stay small in memory and
+counting/grouping runs on integer codes.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Text columns whose distinct values are at most this fraction of their
+# non-null values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Columns parsed to datetime64 when they were read as text
+DATE_COLUMNS = ('Appoinment Date',)
+
+
+class DtypeReport:
+    """Columns converted for one sheet and the memory saved"""
+
+    def __init__(self, before_bytes, after_bytes, conversions):
+        self.before_bytes = before_bytes
+        self.after_bytes = after_bytes
+        self.conversions = conversions
+
+    @property
+    def saved_bytes(self):
+        return self.before_bytes - self.after_bytes
+
+    def as_dict(self):
+        return dict(vars(self), saved_bytes=self.saved_bytes)
+
+    def __str__(self):
+        saved = self.saved_bytes / self.before_bytes if self.before_bytes else 0.0
+        return (f"{self.before_bytes / 1e6:.1f} → {self.after_bytes / 1e6:.1f} MB "
+                f"(-{saved:.0%}) after dtype optimization")
+
+
+def _as_category(column):
+    if column.dtype != object or pd.api.types.infer_dtype(column, skipna=True) != 'string':
+        return None
+    values = column.dropna()
+    uniques = pd.unique(values)
+    if len(uniques) > CATEGORY_MAX_RATIO * len(values):
+        return None
+    # Categories in order of first appearance, so value_counts() breaks
+    # ties in the same order it does for object columns
+    return column.astype(pd.CategoricalDtype(uniques))
+
+
+def _as_smaller_int(column):
+    if not (isinstance(column.dtype, np.dtype) and column.dtype.kind == 'i' and column.dtype.itemsize > 4):
+        return None
+    downcast = pd.to_numeric(column, downcast='integer')
+    # Never below int32: instruction code doing arithmetic on int8/int16
+    # columns would overflow silently
+    if downcast.dtype.itemsize < 4:
+        downcast = downcast.astype(np.int32)
+    return downcast if downcast.dtype != column.dtype else None
+
+
+def _as_datetime(column):
+    if column.dtype != object:
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return pd.to_datetime(column)
+    except (ValueError, TypeError, OverflowError):
+        # Keep text that isn't entirely dates rather than losing values to NaT
+        return None
+
+
+def optimize_dtypes(df):
+    """Return (optimized shallow copy of df, DtypeReport)
+
+    Floats are left at float64: float32 would change printed values.
+    """
+    before_bytes = int(df.memory_usage(deep=True).sum())
+    optimized = df.copy(deep=False)
+    conversions = {}
+
+    for position, name in enumerate(df.columns):
+        column = df.iloc[:, position]
+        if name in DATE_COLUMNS:
+            converted = _as_datetime(column)
+        else:
+            converted = _as_category(column)
+            if converted is None:
+                converted = _as_smaller_int(column)
+        if converted is not None:
+            optimized.isetitem(position, converted)
+            conversions[str(name)] = str(converted.dtype)
+
+    after_bytes = int(optimized.memory_usage(deep=True).sum())
+    return optimized, DtypeReport(before_bytes, after_bytes, conversions)
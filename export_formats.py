@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Export formats for processed workbooks
+xlsx for people; gzip CSV, Parquet and Arrow IPC for pipelines that read the
+data back into pandas. Every format is streamed a chunk at a time, and
+non-xlsx exports of multi-sheet workbooks become a zip of per-sheet files.
+"""
+
+import gzip
+import os
+import re
+import time
+import zipfile
+
+import pandas as pd
+
+from workbook_writer import XLSX_MIMETYPE, ChunkBuffer, iter_xlsx
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Rows encoded per CSV chunk, Parquet row group and Arrow record batch
+EXPORT_CHUNK_ROWS = 65536
+
+# gzip level for CSV; 1 is several times faster than 9 for ~20% more bytes
+CSV_GZIP_LEVEL = 1
+
+
+class ExportFormat:
+    def __init__(self, name, extension, mimetype, encode=None, zip_compression=zipfile.ZIP_DEFLATED):
+        self.name = name
+        self.extension = extension
+        self.mimetype = mimetype
+        # encode(df, buffer) yields after writing each chunk into buffer
+        self.encode = encode
+        self.zip_compression = zip_compression
+
+
+class ExportReport:
+    """Bytes written and time spent encoding one export"""
+
+    def __init__(self, export_format, sheets):
+        self.format = export_format
+        self.sheets = sheets
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return (f"{self.format}: {self.sheets} sheet(s), {self.bytes / 1e6:.2f} MB "
+                f"encoded in {self.seconds:.2f}s")
+
+
+def _arrow_schema(df):
+    """Arrow schema for df and the positions of columns written as text
+
+    Types come from whole columns, so every batch converted from a slice of
+    df matches the schema. Object columns Arrow cannot represent (e.g.
+    numbers mixed with text) are written as text. Only object columns that
+    aren't plain text are converted while checking, one at a time.
+    """
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    text_columns = set()
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if column.dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(column, skipna=True)
+        if inferred in ('string', 'empty'):
+            arrow_type = pa.string() if inferred == 'string' else pa.null()
+        else:
+            try:
+                arrow_type = pa.array(column, from_pandas=True).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                text_columns.add(position)
+                arrow_type = pa.string()
+        schema = schema.set(position, schema.field(position).with_type(arrow_type))
+    return schema, text_columns
+
+
+def _arrow_batches(df, schema, text_columns):
+    """df as record batches of EXPORT_CHUNK_ROWS rows, converted one at a time"""
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        arrays = []
+        for position, field in enumerate(schema):
+            column = chunk.iloc[:, position]
+            if position in text_columns:
+                column = column.where(column.isna(), column.astype(str))
+            arrays.append(pa.array(column, type=field.type, from_pandas=True))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _encode_csv(df, buffer):
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        buffer.write(chunk.to_csv(index=False, header=start == 0).encode('utf-8'))
+        yield
+
+
+def _encode_csv_gzip(df, buffer):
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=CSV_GZIP_LEVEL, mtime=0) as f:
+        yield from _encode_csv(df, f)
+    yield
+
+
+def _encode_parquet(df, buffer):
+    schema, text_columns = _arrow_schema(df)
+    with pq.ParquetWriter(buffer, schema, compression='snappy') as writer:
+        for batch in _arrow_batches(df, schema, text_columns):
+            writer.write_batch(batch)
+            yield
+    yield
+
+
+def _encode_arrow(df, buffer):
+    schema, text_columns = _arrow_schema(df)
+    with pa.ipc.new_file(pa.PythonFile(buffer, mode='w'), schema) as writer:
+        for batch in _arrow_batches(df, schema, text_columns):
+            writer.write_batch(batch)
+            yield
+    yield
+
+
+EXPORT_FORMATS = {
+    'xlsx': ExportFormat('xlsx', '.xlsx', XLSX_MIMETYPE),
+    'csv': ExportFormat('csv', '.csv.gz', 'application/gzip', _encode_csv_gzip),
+    'parquet': ExportFormat('parquet', '.parquet', 'application/vnd.apache.parquet', _encode_parquet,
+                            zip_compression=zipfile.ZIP_STORED),
+    'arrow': ExportFormat('arrow', '.arrow', 'application/vnd.apache.arrow.file', _encode_arrow),
+}
+
+# Inside a zip, CSV members are deflated by the zip itself
+_ZIPPED_CSV = ExportFormat('csv', '.csv', 'text/csv', _encode_csv)
+
+
+def get_export_format(name):
+    """Look up an export format, raising ValueError for unknown or unavailable ones"""
+    export_format = EXPORT_FORMATS.get((name or 'xlsx').lower())
+    if export_format is None:
+        raise ValueError(f"Unknown export format '{name}'. Choose from: {', '.join(EXPORT_FORMATS)}")
+    if export_format.name in ('parquet', 'arrow') and not HAS_PYARROW:
+        raise ValueError(f"The {export_format.name} format requires pyarrow")
+    return export_format
+
+
+def is_zipped(export_format, workbook):
+    return export_format.name != 'xlsx' and len(workbook) > 1
+
+
+def export_extension(export_format, workbook):
+    return '.zip' if is_zipped(export_format, workbook) else export_format.extension
+
+
+def export_mimetype(export_format, workbook):
+    return 'application/zip' if is_zipped(export_format, workbook) else export_format.mimetype
+
+
+def export_filename(filename, export_format, workbook):
+    """Give filename the extension the export will actually have"""
+    extension = export_extension(export_format, workbook)
+    if filename.lower().endswith(extension):
+        return filename
+    stem = re.sub(r'(\.csv\.gz|\.xlsx|\.csv|\.parquet|\.arrow|\.zip)$', '', filename, flags=re.I)
+    return stem + extension
+
+
+def _member_names(sheet_names, extension):
+    """Unique, filesystem-safe zip member names for sheets"""
+    names = []
+    for sheet_name in sheet_names:
+        stem = re.sub(r'[^\w\- .]', '_', str(sheet_name)).strip() or 'sheet'
+        name, suffix = stem + extension, 2
+        while name in names:
+            name, suffix = f"{stem}_{suffix}{extension}", suffix + 1
+        names.append(name)
+    return names
+
+
+def _iter_encoded(df, encode):
+    buffer = ChunkBuffer()
+    for _ in encode(df, buffer):
+        yield buffer.drain()
+    yield buffer.drain()
+
+
+def _iter_zip(workbook, export_format):
+    if export_format.name == 'csv':
+        export_format = _ZIPPED_CSV
+    sheet_names = list(workbook)
+    buffer = ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for sheet_name, member in zip(sheet_names, _member_names(sheet_names, export_format.extension)):
+            df = workbook[sheet_name]
+            info = zipfile.ZipInfo(member, date_time=time.localtime()[:6])
+            info.compress_type = export_format.zip_compression
+            with archive.open(info, 'w', force_zip64=df.size * 64 > 1 << 30) as entry:
+                for _ in export_format.encode(df, entry):
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def _iter_chunks(workbook, export_format, source_path, modified_sheets):
+    if export_format.name == 'xlsx':
+        return iter_xlsx(workbook, source_path=source_path, modified_sheets=modified_sheets)
+    if is_zipped(export_format, workbook):
+        return _iter_zip(workbook, export_format)
+    return _iter_encoded(workbook[next(iter(workbook))], export_format.encode)
+
+
+def iter_export(workbook, export_format, source_path=None, modified_sheets=(), on_complete=None):
+    """Yield the workbook encoded in export_format as byte chunks
+
+    When the last chunk has been produced, on_complete(report) is called
+    with the bytes written and the time spent encoding, which excludes time
+    spent waiting on the consumer (e.g. a slow client).
+    """
+    report = ExportReport(export_format.name, len(workbook))
+    chunks = _iter_chunks(workbook, export_format, source_path, modified_sheets)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            report.seconds += time.perf_counter() - start
+        if chunk:
+            report.bytes += len(chunk)
+            yield chunk
+
+    if on_complete:
+        on_complete(report)
+
+
+def write_export(workbook, path, export_format, source_path=None, modified_sheets=()):
+    """Write an export to path and return its ExportReport"""
+    reports = []
+    with open(path + '.tmp', 'wb') as f:
+        for chunk in iter_export(workbook, export_format, source_path, modified_sheets, reports.append):
+            f.write(chunk)
+    os.replace(path + '.tmp', path)
+    return reports[0]
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Values pulled out of instruction text
+Shared by both apps so they read filters, dates and row counts the same way.
+"""
+
+import re
+
+import pandas as pd
+
+# Instruction keywords naming indexed filter columns, most specific first
+FILTER_COLUMNS = (
+    ('insurance new', 'Insurance New'),
+    ('insurance', 'Insurance'),
+    ('office', 'Office Name'),
+    ('provider', 'Provider Name'),
+)
+
+
+def extract_filter(text):
+    """(column, value, explicit) from e.g. "filter by office north"
+
+    value is None if not given; explicit is True if it follows =, :, is or
+    by, and otherwise it may just be more words of the instruction.
+    """
+    for keyword, column in FILTER_COLUMNS:
+        match = re.search(rf"\b{keyword}\b(?:\s+name)?\s*(?:(=|:|\bis\b|\bby\b)\s*)?(.*)$", text)
+        if match:
+            return column, match.group(2).strip().strip('\'"').strip() or None, bool(match.group(1))
+    return None, None, False
+
+
+def extract_dates(text):
+    """Dates written as YYYY-MM-DD or M/D/YYYY in text, in order"""
+    return [pd.Timestamp(match) for match in re.findall(r'\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4}', text)]
+
+
+def extract_number(text):
+    """Extract number from text"""
+    numbers = re.findall(r'\d+', text)
+    return int(numbers[0]) if numbers else None
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of instruction execution
+A profiled block runs either under cProfile, saved as a .pstats file for
+pstats/snakeviz, or under a sampling profiler that records the thread's
+stack every millisecond, saved in speedscope's JSON format. Nothing is
+installed unless a block is profiled.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_FORMATS = {
+    'pstats': '.pstats',
+    'speedscope': '.speedscope.json',
+}
+
+SAMPLE_INTERVAL = 0.001
+
+
+def get_profile_format(value):
+    """Profile format requested by a header or form value, or None
+
+    '1', 'true', 'yes' and 'on' mean pstats.
+    """
+    value = (value or '').strip().lower()
+    if value in ('1', 'true', 'yes', 'on', 'cprofile'):
+        return 'pstats'
+    return value if value in PROFILE_FORMATS else None
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread
+
+    Each sample is weighted by the time since the previous one, so stacks
+    that hold the GIL for a long stretch (e.g. inside pandas) still get
+    their share even though the sampler could not run meanwhile.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.frames = []
+        self.samples = []
+        self.weights = []
+        self._frame_index = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _frame(self, code):
+        # co_qualname is new in Python 3.11
+        key = (getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+        return index
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(self._frame(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples.append(stack[::-1])
+                self.weights.append(now - last)
+            last = now
+
+    def speedscope(self, name):
+        """The samples as a speedscope file (https://www.speedscope.app)"""
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(self.weights),
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+            'name': name,
+            'exporter': 'instruction_profiler',
+        }
+
+
+class ProfileResult:
+    """Where a profile was saved and a short text summary of it"""
+
+    def __init__(self, path, profile_format, seconds, summary):
+        self.path = path
+        self.profile_format = profile_format
+        self.seconds = seconds
+        self.summary = summary
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+    def __str__(self):
+        return f"🔬 Profiled in {self.seconds:.2f}s ({self.profile_format}): {self.filename}"
+
+
+def _top_functions(profile, limit):
+    buffer = io.StringIO()
+    stats = pstats.Stats(profile, stream=buffer)
+    stats.sort_stats('cumulative').print_stats(limit)
+    # Drop the header pstats prints before the table
+    lines = buffer.getvalue().strip().splitlines()
+    start = next((index for index, line in enumerate(lines) if line.lstrip().startswith('ncalls')), 0)
+    return '\n'.join(lines[start:])
+
+
+def _top_frames(sampler, limit):
+    # Inclusive time per frame, counted once per sample
+    totals = {}
+    for stack, weight in zip(sampler.samples, sampler.weights):
+        for index in set(stack):
+            totals[index] = totals.get(index, 0.0) + weight
+    top = sorted(totals.items(), key=lambda item: -item[1])[:limit]
+    return '\n'.join(f"{seconds:9.3f}s  {sampler.frames[index]['name']} "
+                     f"({os.path.basename(sampler.frames[index]['file'])}:{sampler.frames[index]['line']})"
+                     for index, seconds in top)
+
+
+@contextmanager
+def profiled(profile_format, path, name='instruction', top=15):
+    """Profile the block on this thread and save the result to path
+
+    Yields a ProfileResult whose summary (the slowest functions by
+    cumulative time) is filled in when the block exits, even if it raises.
+    """
+    result = ProfileResult(path, profile_format, 0.0, '')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    start = time.perf_counter()
+    if profile_format == 'speedscope':
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield result
+        finally:
+            sampler.stop()
+            result.seconds = time.perf_counter() - start
+            with open(path, 'w') as f:
+                json.dump(sampler.speedscope(name), f)
+            result.summary = _top_frames(sampler, top)
+    else:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one cProfile per process at a time
+            raise RuntimeError("Another instruction is being profiled; try again when it finishes") from None
+        try:
+            yield result
+        finally:
+            profile.disable()
+            result.seconds = time.perf_counter() - start
+            profile.dump_stats(path)
+            result.summary = _top_functions(profile, top)
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Insurance name normalization
+Carrier patterns are compiled once at import time into an ordered rule table
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+
+from lru import LRUCache
+
+# Normalized strings kept per normalizer across requests
+NORMALIZED_CACHE_SIZE = 20000
+
+# Columns with at least this many distinct uncached values are normalized
+# across NORMALIZE_WORKERS processes; below it, process startup and
+# pickling cost more than they save
+PARALLEL_THRESHOLD = int(os.environ.get('NORMALIZE_PARALLEL_THRESHOLD', 20000))
+NORMALIZE_WORKERS = int(os.environ.get('NORMALIZE_WORKERS', os.cpu_count() or 1))
+
+# State abbreviations mapping
+STATE_ABBREVIATIONS = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AR': 'Arkansas', 'AZ': 'Arizona',
+    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
+    'DC': 'District of Columbia', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
+    'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine',
+    'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
+    'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska',
+    'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico',
+    'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
+    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island',
+    'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas',
+    'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
+    'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'
+}
+
+# All abbreviations in one alternation so expansion is a single scan
+_STATE_PATTERN = re.compile(r'\b(' + '|'.join(STATE_ABBREVIATIONS) + r')\b', re.IGNORECASE)
+
+
+def _full_state_name(match):
+    abbr = match.group(1)
+    full_name = STATE_ABBREVIATIONS.get(abbr.upper())
+    if full_name is None:
+        # IGNORECASE also folds a few non-ASCII letters (e.g. the Kelvin sign)
+        # that str.upper() leaves alone
+        full_name = next(
+            name for key, name in STATE_ABBREVIATIONS.items()
+            if re.fullmatch(key, abbr, re.IGNORECASE)
+        )
+    return full_name
+
+
+def expand_state_abbreviations(text):
+    """Expand state abbreviations to full state names"""
+    if pd.isna(text):
+        return text
+
+    # Look for state abbreviations (2 letters at word boundaries)
+    return _STATE_PATTERN.sub(_full_state_name, str(text))
+
+
+def _compile(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# Special cases and Primary/Secondary cleanup
+_NO_PATIENT_CHART = _compile(r'no\s+patient\s+chart')
+_PRIORITY_MARKER = _compile(r'primary|secondary')
+_PRIORITY_CLEANUP = [
+    _compile(r'\s*\(Primary\)'),
+    _compile(r'\s*\(Secondary\)'),
+    _compile(r'\s*Primary'),
+    _compile(r'\s*Secondary'),
+]
+
+# State extraction patterns used by the carrier handlers
+_DELTA_DENTAL_STATE = _compile(r'delta\s+dental\s+(?:of\s+)?(.+)')
+_BLUE_CROSS_BLUE_SHIELD = _compile(r'blue\s+cross\s+blue\s+shield')
+_BLUE_CROSS_BLUE_SHIELD_STATE = _compile(r'blue\s+cross\s+blue\s+shield\s+(?:of\s+)?(.+)')
+_BC_BS = _compile(r'bc/bs')
+_BC_BS_STATE = _compile(r'bc/bs\s+(?:of\s+)?(.+)')
+_BC_OF = _compile(r'bc\s+of')
+_BC_OF_STATE = _compile(r'bc\s+of\s+(.+)')
+_BCBBS = _compile(r'bcbbs')
+_BCBS_STATE = _compile(r'(?:bcbs|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)')
+_BASIC_BCBS_STATE = _compile(r'(?:bcbs|blue\s+cross\s+blue\s+shield|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)')
+_WISCONSIN = _compile(r'wisconsin')
+_HEALTH_PARTNERS_STATE = _compile(r'health\s*partners\s+of\s+(.+)')
+_DD_OF_CODE = _compile(r'dd\s+of\s+([a-z]{2})')
+_DD_CODE = _compile(r'dd\s+([a-z]{2})')
+_DD_STATE_PATTERNS = [
+    _compile(r'delta\s+dental\s+of\s+(.+)'),
+    _compile(r'dental\s+dental\s+of\s+(.+)'),
+    _compile(r'denta\s+dental\s+of\s+(.+)'),
+    _compile(r'dleta\s+dental\s+of\s+(.+)'),
+    _compile(r'dektal?\s+dental\s+of\s+(.+)'),
+    _compile(r'dental\s+of\s+(.+)'),
+]
+_DENTAL_NETWORK_OF_AMERICA = _compile(r'dental\s+network\s+of\s+america')
+
+
+def _state_name(prefix, match):
+    """Format '<prefix> <state>' from a captured state suffix"""
+    state = expand_state_abbreviations(match.group(1).strip())
+    return f"{prefix} {state}"
+
+
+def _delta_dental(company_name):
+    delta_match = _DELTA_DENTAL_STATE.search(company_name)
+    if delta_match:
+        return _state_name("DD", delta_match)
+    return "DD"
+
+
+def _bcbs(company_name):
+    # Check for full "Blue Cross Blue Shield" pattern first
+    if _BLUE_CROSS_BLUE_SHIELD.search(company_name):
+        bcbs_match = _BLUE_CROSS_BLUE_SHIELD_STATE.search(company_name)
+    elif _BC_BS.search(company_name):
+        bcbs_match = _BC_BS_STATE.search(company_name)
+    elif _BC_OF.search(company_name):
+        bcbs_match = _BC_OF_STATE.search(company_name)
+    elif _BCBBS.search(company_name):
+        return "BCBS"
+    else:
+        bcbs_match = _BCBS_STATE.search(company_name)
+
+    if bcbs_match:
+        return _state_name("BCBS", bcbs_match)
+    return "BCBS"
+
+
+def _network_health(company_name):
+    if _WISCONSIN.search(company_name):
+        return "Network Health Wisconsin"
+    return "Network Health Go"
+
+
+def _health_partners(company_name):
+    state_match = _HEALTH_PARTNERS_STATE.search(company_name)
+    if state_match:
+        return f"Health Partners {state_match.group(1).strip()}"
+    return "Health Partners"
+
+
+def _dd_variants(company_name):
+    # Handle DD OF [State] and DD [State] patterns
+    for pattern in (_DD_OF_CODE, _DD_CODE):
+        state_match = pattern.search(company_name)
+        if state_match:
+            state = expand_state_abbreviations(state_match.group(1).upper())
+            return f'DD {state}'
+
+    # Handle "<Delta Dental misspelling> of [State]" patterns
+    for pattern in _DD_STATE_PATTERNS:
+        state_match = pattern.search(company_name)
+        if state_match:
+            return _state_name('DD', state_match)
+
+    if _DENTAL_NETWORK_OF_AMERICA.search(company_name):
+        return 'DD Network of America'
+    return 'DD'
+
+
+# Ordered carrier rules: the first pattern found anywhere in the cleaned
+# company name wins. The result is either a fixed name or a handler that
+# receives the cleaned company name.
+INSURANCE_RULES = [
+    (r'delta\s+dental', _delta_dental),
+    # Anthem goes before BCBS to avoid conflicts
+    (r'anthem|blue\s+cross.*anthem|anthem.*blue\s+cross', "Anthem"),
+    (r'bcbs|bc/bs|bc\s+of|blue\s+cross|blue\s+shield|bcbbs', _bcbs),
+    (r'metlife|met\s+life', "Metlife"),
+    (r'cigna', "Cigna"),
+    (r'aarp', "AARP"),
+    (r'adn\s+administrators', "ADN Administrators"),
+    (r'beam', "Beam"),
+    (r'uhc|united.*health|united.*heal|unitedhelathcare', "UHC"),
+    (r'teamcare', "Teamcare"),
+    (r'humana', "Humana"),
+    (r'aetna', "Aetna"),
+    (r'guardian', "Guardian"),
+    (r'g\s*e\s*h\s*a', "GEHA"),
+    (r'principal', "Principal"),
+    (r'ameritas', "Ameritas"),
+    (r'physicians\s+mutual', "Physicians Mutual"),
+    (r'mutual\s+of\s+omaha', "Mutual Omaha"),
+    (r'sunlife|sun\s+life', "Sunlife"),
+    (r'liberty(?:\s+dental)?', "Liberty Dental Plan"),
+    (r'careington', "Careington Benefit Solutions"),
+    (r'automated\s+benefit', "Automated Benefit Services Inc"),
+    (r'network\s+health', _network_health),
+    (r'regence', "REGENCE BCBS"),
+    (r'united\s+concordia', "United Concordia"),
+    (r'medical\s+mutual', "Medical Mutual"),
+    (r'blue\s+care\s+dental', "Blue Care Dental"),
+    (r'dominion\s+dental', "Dominion Dental"),
+    (r'carefirst', "CareFirst BCBS"),
+    (r'health\s*partners', _health_partners),
+    (r'keenan', "Keenan"),
+    (r'wilson\s+mcshane', "Wilson McShane- Delta Dental"),
+    (r'standard\s+(?:life\s+)?insurance', "Standard Life Insurance"),
+    (r'plan\s+for\s+health', "Plan for Health"),
+    (r'kansas\s+city', "Kansas City"),
+    (r'the\s+guardian', "The Guardian"),
+    (r'community\s+dental', "Community Dental Associates"),
+    (r'northeast\s+delta\s+dental', "Northeast Delta Dental"),
+    (r'say\s+cheese\s+dental', "Say Cheese Dental Network"),
+    (r'dentaquest', "Dentaquest"),
+    (r'umr', "UMR"),
+    (r'mhbp', "MHBP"),
+    (r'united\s+states\s+army', "United States Army"),
+    (r'conversion\s+default', "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!"),
+    (r'equitable', "Equitable"),
+    (r'manhattan\s+life', "Manhattan Life"),
+    (r'ucci', "UCCI"),
+    (r'ccpoa|cc\s*poa|c\s+c\s+p\s+o\s+a', "CCPOA"),
+    (r'dd\s+of|dd\s+[a-z]{2}|delta\s+dental|dental\s+dental|denta\s+dental|dleta\s+dental|dektal?\s+dental', _dd_variants),
+]
+
+
+def _build_classifier(rules):
+    """Combine the ordered rules into one alternation of lookaheads
+
+    Alternatives are tried in rule order, and each lookahead succeeds when its
+    pattern occurs anywhere in the string, so a single match() reproduces the
+    priority of the original if/elif chain. The empty group after each
+    lookahead names the rule that fired.
+    """
+    branches = [
+        rf'(?=[\s\S]*?(?:{pattern}))(?P<rule{index}>)'
+        for index, (pattern, _) in enumerate(rules)
+    ]
+    return re.compile('|'.join(branches), re.IGNORECASE)
+
+
+_CLASSIFIER = _build_classifier(INSURANCE_RULES)
+_RULE_RESULTS = {f'rule{index}': result for index, (_, result) in enumerate(INSURANCE_RULES)}
+
+
+def _basic_bcbs(company_name):
+    bcbs_match = _BASIC_BCBS_STATE.search(company_name)
+    if bcbs_match:
+        return _state_name("BCBS", bcbs_match)
+    return "BCBS"
+
+
+# Rule set used by the command line tool (AIExcelAutomation)
+BASIC_INSURANCE_RULES = [
+    (r'delta\s+dental', _delta_dental),
+    (r'bcbs|blue\s+cross|blue\s+shield', _basic_bcbs),
+    (r'metlife|met\s+life', "Metlife"),
+    (r'cigna', "Cigna"),
+    (r'aarp', "AARP"),
+    (r'uhc|united\s*healthcare|united\s*health\s*care', "UHC"),
+    (r'teamcare', "Teamcare"),
+    (r'humana', "Humana"),
+    (r'aetna', "Aetna"),
+    (r'guardian', "Guardian"),
+    (r'anthem', "Anthem"),
+    (r'g\s*e\s*h\s*a', "GEHA"),
+    (r'principal', "Principal"),
+    (r'ameritas', "Ameritas"),
+    (r'physicians\s+mutual', "Physicians Mutual"),
+    (r'mutual\s+of\s+omaha', "Mutual Omaha"),
+    (r'sunlife|sun\s+life', "Sunlife"),
+    (r'liberty\s+dental', "Liberty Dental Plan"),
+    (r'careington', "Careington Benefit Solutions"),
+    (r'automated\s+benefit', "Automated Benefit Services Inc"),
+    (r'network\s+health', "Network Health Wisconsin"),
+    (r'regence', "REGENCE BCBS"),
+    (r'united\s+concordia', "United Concordia"),
+    (r'medical\s+mutual', "Medical Mutual"),
+    (r'blue\s+care\s+dental', "Blue Care Dental"),
+    (r'dominion\s+dental', "Dominion Dental"),
+    (r'carefirst', "CareFirst BCBS"),
+    (r'health\s+partners', "Health Partners"),
+    (r'keenan', "Keenan"),
+    (r'wilson\s+mcshane', "Wilson McShane- Delta Dental"),
+    (r'standard\s+(?:life\s+)?insurance', "Standard Life Insurance"),
+    (r'plan\s+for\s+health', "Plan for Health"),
+    (r'kansas\s+city', "Kansas City"),
+    (r'the\s+guardian', "The Guardian"),
+    (r'community\s+dental', "Community Dental Associates"),
+    (r'northeast\s+delta\s+dental', "Northeast Delta Dental"),
+    (r'say\s+cheese\s+dental', "SAY CHEESE DENTAL NETWORK"),
+    (r'dentaquest', "Dentaquest"),
+    (r'umr', "UMR"),
+    (r'mhbp', "MHBP"),
+    (r'united\s+states\s+army', "United States Army"),
+    (r'conversion\s+default', "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!"),
+    (r'equitable', "Equitable"),
+    (r'manhattan\s+life', "Manhattan Life"),
+]
+
+_BASIC_CLASSIFIER = _build_classifier(BASIC_INSURANCE_RULES)
+_BASIC_RULE_RESULTS = {f'rule{index}': result for index, (_, result) in enumerate(BASIC_INSURANCE_RULES)}
+
+
+def _special_case(insurance_str):
+    """Return the fixed value for special markers, or None"""
+    upper_str = insurance_str.upper()
+    if upper_str == 'NO INSURANCE':
+        return 'No Insurance'
+    elif upper_str == 'PATIENT NOT FOUND':
+        return 'PATIENT NOT FOUND'
+    elif upper_str == 'DUPLICATE':
+        return 'DUPLICATE'
+    return None
+
+
+def _company_name(insurance_str):
+    """Strip the phone suffix and Primary/Secondary markers"""
+    # Extract company name before "Ph#"
+    if "Ph#" in insurance_str:
+        company_name = insurance_str.split("Ph#")[0].strip()
+    else:
+        company_name = insurance_str
+
+    # Remove "Primary" and "Secondary" text
+    if _PRIORITY_MARKER.search(company_name):
+        for pattern in _PRIORITY_CLEANUP:
+            company_name = pattern.sub('', company_name)
+
+    return company_name
+
+
+def _classify(company_name, classifier, rule_results):
+    match = classifier.match(company_name)
+    if match:
+        result = rule_results[match.lastgroup]
+        return result(company_name) if callable(result) else result
+
+    # If no specific pattern matches, return the cleaned company name
+    return company_name.strip()
+
+
+def format_insurance_name(insurance_text):
+    """Reformat an Insurance value to match the expected format"""
+    if pd.isna(insurance_text):
+        return insurance_text
+
+    insurance_str = str(insurance_text).strip()
+
+    # Handle special cases first
+    special = _special_case(insurance_str)
+    if special is not None:
+        return special
+    if _NO_PATIENT_CHART.search(insurance_str):
+        return 'No Patient chart'
+
+    return _classify(_company_name(insurance_str), _CLASSIFIER, _RULE_RESULTS)
+
+
+def format_basic_insurance_name(insurance_text):
+    """Reformat an Insurance value using the command line tool's rule set"""
+    if pd.isna(insurance_text):
+        return insurance_text
+
+    insurance_str = str(insurance_text).strip()
+
+    special = _special_case(insurance_str)
+    if special is not None:
+        return special
+
+    return _classify(_company_name(insurance_str), _BASIC_CLASSIFIER, _BASIC_RULE_RESULTS)
+
+
+_normalized_caches = {}
+_normalized_caches_lock = threading.Lock()
+
+
+def normalized_cache(normalizer):
+    """Return the process-wide LRU of normalized strings for a normalizer"""
+    with _normalized_caches_lock:
+        cache = _normalized_caches.get(normalizer)
+        if cache is None:
+            cache = _normalized_caches[normalizer] = LRUCache(NORMALIZED_CACHE_SIZE)
+        return cache
+
+
+def clear_normalized_caches():
+    """Empty every normalizer's LRU (e.g. between benchmark runs)"""
+    with _normalized_caches_lock:
+        caches = list(_normalized_caches.values())
+    for cache in caches:
+        cache.clear()
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _normalizer_pool():
+    """Process pool shared by all parallel normalizations, started on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # The apps run request and job threads, so workers must not be
+            # forked from them. The fork server imports only this module,
+            # not the caller's __main__, and forks workers from that clean
+            # process; spawn is the fallback where it is unavailable
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _process_pool = ProcessPoolExecutor(max_workers=_pool_size(), mp_context=context)
+        return _process_pool
+
+
+def _discard_pool(pool):
+    """Forget a broken pool so the next parallel run starts a new one"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _normalize_chunk(normalizer, values):
+    return [normalizer(value) for value in values]
+
+
+def _pool_size():
+    # parallel=True still splits the work on a single-core machine
+    return max(NORMALIZE_WORKERS, 2)
+
+
+def _normalize_parallel(values, normalizer):
+    """normalizer over values split into one contiguous block per worker, in order"""
+    size = -(-len(values) // _pool_size())
+    blocks = [values[start:start + size] for start in range(0, len(values), size)]
+    pool = _normalizer_pool()
+    try:
+        results = pool.map(_normalize_chunk, [normalizer] * len(blocks), blocks)
+        return [result for block in results for result in block]
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); normalize in this process
+        _discard_pool(pool)
+        print("⚠️ Normalization worker pool failed; normalizing in-process")
+        return _normalize_chunk(normalizer, values)
+
+
+def normalize_column(series, normalizer=format_insurance_name, parallel=None):
+    """Apply normalizer to a column, computing each distinct value only once
+
+    Equivalent to series.apply(normalizer). Distinct values are found with
+    pd.factorize (or taken from a categorical's categories), looked up in a
+    bounded LRU that survives across requests, and the results are
+    broadcast back through the factorize codes.
+
+    Uncached distinct values are spread over a process pool when there are
+    at least PARALLEL_THRESHOLD of them and more than one worker; pass
+    parallel=True or False to force either way.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Already factorized; normalize each category once
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+
+    # factorize compares with ==, which would merge values such as 1 and 1.0
+    # that format differently; only string columns take the fast path
+    if len(uniques) == 0 or pd.api.types.infer_dtype(uniques, skipna=False) != 'string':
+        return series.apply(normalizer)
+
+    cache = normalized_cache(normalizer)
+    missing_values = [value for value in uniques if value not in cache]
+    if parallel is None:
+        parallel = NORMALIZE_WORKERS > 1 and len(missing_values) >= PARALLEL_THRESHOLD
+    computed = {}
+    if parallel and missing_values:
+        # Kept locally as well, since more values than the cache holds may
+        # have been computed
+        results = _normalize_parallel(missing_values, normalizer)
+        computed = dict(zip(missing_values, results))
+        for value, result in computed.items():
+            cache.put(value, result)
+
+    normalized = np.empty(len(uniques), dtype=object)
+    normalized[:] = [
+        computed[value] if value in computed else cache.get_or_compute(value, normalizer)
+        for value in uniques
+    ]
+
+    values = normalized[codes]
+    missing = codes == -1
+    if missing.any():
+        # Missing values pass through unchanged, exactly as apply() would
+        values[missing] = series.to_numpy(dtype=object)[missing]
+
+    return pd.Series(values, index=series.index, name=series.name)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Background jobs for long-running instructions
+Jobs run on a bounded thread pool and write their output into the job
+record as they go, so clients can poll for progress.
+"""
+
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class _ThreadLocalStdout:
+    """sys.stdout replacement that lets each thread redirect its own prints
+
+    contextlib.redirect_stdout swaps the process-wide sys.stdout, so output
+    from concurrent requests and jobs would end up in each other's buffers.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def _target(self):
+        return getattr(self._local, 'target', None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._default, name)
+
+
+# Kept here too: anything may swap sys.stdout later (test runners, servers,
+# contextlib.redirect_stdout), and capture_output must not touch theirs
+_stdout = sys.stdout if isinstance(sys.stdout, _ThreadLocalStdout) else _ThreadLocalStdout(sys.stdout)
+sys.stdout = _stdout
+
+
+@contextmanager
+def capture_output(target):
+    """Send this thread's prints to target (anything with write())
+
+    Prints are redirected while sys.stdout is the stream installed at import.
+    """
+    local = _stdout._local
+    previous = getattr(local, 'target', None)
+    local.target = target
+    try:
+        yield target
+    finally:
+        local.target = previous
+
+
+class JobOutput:
+    """Thread-safe text buffer a job prints into while it runs"""
+
+    def __init__(self):
+        self._parts = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._parts.append(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        with self._lock:
+            return ''.join(self._parts)
+
+
+class Job:
+    """One queued instruction and its progress"""
+
+    def __init__(self, job_id, owner, description):
+        self.job_id = job_id
+        self.owner = owner
+        self.description = description
+        self.status = 'queued'
+        self.output = JobOutput()
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def as_dict(self):
+        end = self.finished or time.time()
+        return {
+            'job_id': self.job_id,
+            'description': self.description,
+            'status': self.status,
+            'output': self.output.getvalue(),
+            'error': self.error,
+            'queued_seconds': (self.started or end) - self.created,
+            'run_seconds': end - self.started if self.started else 0.0,
+        }
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Bounded pool of background jobs
+
+    Jobs with the same owner (a session id) run one at a time, so they
+    never modify the same workbook concurrently, and cancel() drops an
+    owner's jobs that have not started yet.
+    At most max_pending jobs may wait; finished jobs are kept until
+    max_finished newer ones have completed.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, max_finished=200):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._owner_locks = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, description, fn):
+        """Queue fn(output) to run in the background and return its Job
+
+        fn should write progress to output, e.g. with capture_output(output);
+        any exception is recorded on the job. Raises QueueFull when
+        max_pending jobs are already waiting.
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.done)
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs are already waiting; try again shortly")
+            job = Job(secrets.token_urlsafe(9), owner, description)
+            self._jobs[job.job_id] = job
+            owner_lock = self._owner_locks.setdefault(owner, threading.Lock())
+            self._prune()
+
+        self._executor.submit(self._run, job, owner_lock, fn)
+        return job
+
+    def cancel(self, owner):
+        """Cancel owner's queued jobs and return how many were cancelled"""
+        with self._lock:
+            queued = [job for job in self._jobs.values() if job.owner == owner and job.status == 'queued']
+            for job in queued:
+                job.status = 'cancelled'
+                job.finished = time.time()
+        return len(queued)
+
+    def _run(self, job, owner_lock, fn):
+        with owner_lock:
+            with self._lock:
+                if job.status == 'cancelled':
+                    return
+                job.status = 'running'
+                job.started = time.time()
+            try:
+                fn(job.output)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.output.write(f"Error executing instruction: {e}")
+                job.status = 'failed'
+            finally:
+                job.finished = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+        active_owners = {job.owner for job in self._jobs.values()}
+        for owner in list(self._owner_locks):
+            if owner not in active_owners and not self._owner_locks[owner].locked():
+                del self._owner_locks[owner]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
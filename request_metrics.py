@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Per-request stage timings and memory
+A RequestTimer times the stages of one request (parse, exec, render,
+export...) and its memory growth. Finished timers feed process-wide
+histograms that /metrics serves in Prometheus text format, and each
+response lists its own stages in a Server-Timing header.
+"""
+
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_local = threading.local()
+_DONE = object()
+
+
+def rss_bytes():
+    """Resident memory of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RequestTimer:
+    """Stage timings and memory growth of one request
+
+    Repeated stages add up. With track_memory, the peak of tracemalloc'd
+    allocations above the level at the start is recorded as well; tracing
+    is process-wide, so concurrent requests inflate each other's peaks.
+    """
+
+    def __init__(self, route, track_memory=False):
+        self.route = route
+        self.stages = {}
+        self.seconds = None
+        self.rss_delta = None
+        self.traced_peak = None
+        # Set when producing a streamed body raised after the response began
+        self.failed = False
+        self._track_memory = track_memory and tracemalloc.is_tracing()
+        self._rss = rss_bytes()
+        if self._track_memory:
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def timed_iter(self, name, chunks):
+        """Yield from chunks, timing the work of producing them as stage name
+
+        An error producing a chunk marks the timer failed and propagates, so
+        the server aborts the response instead of ending it cleanly.
+        """
+        iterator = iter(chunks)
+        while True:
+            try:
+                with self.stage(name):
+                    chunk = next(iterator, _DONE)
+            except Exception:
+                self.failed = True
+                raise
+            if chunk is _DONE:
+                return
+            yield chunk
+
+    def finish(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self._start
+            rss = rss_bytes()
+            if rss is not None and self._rss is not None:
+                self.rss_delta = rss - self._rss
+            if self._track_memory and tracemalloc.is_tracing():
+                self.traced_peak = max(0, tracemalloc.get_traced_memory()[1] - self._traced)
+        return self
+
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self._start
+        metrics = [f"{name};dur={stage_seconds * 1000:.1f}" for name, stage_seconds in self.stages.items()]
+        metrics.append(f"total;dur={seconds * 1000:.1f}")
+        return ', '.join(metrics)
+
+    def __str__(self):
+        stages = ', '.join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.stages.items())
+        text = f"{self.route}: {stages or 'no stages'}"
+        if self.seconds is not None:
+            text += f" ({self.seconds * 1000:.1f} ms total"
+            if self.rss_delta is not None:
+                text += f", RSS {self.rss_delta / 2 ** 20:+.1f} MB"
+            if self.traced_peak is not None:
+                text += f", peak {self.traced_peak / 2 ** 20:.1f} MB allocated"
+            text += ")"
+        return text
+
+
+def current_timer():
+    """The RequestTimer of the request this thread is handling, if any"""
+    return getattr(_local, 'timer', None)
+
+
+def stage(name):
+    """Time a block as stage name of the current request (no-op outside one)"""
+    timer = current_timer()
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class RequestMetrics:
+    """Process-wide request statistics in Prometheus text format
+
+    start() begins timing a request on the current thread, so stage() calls
+    anywhere below it are attributed to it; record() adds the finished
+    timer to the totals. Extra gauges (e.g. queue sizes) are read from
+    callbacks at scrape time.
+    """
+
+    def __init__(self, prefix='excel', track_memory=False):
+        self.prefix = prefix
+        self.track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._durations = {}
+        self._stages = {}
+        self._requests = {}
+        self._rss_deltas = {}
+        self._traced_peaks = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def start(self, route):
+        """A RequestTimer for route, current on this thread until detach()"""
+        timer = _local.timer = RequestTimer(route, self.track_memory)
+        return timer
+
+    def detach(self):
+        _local.timer = None
+
+    @contextmanager
+    def track(self, route):
+        """Time a block as one request to route and record it"""
+        previous = current_timer()
+        timer = self.start(route)
+        status = 'error'
+        try:
+            yield timer
+            status = 'ok'
+        finally:
+            _local.timer = previous
+            self.record(timer, status)
+
+    def record(self, timer, status):
+        timer.finish()
+        with self._lock:
+            self._durations.setdefault(timer.route, _Histogram()).observe(timer.seconds)
+            for name, seconds in timer.stages.items():
+                self._stages.setdefault((timer.route, name), _Histogram()).observe(seconds)
+            key = (timer.route, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for totals, value in ((self._rss_deltas, timer.rss_delta), (self._traced_peaks, timer.traced_peak)):
+                if value is not None:
+                    count, total = totals.get(timer.route, (0, 0))
+                    totals[timer.route] = (count + 1, total + value)
+
+    def add_gauge(self, name, help_text, read):
+        """Report read() at every scrape: a number, or a {label value: number} dict labelled by 'state'"""
+        self._gauges.append((name, help_text, read))
+
+    def _histogram_lines(self, name, help_text, histograms):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, histogram in sorted(histograms.items()):
+            for bound, count in zip(DURATION_BUCKETS, histogram.buckets):
+                lines.append(f"{name}_bucket{_labels(**dict(labels), le=bound)} {count}")
+            lines.append(f"{name}_bucket{_labels(**dict(labels), le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(**dict(labels))} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(**dict(labels))} {histogram.count}")
+        return lines
+
+    def _summary_lines(self, name, help_text, totals):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+        for route, (count, total) in sorted(totals.items()):
+            lines.append(f"{name}_sum{_labels(route=route)} {total}")
+            lines.append(f"{name}_count{_labels(route=route)} {count}")
+        return lines
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        prefix = self.prefix
+        with self._lock:
+            durations = {(('route', route),): histogram for route, histogram in self._durations.items()}
+            stages = {(('route', route), ('stage', name)): histogram
+                      for (route, name), histogram in self._stages.items()}
+            requests = sorted(self._requests.items())
+            rss_deltas = dict(self._rss_deltas)
+            traced_peaks = dict(self._traced_peaks)
+
+        lines = self._histogram_lines(f'{prefix}_request_duration_seconds', 'Time to handle a request', durations)
+        lines.extend(self._histogram_lines(f'{prefix}_request_stage_seconds',
+                                           'Time spent in each stage of a request', stages))
+        lines.extend([f"# HELP {prefix}_requests_total Requests handled",
+                      f"# TYPE {prefix}_requests_total counter"])
+        lines.extend(f"{prefix}_requests_total{_labels(route=route, status=status)} {count}"
+                     for (route, status), count in requests)
+        lines.extend(self._summary_lines(f'{prefix}_request_rss_delta_bytes',
+                                         'Change in resident memory over a request', rss_deltas))
+        if self.track_memory:
+            lines.extend(self._summary_lines(f'{prefix}_request_traced_peak_bytes',
+                                             'Peak Python allocations during a request above its start',
+                                             traced_peaks))
+
+        rss = rss_bytes()
+        if rss is not None:
+            lines.extend([f"# HELP {prefix}_resident_memory_bytes Resident memory of this process",
+                          f"# TYPE {prefix}_resident_memory_bytes gauge",
+                          f"{prefix}_resident_memory_bytes {rss}"])
+        for name, help_text, read in self._gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} gauge"])
+            if isinstance(value, dict):
+                lines.extend(f"{prefix}_{name}{_labels(state=state)} {count}" for state, count in value.items())
+            else:
+                lines.append(f"{prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def instrument(app, metrics, endpoint='/metrics'):
+    """Time every request of a Flask app and serve metrics.render() at endpoint
+
+    Each request is timed under its URL rule; stage() calls made while it
+    is handled show up in its Server-Timing header. A streamed response is
+    recorded once its body has been sent, as a 500 if producing the body
+    failed, and a request that raised before a response was made is
+    recorded as a 500.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_timer = metrics.start(request.url_rule.rule if request.url_rule else 'unmatched')
+
+    @app.after_request
+    def add_server_timing(response):
+        timer = g.pop('request_timer', None)
+        if timer is None:
+            return response
+        metrics.detach()
+        response.headers['Server-Timing'] = timer.server_timing()
+        if response.is_streamed:
+            response.call_on_close(lambda: metrics.record(timer, 500 if timer.failed else response.status_code))
+        else:
+            metrics.record(timer, response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error):
+        # after_request is skipped when the view raises, so the timer is
+        # still here; don't leave it attached for this thread's next request
+        timer = g.pop('request_timer', None)
+        if timer is not None:
+            metrics.detach()
+            metrics.record(timer, 500)
+
+    @app.route(endpoint)
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
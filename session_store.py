@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Per-user workbook sessions
+Sessions stay in memory up to a byte budget. Idle sessions are evicted
+least-recently-used first and transparently reloaded from disk on next access.
+"""
+
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+
+import pyarrow.parquet as pq
+
+from sheet_storage import private_directory, read_sheet_table, sheet_table
+from workbook_loader import LazyWorkbook
+
+META_FILE = 'session.json'
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def new_session_id():
+    return secrets.token_urlsafe(18)
+
+
+def is_valid_session_id(session_id):
+    """Session ids become directory names, so only accept our own format"""
+    return bool(session_id) and bool(_SESSION_ID.match(session_id))
+
+
+class WorkbookSession:
+    """One user's workbook, current sheet and instruction history"""
+
+    def __init__(self, session_id, directory):
+        self.session_id = session_id
+        self.directory = directory
+        self.data = {}
+        self.current_sheet = None
+        self.filename = None
+        self.source_file = None
+        self.conversation_history = []
+        self.version = 0
+        # New for every uploaded workbook, so work started on an earlier
+        # upload can tell it was replaced
+        self.upload_id = None
+        # sheet name -> number of times it has been modified
+        self.sheet_versions = {}
+        self.last_access = time.time()
+        # Sheets that differ from the uploaded source, and the subset of
+        # those not yet written to disk
+        self.modified_sheets = {}
+        self.unsaved_sheets = set()
+
+    @property
+    def nbytes(self):
+        """Bytes held by the sheets parsed so far"""
+        return self.data.nbytes if self.data else 0
+
+    @property
+    def source_path(self):
+        return os.path.join(self.directory, self.source_file) if self.source_file else None
+
+    def source_path_for(self, filename):
+        """Where to save an uploaded file, keeping its extension for the Excel engine"""
+        extension = os.path.splitext(filename)[1].lower() or '.xlsx'
+        self.source_file = 'source' + extension
+        return self.source_path
+
+    def load_workbook(self, filename, data):
+        """Replace the workbook with a freshly uploaded LazyWorkbook"""
+        self.data = data
+        self.filename = filename
+        self.upload_id = secrets.token_hex(8)
+        self.conversation_history = []
+        self.modified_sheets = {}
+        self.unsaved_sheets = set()
+        self.sheet_versions = {}
+
+        # Set the main sheet as current
+        if 'Consolidated' in data:
+            self.current_sheet = 'Consolidated'
+        else:
+            self.current_sheet = list(data.keys())[0]
+
+    def set_sheet(self, sheet_name, df):
+        """Store a modified sheet"""
+        self.data[sheet_name] = df
+        self.modified_sheets.setdefault(sheet_name, None)
+        self.unsaved_sheets.add(sheet_name)
+        self.sheet_versions[sheet_name] = self.sheet_versions.get(sheet_name, 0) + 1
+
+
+class SessionStore:
+    """Session-keyed workbook store with a memory budget
+
+    Every save writes the session metadata and any modified sheets to disk,
+    so sessions can be evicted at any time and any worker process sharing
+    root can serve any session. Unmodified sheets are re-read from the
+    uploaded file instead of being duplicated on disk, and reloaded sessions
+    parse each sheet only when it is first used. Sheets are stored as
+    Parquet, never pickled, and root is private to this user.
+    Changes to a session should be made holding lock(session_id), which
+    serializes them between request and job threads of this process.
+    """
+
+    def __init__(self, root, memory_budget, workbook_cache=None, optimize_dtypes=False):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.workbook_cache = workbook_cache
+        self.optimize_dtypes = optimize_dtypes
+        self.evictions = 0
+        self.reloads = 0
+        self._sessions = OrderedDict()
+        # A session's lock lives as long as some thread holds a reference
+        # to it, so every thread working on a session shares one lock
+        self._session_locks = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+        private_directory(root)
+
+    def lock(self, session_id):
+        """The lock guarding changes to one session"""
+        with self._lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = threading.Lock()
+            return lock
+
+    def _directory(self, session_id):
+        return os.path.join(self.root, session_id)
+
+    def _read_meta(self, session_id):
+        try:
+            with open(os.path.join(self._directory(session_id), META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, session_id):
+        """Return the session, reloading it from disk if evicted or stale
+
+        Unknown ids get a new empty session, which is only kept once saved.
+        """
+        meta = self._read_meta(session_id)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and (meta is None or meta['version'] <= session.version):
+                self._sessions.move_to_end(session_id)
+                session.last_access = time.time()
+                return session
+
+        if meta is None:
+            return WorkbookSession(session_id, self._directory(session_id))
+
+        # Evicted, or saved more recently by another worker
+        session = self._load(session_id, meta)
+        with self._lock:
+            self.reloads += 1
+            self._sessions[session_id] = session
+            self._enforce_budget(keep=session_id)
+        return session
+
+    def reset(self, session_id):
+        """Discard any stored workbook and return an empty session"""
+        self.delete(session_id)
+        directory = self._directory(session_id)
+        os.makedirs(directory, exist_ok=True)
+        return WorkbookSession(session_id, directory)
+
+    def save(self, session):
+        """Write metadata and unsaved sheets to disk and keep the session resident"""
+        os.makedirs(session.directory, exist_ok=True)
+
+        # New sheet files get versioned names, and the files they replace are
+        # removed only after the metadata pointing at them has been swapped
+        sheet_names = list(session.data.keys())
+        replaced_files = []
+        for sheet_name in sorted(session.unsaved_sheets):
+            old_file = session.modified_sheets.get(sheet_name)
+            if old_file:
+                replaced_files.append(old_file)
+            session.modified_sheets[sheet_name] = self._write_sheet(
+                session, sheet_names.index(sheet_name), session.data[sheet_name]
+            )
+        session.unsaved_sheets.clear()
+
+        session.version += 1
+        meta = {
+            'version': session.version,
+            'upload_id': session.upload_id,
+            'sheet_versions': session.sheet_versions,
+            'filename': session.filename,
+            'source_file': session.source_file,
+            'current_sheet': session.current_sheet,
+            'sheets': list(session.data.keys()),
+            'modified_sheets': session.modified_sheets,
+            'sheet_shapes': {name: session.data.shape(name) for name in session.modified_sheets},
+            'conversation_history': [
+                dict(entry, timestamp=entry['timestamp'].isoformat())
+                for entry in session.conversation_history
+            ],
+        }
+        self._write_atomic(os.path.join(session.directory, META_FILE), json.dumps(meta).encode('utf-8'))
+        for old_file in replaced_files:
+            self._remove(os.path.join(session.directory, old_file))
+
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            session.last_access = time.time()
+            self._enforce_budget(keep=session.session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        shutil.rmtree(self._directory(session_id), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'resident_sessions': len(self._sessions),
+                'resident_bytes': sum(s.nbytes for s in self._sessions.values()),
+                'memory_budget': self.memory_budget,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+            }
+
+    def _enforce_budget(self, keep):
+        """Evict least recently used sessions until under the memory budget"""
+        total = sum(s.nbytes for s in self._sessions.values())
+        for session_id in list(self._sessions):
+            if total <= self.memory_budget:
+                break
+            if session_id == keep:
+                continue
+            session = self._sessions.pop(session_id)
+            total -= session.nbytes
+            self.evictions += 1
+
+    def _load(self, session_id, meta):
+        session = WorkbookSession(session_id, self._directory(session_id))
+        session.version = meta['version']
+        session.upload_id = meta.get('upload_id')
+        session.sheet_versions = meta.get('sheet_versions', {})
+        session.filename = meta['filename']
+        session.source_file = meta['source_file']
+        session.current_sheet = meta['current_sheet']
+        session.modified_sheets = meta['modified_sheets']
+        session.conversation_history = [
+            dict(entry, timestamp=datetime.fromisoformat(entry['timestamp']))
+            for entry in meta['conversation_history']
+        ]
+
+        if not session.source_file:
+            return session
+
+        # Nothing is parsed here; sheets load on first access, modified ones
+        # from their saved files and the rest from the uploaded workbook
+        session.data = LazyWorkbook(session.source_path, workbook_cache=self.workbook_cache,
+                                    optimize=self.optimize_dtypes)
+        shapes = meta.get('sheet_shapes', {})
+        for sheet_name, sheet_file in session.modified_sheets.items():
+            shape = shapes.get(sheet_name)
+            session.data.set_loader(
+                sheet_name,
+                partial(self._read_sheet, os.path.join(session.directory, sheet_file)),
+                shape=tuple(shape) if shape else None,
+            )
+        return session
+
+    def _write_sheet(self, session, index, df):
+        """Write a sheet as Parquet"""
+        path = os.path.join(session.directory, f"sheet_{index}_v{session.version + 1}.parquet")
+        try:
+            pq.write_table(sheet_table(df), path + '.tmp')
+        except Exception:
+            self._remove(path + '.tmp')
+            raise
+        os.replace(path + '.tmp', path)
+        return os.path.basename(path)
+
+    @staticmethod
+    def _read_sheet(path):
+        return read_sheet_table(pq.read_table(path))
+
+    @staticmethod
+    def _write_atomic(path, payload):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Cached per-sheet statistics
+Summary, count, info and filter instructions read value counts, distinct
+counts, missing values, describe(), date ranges and row indexes from here, so
+repeated queries on an unchanged sheet don't rescan it. Statistics are kept per column, and a
+modified sheet recomputes only the columns that changed.
+"""
+
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+def _buffer(series):
+    """The numpy array holding a column's values, or None for other storage"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # .cat.codes would copy them
+        return series.array.codes
+    if not isinstance(series.dtype, np.dtype):
+        return None
+    return series.to_numpy()
+
+
+def _same_column(old, new):
+    """True if new holds exactly old's data
+
+    Copy-on-write leaves columns an instruction didn't write sharing memory
+    with the original frame, so comparing buffers is enough and costs
+    nothing; columns that were copied without changes count as changed.
+    """
+    if old.dtype != new.dtype:
+        return False
+    if isinstance(old.dtype, pd.CategoricalDtype) and not old.cat.categories.equals(new.cat.categories):
+        return False
+    old_values, new_values = _buffer(old), _buffer(new)
+    if old_values is None or new_values is None:
+        return False
+    return (old_values.shape == new_values.shape and old_values.strides == new_values.strides
+            and old_values.__array_interface__['data'][0] == new_values.__array_interface__['data'][0])
+
+
+def unchanged_columns(old, new):
+    """Names of columns whose values are the same objects in both frames"""
+    if not (old.columns.is_unique and new.columns.is_unique) or not old.index.equals(new.index):
+        return []
+    return [column for column in new.columns
+            if column in old.columns and _same_column(old[column], new[column])]
+
+
+def same_frame(old, new):
+    """True if new has old's columns and index and shares all of its column data"""
+    if old is new:
+        return True
+    return (old.columns.equals(new.columns)
+            and len(unchanged_columns(old, new)) == len(new.columns))
+
+
+def _text_key(value):
+    return str(value).strip().casefold()
+
+
+class RowIndex:
+    """Ascending row positions of each distinct value of a column
+
+    Values are looked up by their text, ignoring case and surrounding
+    whitespace, since instructions are matched in lower case.
+    """
+
+    def __init__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.array.codes, series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+
+        # One stable sort groups rows by value, each group in row order;
+        # missing values (code -1) sort first and are skipped
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        bounds = np.concatenate([[0], np.cumsum(counts)]) + (len(codes) - counts.sum())
+
+        groups = {}
+        for code, value in enumerate(uniques):
+            if counts[code]:
+                groups.setdefault(_text_key(value), []).append((value, order[bounds[code]:bounds[code + 1]]))
+        self._values = {key: [value for value, _ in group] for key, group in groups.items()}
+        self._rows = {
+            key: group[0][1] if len(group) == 1 else np.sort(np.concatenate([rows for _, rows in group]))
+            for key, group in groups.items()
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+    def lookup(self, text):
+        """(matching values, their row positions) for text"""
+        key = _text_key(text)
+        return self._values.get(key, []), self._rows.get(key, np.empty(0, dtype=np.intp))
+
+
+class DateIndex:
+    """Row positions of a datetime column in date order
+
+    Ranges, min/max and per-day or per-month counts are answered by binary
+    search over the sorted dates instead of scanning the column.
+    """
+
+    def __init__(self, series):
+        self.name = series.name
+        values = series.to_numpy()
+        positions = np.flatnonzero(~np.isnat(values))
+        self.order = positions[np.argsort(values[positions], kind='stable')]
+        self.dates = values[self.order]
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def min(self):
+        return pd.Timestamp(self.dates[0]) if len(self.dates) else pd.NaT
+
+    @property
+    def max(self):
+        return pd.Timestamp(self.dates[-1]) if len(self.dates) else pd.NaT
+
+    def between(self, start, end):
+        """Ascending row positions with start <= date < end"""
+        low, high = np.searchsorted(self.dates, [pd.Timestamp(start).to_datetime64(),
+                                                 pd.Timestamp(end).to_datetime64()])
+        return np.sort(self.order[low:high])
+
+    def buckets(self, freq):
+        """Rows per period ('D' for days, 'M' for months), in date order"""
+        periods = self.dates.astype(f'datetime64[{freq}]')
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]]) if len(periods) else np.empty(0, dtype=np.intp)
+        counts = np.diff(np.r_[starts, len(periods)])
+        index = pd.PeriodIndex(pd.DatetimeIndex(periods[starts]), freq=freq, name=self.name)
+        return pd.Series(counts, index=index, name='count')
+
+
+def _is_datetime(series):
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind == 'M'
+
+
+def _describe_column(series):
+    return series.describe()
+
+
+def _assemble_describe(df, describe_column):
+    """df.describe() built from one description per column"""
+    data = df.select_dtypes(include=[np.number, 'datetime'])
+    if len(data.columns) == 0:
+        data = df
+    descriptions = [describe_column(column) for column in data.columns]
+
+    # Row order as pandas orders it: shortest descriptions first
+    names = []
+    for index in sorted((description.index for description in descriptions), key=len):
+        names.extend(name for name in index if name not in names)
+    result = pd.concat([description.reindex(names) for description in descriptions], axis=1, sort=False)
+    result.columns = data.columns.copy()
+    return result
+
+
+class SheetStats:
+    """Statistics of one version of a sheet, each computed on first use
+
+    Only a weak reference to the frame is held, so cached statistics never
+    keep an evicted sheet in memory. Results are shared between callers and
+    must not be modified.
+    """
+
+    def __init__(self, df, version=0):
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._frame = weakref.ref(df)
+        # column -> {statistic: result}
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def bind(self, df):
+        """Compute from df from now on (the same version, e.g. re-parsed)"""
+        self._frame = weakref.ref(df)
+
+    @property
+    def frame(self):
+        df = self._frame()
+        if df is None:
+            raise ReferenceError("The sheet these statistics belong to is no longer loaded")
+        return df
+
+    def carry_over(self, previous, columns):
+        """Reuse previous's statistics for columns whose values are unchanged"""
+        with previous._lock:
+            kept = {column: dict(previous._columns[column]) for column in columns if column in previous._columns}
+        with self._lock:
+            self._columns.update(kept)
+
+    def cached_columns(self):
+        with self._lock:
+            return list(self._columns)
+
+    def _memo(self, column, statistic, compute):
+        with self._lock:
+            results = self._columns.get(column)
+            if results is not None and statistic in results:
+                self.hits += 1
+                return results[statistic]
+        result = compute(self.frame[column])
+        with self._lock:
+            self.misses += 1
+            return self._columns.setdefault(column, {}).setdefault(statistic, result)
+
+    def value_counts(self, column):
+        return self._memo(column, 'value_counts', lambda series: series.value_counts())
+
+    def nunique(self, column):
+        return self._memo(column, 'nunique', lambda series: series.nunique())
+
+    def count(self, column):
+        return self._memo(column, 'count', lambda series: series.count())
+
+    def nulls(self, column):
+        return self._memo(column, 'nulls', lambda series: series.isnull().sum())
+
+    def min(self, column):
+        return self._memo(column, 'min', lambda series: self.date_index(column).min
+                          if _is_datetime(series) else series.min())
+
+    def max(self, column):
+        return self._memo(column, 'max', lambda series: self.date_index(column).max
+                          if _is_datetime(series) else series.max())
+
+    def date_index(self, column):
+        """DateIndex of a datetime64 column"""
+        return self._memo(column, 'date_index', DateIndex)
+
+    def row_index(self, column):
+        """RowIndex of column, for filters that touch only the matched rows"""
+        return self._memo(column, 'row_index', RowIndex)
+
+    def null_counts(self):
+        """df.isnull().sum()"""
+        df = self.frame
+        if not df.columns.is_unique or len(df.columns) == 0:
+            return df.isnull().sum()
+        return pd.Series([self.nulls(column) for column in df.columns], index=df.columns.copy(), dtype=np.int64)
+
+    def describe(self):
+        """df.describe()"""
+        df = self.frame
+        if not df.columns.is_unique or len(df.columns) == 0:
+            return df.describe()
+        return _assemble_describe(df, lambda column: self._memo(column, 'describe', _describe_column))
+
+
+class StatsCache:
+    """SheetStats per sheet, versioned by a counter bumped on every change
+
+    Call update() with the new frame whenever a sheet is replaced, before
+    the old frame is released: statistics of columns it shares with the old
+    frame are kept and the rest are computed again on demand.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def version(self, sheet_name):
+        return self._versions.get(sheet_name, 0)
+
+    def update(self, sheet_name, df):
+        """Start a new version of sheet_name from df, keeping unchanged columns"""
+        with self._lock:
+            version = self._versions[sheet_name] = self._versions.get(sheet_name, 0) + 1
+            previous = self._stats.pop(sheet_name, None)
+            old = previous._frame() if previous is not None else None
+            if old is None or old is df:
+                # Nothing to compare against (or modified in place)
+                return
+            stats = self._stats[sheet_name] = SheetStats(df, version)
+        stats.carry_over(previous, unchanged_columns(old, df))
+
+    def get(self, sheet_name, df):
+        """Statistics for the current version of sheet_name, computed from df"""
+        with self._lock:
+            version = self._versions.get(sheet_name, 0)
+            stats = self._stats.get(sheet_name)
+            if stats is None or stats.version != version:
+                stats = self._stats[sheet_name] = SheetStats(df, version)
+            else:
+                stats.bind(df)
+            return stats
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sheets': len(self._stats),
+                'hits': sum(stats.hits for stats in self._stats.values()),
+                'misses': sum(stats.misses for stats in self._stats.values()),
+            }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+On-disk storage of sheets
+Sheets are written as Arrow tables that round-trip every column exactly,
+including columns Arrow has no type for, into directories private to this
+user. Nothing is unpickled, so a file someone else planted can't run code.
+"""
+
+import json
+import os
+import stat
+from datetime import date, datetime, timedelta
+from datetime import time as time_of_day
+from numbers import Integral, Real
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+SHEET_METADATA = b'excel_ai_sheet'
+
+
+def private_directory(path):
+    """Create path as a directory only this user can access, and return it
+
+    An existing directory must be this user's and not writable by others,
+    since what is read back from it is trusted; one that others can only
+    read is made private.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return path
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a directory owned by this user; remove it or choose another path")
+    if info.st_mode & 0o022:
+        raise PermissionError(f"{path} is writable by other users; remove it or choose another path")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _tag(value):
+    """A cell or column label as JSON-able [type, value], or None if missing"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, bool):
+        return ['bool', value]
+    if isinstance(value, Integral):
+        return ['int', int(value)]
+    if isinstance(value, Real):
+        return ['float', float(value)]
+    if isinstance(value, str):
+        return ['str', value]
+    if isinstance(value, pd.Timestamp):
+        return ['timestamp', value.isoformat()]
+    if isinstance(value, datetime):
+        return ['datetime', value.isoformat()]
+    if isinstance(value, date):
+        return ['date', value.isoformat()]
+    if isinstance(value, time_of_day):
+        return ['time', value.isoformat()]
+    if isinstance(value, timedelta):
+        return ['timedelta', [value.days, value.seconds, value.microseconds]]
+    return ['str', str(value)]
+
+
+_UNTAG = {
+    'bool': bool,
+    'int': int,
+    'float': float,
+    'str': str,
+    'timestamp': pd.Timestamp,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time_of_day.fromisoformat,
+    'timedelta': lambda parts: timedelta(*parts),
+}
+
+
+def _untag(tagged):
+    return None if tagged is None else _UNTAG[tagged[0]](tagged[1])
+
+
+def _kind(value_type):
+    """Which typed part of a mixed column values of value_type are stored in"""
+    for kind, types in (('bool', bool), ('int', Integral), ('float', Real), ('str', str),
+                        ('datetime', datetime), ('date', date), ('time', time_of_day), ('timedelta', timedelta)):
+        if issubclass(value_type, types):
+            return kind
+    return 'text'
+
+
+def _split_mixed(column):
+    """{kind: Arrow array holding the column's values of that kind, null elsewhere}"""
+    types = column.map(type)
+    kinds = types.map({value_type: _kind(value_type) for value_type in types.unique()}).where(column.notna())
+    parts = {}
+    for kind in kinds.dropna().unique():
+        part = column.where(kinds == kind)
+        try:
+            parts[kind] = pa.array(part.map(str, na_action='ignore') if kind == 'text' else part, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # e.g. datetimes in several time zones
+            text = parts.get('text')
+            part = part.map(str, na_action='ignore')
+            if text is not None:
+                part = part.where(part.notna(), pd.Series(text.to_pandas(), index=part.index))
+            parts['text'] = pa.array(part, from_pandas=True)
+    return parts
+
+
+def sheet_table(df):
+    """A sheet as an Arrow table that read_sheet_table turns back into it
+
+    Columns are stored under positional names, with their labels in the
+    schema metadata, so labels needn't be unique strings. A column Arrow
+    cannot represent, such as numbers mixed with text, is split into one
+    Arrow column per Python type, each null where the others have values.
+    """
+    frame = df.set_axis([f'c{position}' for position in range(df.shape[1])], axis=1)
+    split = {}
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        for position in range(frame.shape[1]):
+            try:
+                pa.array(frame.iloc[:, position], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                split[position] = _split_mixed(frame.iloc[:, position].astype(object))
+        table = pa.Table.from_pandas(frame.drop(columns=[f'c{position}' for position in split]),
+                                     preserve_index=True)
+        for position, parts in split.items():
+            for kind, part in parts.items():
+                table = table.append_column(f'c{position}.{kind}', part)
+    info = {'columns': [_tag(label) for label in df.columns],
+            'split': {position: list(parts) for position, parts in split.items()}}
+    return table.replace_schema_metadata({**table.schema.metadata, SHEET_METADATA: json.dumps(info)})
+
+
+def read_sheet_table(table):
+    info = json.loads(table.schema.metadata[SHEET_METADATA])
+    mixed = {}
+    for position, kinds in info['split'].items():
+        values = np.full(table.num_rows, None, dtype=object)
+        for kind in kinds:
+            part = table.column(f'c{position}.{kind}')
+            present = part.drop_null()
+            # numpy turns numbers and text back into Python objects much
+            # faster than to_pylist, which is needed for dates and times
+            if kind in ('bool', 'int', 'float', 'str', 'text'):
+                present = present.to_numpy(zero_copy_only=False).astype(object)
+            else:
+                present = present.to_pylist()
+            values[part.is_valid().to_numpy(zero_copy_only=False)] = present
+        mixed[int(position)] = values
+        table = table.drop_columns([f'c{position}.{kind}' for kind in kinds])
+    df = table.to_pandas()
+    for position in sorted(mixed):
+        df.insert(position, f'c{position}', mixed[position])
+    df.columns = [_untag(label) for label in info['columns']]
+    return df
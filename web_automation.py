@@ -11,9 +11,14 @@ import json
 
 # Import our automation class
 from ai_excel_automation import AIExcelAutomation
+from request_metrics import RequestMetrics, instrument, stage
 
 app = Flask(__name__)
 
+# Stage timings of every request, served at /metrics and in each response's
+# Server-Timing header
+instrument(app, RequestMetrics(track_memory=os.environ.get('TRACK_REQUEST_MEMORY') == '1'))
+
 # Global automation instance
 automation = None
 
@@ -29,7 +34,7 @@ HTML_TEMPLATE = """
         .section { margin: 20px 0; padding: 15px; border: 1px solid #ddd; border-radius: 5px; }
         .form-group { margin: 10px 0; }
         label { display: block; margin-bottom: 5px; font-weight: bold; }
-        input[type="text"], textarea { width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
+        input[type="text"], select, textarea { width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
         button { background: #007bff; color: white; padding: 10px 20px; border: none; border-radius: 4px; cursor: pointer; margin: 5px; }
         button:hover { background: #0056b3; }
         .output { background: #f8f9fa; padding: 15px; border-radius: 4px; white-space: pre-wrap; font-family: monospace; max-height: 400px; overflow-y: auto; }
@@ -122,6 +127,15 @@ HTML_TEMPLATE = """
                     <input type="text" id="filename" name="filename" 
                            placeholder="processed_data.xlsx">
                 </div>
+                <div class="form-group">
+                    <label for="format">Format:</label>
+                    <select id="format" name="format">
+                        <option value="xlsx">Excel (.xlsx)</option>
+                        <option value="csv">CSV, gzipped (.csv.gz)</option>
+                        <option value="parquet">Parquet (.parquet)</option>
+                        <option value="arrow">Arrow IPC (.arrow)</option>
+                    </select>
+                </div>
                 <button type="submit">Export Current Data</button>
             </form>
         </div>
@@ -218,9 +232,10 @@ def execute_instruction():
         
         output = output_buffer.getvalue()
         
-        return render_template_string(HTML_TEMPLATE, 
-                                   automation=automation, 
-                                   output=output)
+        with stage('render'):
+            return render_template_string(HTML_TEMPLATE, 
+                                       automation=automation, 
+                                       output=output)
         
     except Exception as e:
         return render_template_string(HTML_TEMPLATE, 
@@ -258,7 +273,7 @@ def export_data():
         filename = None
     
     try:
-        output_file = automation.export_data(filename)
+        output_file = automation.export_data(filename, request.form.get('format', 'xlsx'))
         if output_file:
             return send_file(output_file, as_attachment=True)
         else:
@@ -4,22 +4,78 @@ Web-based Excel Automation App
 Upload Excel files and give natural language instructions
 """
 
-from flask import Flask, render_template_string, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template_string, request, jsonify, Response, redirect, url_for, g, send_file
 import pandas as pd
 import os
+import itertools
 import json
 from datetime import datetime
 import re
+import tempfile
 from werkzeug.utils import secure_filename
 
+from command_registry import CommandRegistry
+from instruction_parsing import extract_dates, extract_filter, extract_number
+from session_store import SessionStore, is_valid_session_id, new_session_id
+from insurance_normalizer import normalize_column, format_insurance_name
+from workbook_cache import WorkbookCache
+from workbook_loader import LazyWorkbook
+from job_queue import JobQueue, QueueFull, capture_output
+from export_formats import export_filename, export_mimetype, get_export_format, iter_export
+from request_metrics import RequestMetrics, instrument, stage
+from instruction_profiler import PROFILE_FORMATS, get_profile_format, profiled
+
+# Copy-on-write lets instructions share column data with the stored sheets
+pd.set_option('mode.copy_on_write', True)
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Global variables to store session data
-current_data = {}
-current_sheet = None
-current_filename = None
-conversation_history = []
+# Parsed sheets of every uploaded file, keyed by content hash, so
+# re-uploading the same workbook skips the Excel parse
+workbook_cache = WorkbookCache(
+    os.environ.get('WORKBOOK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'excel_ai_workbook_cache')),
+    int(os.environ.get('WORKBOOK_CACHE_MB', 2048)) * 1024 * 1024,
+)
+
+# Store low-cardinality text as categoricals, downcast integers and parse
+# appointment dates when sheets are loaded
+OPTIMIZE_DTYPES = os.environ.get('OPTIMIZE_DTYPES', '1') != '0'
+
+# Per-user workbooks, kept in memory up to SESSION_MEMORY_MB and spilled to
+# SESSION_DIR, which worker processes on the same host can share
+SESSION_COOKIE = 'excel_session'
+sessions = SessionStore(
+    os.environ.get('SESSION_DIR', os.path.join(tempfile.gettempdir(), 'excel_ai_sessions')),
+    int(os.environ.get('SESSION_MEMORY_MB', 512)) * 1024 * 1024,
+    workbook_cache=workbook_cache,
+    optimize_dtypes=OPTIMIZE_DTYPES,
+)
+
+# Measure peak parse memory per sheet on upload (slows parsing down)
+TRACK_LOAD_MEMORY = os.environ.get('TRACK_LOAD_MEMORY') == '1'
+
+# Instructions on sheets with at least this many rows run as background jobs
+# so the request returns immediately and the page polls /jobs/<id>
+BACKGROUND_JOB_ROWS = int(os.environ.get('BACKGROUND_JOB_ROWS', 50000))
+jobs = JobQueue(
+    max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('MAX_PENDING_JOBS', 32)),
+)
+
+# Stage timings of every request, served at /metrics and in each response's
+# Server-Timing header; TRACK_REQUEST_MEMORY adds tracemalloc peaks (slower)
+metrics = RequestMetrics(track_memory=os.environ.get('TRACK_REQUEST_MEMORY') == '1')
+metrics.add_gauge('jobs', 'Background jobs by state', jobs.stats)
+metrics.add_gauge('workbook_cache_hits', 'Uploads served from the workbook cache',
+                  lambda: workbook_cache.stats()['hits'])
+instrument(app, metrics)
+
+# Profiles of instructions run with the X-Profile header or the form's
+# profile option are kept in the session directory, newest MAX_PROFILES
+PROFILE_DIR = 'profiles'
+MAX_PROFILES = int(os.environ.get('MAX_PROFILES', 10))
+PROFILE_NAME = re.compile(r'^[\w-]+(' + '|'.join(re.escape(suffix) for suffix in PROFILE_FORMATS.values()) + r')$')
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -75,7 +131,7 @@ HTML_TEMPLATE = """
             font-weight: 600; 
             color: #555;
         }
-        input[type="file"], input[type="text"], textarea { 
+        input[type="file"], input[type="text"], select, textarea { 
             width: 100%; 
             padding: 12px; 
             border: 2px solid #ddd; 
@@ -83,7 +139,7 @@ HTML_TEMPLATE = """
             font-size: 16px;
             transition: border-color 0.3s;
         }
-        input[type="file"]:focus, input[type="text"]:focus, textarea:focus { 
+        input[type="file"]:focus, input[type="text"]:focus, select:focus, textarea:focus { 
             outline: none; 
             border-color: #667eea; 
         }
@@ -228,12 +284,12 @@ HTML_TEMPLATE = """
             <div class="section">
                 <h3>📋 Available Sheets</h3>
                 <div class="sheet-info">
-                    {% for sheet_name, df in current_data.items() %}
+                    {% for sheet_name, shape in sheets %}
                         <div class="sheet-item {% if sheet_name == current_sheet %}current{% endif %}">
                             <div>
                                 <strong>{{ sheet_name }}</strong>
                                 {% if sheet_name == current_sheet %}(current){% endif %}
-                                - {{ df.shape[0] }} rows × {{ df.shape[1] }} columns
+                                {% if shape %}- {{ shape[0] }} rows × {{ shape[1] }} columns{% endif %}
                             </div>
                             <button onclick="switchSheet('{{ sheet_name }}')" class="switch-btn">Switch</button>
                         </div>
@@ -251,6 +307,17 @@ HTML_TEMPLATE = """
                                placeholder="e.g., 'show first 10 rows', 'copy Insurance column to Insurance New', 'count appointments by office'"
                                style="width: 100%;">
                     </div>
+                    <div class="form-group">
+                        <label><input type="checkbox" name="background" value="1"> Run in the background</label>
+                    </div>
+                    <div class="form-group">
+                        <label for="profile">Profile:</label>
+                        <select id="profile" name="profile">
+                            <option value="">Off</option>
+                            <option value="pstats">cProfile (.pstats)</option>
+                            <option value="speedscope">Sampling (speedscope)</option>
+                        </select>
+                    </div>
                     <button type="submit" id="execute-btn">🚀 Execute Instruction</button>
                 </form>
                 
@@ -282,6 +349,15 @@ HTML_TEMPLATE = """
                         <input type="text" id="filename" name="filename" 
                                placeholder="processed_data.xlsx">
                     </div>
+                    <div class="form-group">
+                        <label for="format">Format (multi-sheet CSV, Parquet and Arrow exports download as a zip):</label>
+                        <select id="format" name="format">
+                            <option value="xlsx">Excel (.xlsx)</option>
+                            <option value="csv">CSV, gzipped (.csv.gz)</option>
+                            <option value="parquet">Parquet (.parquet)</option>
+                            <option value="arrow">Arrow IPC (.arrow)</option>
+                        </select>
+                    </div>
                     <button type="submit">💾 Export Current Data</button>
                 </form>
             </div>
@@ -297,6 +373,10 @@ HTML_TEMPLATE = """
                         Ready to process your instructions...
                     {% endif %}
                 </div>
+                {% if profile_url %}
+                    <p>🔬 <a href="{{ profile_url }}">Download profile</a>
+                    {% if profile_url.endswith('.speedscope.json') %}(open it at https://www.speedscope.app){% else %}(open it with <code>python -m pstats</code> or snakeviz){% endif %}</p>
+                {% endif %}
             </div>
         </div>
     </div>
@@ -345,9 +425,31 @@ HTML_TEMPLATE = """
             output.scrollTop = output.scrollHeight;
         }
 
+        // Poll a background job, showing its output as it is printed
+        function pollJob(jobId) {
+            fetch('/jobs/' + jobId)
+            .then(response => response.json())
+            .then(data => {
+                const output = document.getElementById('output');
+                if (!data.status) {
+                    output.textContent = 'Error: ' + data.error;
+                    return;
+                }
+                output.textContent = data.output || ('⏳ Job ' + jobId + ' is ' + data.status + '...');
+                scrollOutput();
+                if (data.status === 'queued' || data.status === 'running') {
+                    setTimeout(() => pollJob(jobId), 1000);
+                }
+            })
+            .catch(error => {
+                setTimeout(() => pollJob(jobId), 2000);
+            });
+        }
+
         // Scroll output on page load
         window.onload = function() {
             scrollOutput();
+            {% if job_id %}pollJob('{{ job_id }}');{% endif %}
         }
 
         // Reset app function
@@ -379,425 +481,262 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def process_instruction(instruction, df):
-    """Process instruction and return code to execute"""
+COMMANDS = CommandRegistry()
+
+
+@COMMANDS.register('show_head')
+def show_head(df, params):
+    print(df.head(params['n']))
+
+
+@COMMANDS.register('show_tail')
+def show_tail(df, params):
+    print(df.tail(params['n']))
+
+
+@COMMANDS.register('data_info', uses_stats=True, heavy=True)
+def data_info(df, params, stats):
+    print("=== DATA INFO ===")
+    print(f"Shape: {df.shape}")
+    print(f"Columns: {list(df.columns)}")
+    print("\nData types:")
+    print(df.dtypes)
+    print("\nMissing values:")
+    print(stats.null_counts())
+    print("\nBasic statistics:")
+    print(stats.describe())
+
+
+@COMMANDS.register('copy_insurance', mutates=True)
+def copy_insurance(df, params):
+    df['Insurance New'] = df['Insurance']
+    print(f"✅ Copied Insurance column to Insurance New")
+    print(f"Insurance New now has {df['Insurance New'].notna().sum()} non-null values")
+
+
+@COMMANDS.register('list_columns')
+def list_columns(df, params):
+    print(params['message'], list(df.columns))
+
+
+@COMMANDS.register('reformat_insurance', mutates=True, heavy=True)
+def reformat_insurance(df, params):
+    # Apply the reformatting once per distinct value
+    df['Insurance New'] = normalize_column(df['Insurance'], format_insurance_name)
+
+    print("✅ Insurance column reformatted to match expected format!")
+    print("Sample of original vs reformatted:")
+    sample_df = df[['Insurance', 'Insurance New']].head(15)
+    print(sample_df.to_string(index=False))
+    print(f"\nTotal reformatted entries: {df['Insurance New'].notna().sum()}")
+    print("\nUnique reformatted values:")
+    print(df['Insurance New'].value_counts().head(25))
+
+
+@COMMANDS.register('value_counts', uses_stats=True)
+def value_counts(df, params, stats):
+    print(params['title'])
+    counts = stats.value_counts(params['column'])
+    print(counts.head(params['top']) if params.get('top') else counts)
+
+
+@COMMANDS.register('filter_rows', uses_stats=True)
+def filter_rows(df, params, stats):
+    column = params['column']
+    if column not in df.columns:
+        print(f"Column '{column}' not found. Available columns:", list(df.columns))
+        return
+    values, rows = stats.row_index(column).lookup(params['value'])
+    if not values:
+        if params.get('explicit', True):
+            print(f"No rows where {column} is '{params['value']}'. Available values:")
+        else:
+            # Not a value, just more words, e.g. "filter insurance types"
+            print(f"Available {column} values:")
+        print(stats.value_counts(column).head(10))
+        return
+    print(f"Filtered {len(rows)} rows where {column} is {' / '.join(map(str, values))}")
+    print(df.take(rows).head(params['n']))
+
+
+@COMMANDS.register('filter_dates', uses_stats=True)
+def filter_dates(df, params, stats):
+    column = params['column']
+    if column not in df.columns or df[column].dtype.kind != 'M':
+        print(f"'{column}' is not a date column. Available columns:", list(df.columns))
+        return
+    start = params['start'].normalize()
+    end = params['end'].normalize()
+    rows = stats.date_index(column).between(start, end + pd.Timedelta(days=1))
+    print(f"Filtered {len(rows)} rows with {column} from {start.date()} to {end.date()}")
+    print(df.take(rows).head(params['n']))
+
+
+@COMMANDS.register('date_buckets', uses_stats=True)
+def date_buckets(df, params, stats):
+    column = params['column']
+    if column not in df.columns or df[column].dtype.kind != 'M':
+        print(f"'{column}' is not a date column. Available columns:", list(df.columns))
+        return
+    print(params['title'])
+    print(stats.date_index(column).buckets(params['freq']))
+
+
+@COMMANDS.register('count_records')
+def count_records(df, params):
+    print(f'Total records: {len(df)}')
+
+
+@COMMANDS.register('summary_report', uses_stats=True, heavy=True)
+def summary_report(df, params, stats):
+    print("=== SUMMARY REPORT ===")
+    print(f"Total records: {len(df)}")
+    if 'Appoinment Date' in df.columns:
+        print(f"Date range: {stats.min('Appoinment Date')} to {stats.max('Appoinment Date')}")
+    if 'Office Name' in df.columns:
+        print(f"Unique offices: {stats.nunique('Office Name')}")
+    if 'Provider Name' in df.columns:
+        print(f"Unique providers: {stats.nunique('Provider Name')}")
+    if 'Patient ID' in df.columns:
+        print(f"Unique patients: {stats.nunique('Patient ID')}")
+    print("\nTop 5 Insurance types:")
+    if 'Insurance' in df.columns:
+        print(stats.value_counts('Insurance').head())
+    print("\nTop 5 Offices:")
+    if 'Office Name' in df.columns:
+        print(stats.value_counts('Office Name').head())
+
+
+@COMMANDS.register('complex_instruction')
+def complex_instruction(df, params):
+    try:
+        print(f"Processing complex instruction: {params['instruction']}")
+        print("Available columns:", list(df.columns))
+
+        # For complex instructions, show sample data first
+        print("\nSample data from Insurance column:")
+        if 'Insurance' in df.columns:
+            print(df['Insurance'].head(10).astype(object).to_string())
+        else:
+            print("Insurance column not found. Available columns:", list(df.columns))
+
+        print("\nFor complex data transformations, try these specific commands:")
+        print("- 'reformat insurance column' - Clean up insurance names")
+        print("- 'show first 10 rows' - Display sample data")
+        print("- 'count insurance types' - Count unique insurance types")
+        print("- 'copy Insurance to Insurance New' - Copy column data")
+
+    except Exception as e:
+        print(f"Error processing instruction: {e}")
+        print("Please try a simpler instruction or use one of the suggested commands above.")
+
+
+def process_instruction(instruction):
+    """Resolve instruction to a registered command"""
     instruction = instruction.lower().strip()
     
     if "show" in instruction or "display" in instruction:
         if "first" in instruction:
             num = extract_number(instruction) or 10
-            return f"print(df.head({num}))"
+            return COMMANDS.command('show_head', n=num)
         elif "last" in instruction:
             num = extract_number(instruction) or 10
-            return f"print(df.tail({num}))"
+            return COMMANDS.command('show_tail', n=num)
         else:
-            return "print(df.head(10))"
+            return COMMANDS.command('show_head', n=10)
     
     elif "info" in instruction or "describe" in instruction:
-        return """
-print("=== DATA INFO ===")
-print(f"Shape: {df.shape}")
-print(f"Columns: {list(df.columns)}")
-print("\\nData types:")
-print(df.dtypes)
-print("\\nMissing values:")
-print(df.isnull().sum())
-print("\\nBasic statistics:")
-print(df.describe())
-"""
+        return COMMANDS.command('data_info')
     
     elif "copy" in instruction and "column" in instruction:
         if "insurance" in instruction and "insurance new" in instruction:
-            return """
-df['Insurance New'] = df['Insurance']
-print(f"✅ Copied Insurance column to Insurance New")
-print(f"Insurance New now has {df['Insurance New'].notna().sum()} non-null values")
-"""
+            return COMMANDS.command('copy_insurance')
         else:
-            return "print('Available columns for copying:', list(df.columns))"
+            return COMMANDS.command('list_columns', message='Available columns for copying:')
     
     elif "reformat" in instruction and "insurance" in instruction:
-        return """
-import re
-
-# State abbreviations mapping
-STATE_ABBREVIATIONS = {
-    'AL': 'Alabama', 'AK': 'Alaska', 'AR': 'Arkansas', 'AZ': 'Arizona',
-    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
-    'DC': 'District of Columbia', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
-    'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
-    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine',
-    'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
-    'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska',
-    'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico',
-    'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
-    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island',
-    'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas',
-    'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
-    'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'
-}
-
-def expand_state_abbreviations(text):
-    \"\"\"Expand state abbreviations to full state names\"\"\"
-    if pd.isna(text):
-        return text
-    
-    text_str = str(text)
-    
-    # Look for state abbreviations (2 letters, possibly with spaces around them)
-    for abbr, full_name in STATE_ABBREVIATIONS.items():
-        # Match abbreviation at word boundaries
-        pattern = r'\\b' + abbr + r'\\b'
-        text_str = re.sub(pattern, full_name, text_str, flags=re.IGNORECASE)
-    
-    return text_str
-
-# Reformat Insurance column to match the expected format
-def format_insurance_name(insurance_text):
-    if pd.isna(insurance_text):
-        return insurance_text
-    
-    insurance_str = str(insurance_text).strip()
-    
-    # Handle special cases first
-    if insurance_str.upper() == 'NO INSURANCE':
-        return 'No Insurance'
-    elif insurance_str.upper() == 'PATIENT NOT FOUND':
-        return 'PATIENT NOT FOUND'
-    elif insurance_str.upper() == 'DUPLICATE':
-        return 'DUPLICATE'
-    elif re.search(r'no\s+patient\s+chart', insurance_str, re.IGNORECASE):
-        return 'No Patient chart'
-    
-    # Extract company name before "Ph#"
-    if "Ph#" in insurance_str:
-        company_name = insurance_str.split("Ph#")[0].strip()
-    else:
-        company_name = insurance_str
-    
-    # Remove "Primary" and "Secondary" text
-    company_name = re.sub(r'\s*\(Primary\)', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*\(Secondary\)', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*Primary', '', company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r'\s*Secondary', '', company_name, flags=re.IGNORECASE)
-    
-    # Handle Delta Dental variations
-    if re.search(r'delta\s+dental', company_name, re.IGNORECASE):
-        # Extract state from Delta Dental
-        delta_match = re.search(r'delta\s+dental\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-        if delta_match:
-            state = delta_match.group(1).strip()
-            # Expand state abbreviations
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        else:
-            return "DD"
-    
-    # Handle Anthem variations FIRST (before BCBS to avoid conflicts)
-    if re.search(r'anthem|blue\s+cross.*anthem|anthem.*blue\s+cross', company_name, re.IGNORECASE):
-        return "Anthem"
-    
-    # Handle BCBS variations
-    elif re.search(r'bcbs|bc/bs|bc\s+of|blue\s+cross|blue\s+shield|bcbbs', company_name, re.IGNORECASE):
-        # Check for full "Blue Cross Blue Shield" pattern first
-        if re.search(r'blue\s+cross\s+blue\s+shield', company_name, re.IGNORECASE):
-            # Extract state from "Blue Cross Blue Shield of [State]"
-            bcbs_match = re.search(r'blue\s+cross\s+blue\s+shield\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BC/BS patterns
-        elif re.search(r'bc/bs', company_name, re.IGNORECASE):
-            bcbs_match = re.search(r'bc/bs\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BC Of patterns
-        elif re.search(r'bc\s+of', company_name, re.IGNORECASE):
-            bcbs_match = re.search(r'bc\s+of\s+(.+)', company_name, re.IGNORECASE)
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BCBBS typo
-        elif re.search(r'bcbbs', company_name, re.IGNORECASE):
-            return "BCBS"
-        # Handle other BCBS patterns
-        else:
-            bcbs_match = re.search(r'(?:bcbs|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)', company_name, re.IGNORECASE)
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-    
-    # Handle other specific companies
-    elif re.search(r'metlife|met\s+life', company_name, re.IGNORECASE):
-        return "Metlife"
-    elif re.search(r'cigna', company_name, re.IGNORECASE):
-        return "Cigna"
-    elif re.search(r'aarp', company_name, re.IGNORECASE):
-        return "AARP"
-    elif re.search(r'adn\s+administrators', company_name, re.IGNORECASE):
-        return "ADN Administrators"
-    elif re.search(r'beam', company_name, re.IGNORECASE):
-        return "Beam"
-    elif re.search(r'uhc|united.*health|united.*heal|unitedhelathcare', company_name, re.IGNORECASE):
-        return "UHC"
-    elif re.search(r'teamcare', company_name, re.IGNORECASE):
-        return "Teamcare"
-    elif re.search(r'humana', company_name, re.IGNORECASE):
-        return "Humana"
-    elif re.search(r'aetna', company_name, re.IGNORECASE):
-        return "Aetna"
-    elif re.search(r'guardian', company_name, re.IGNORECASE):
-        return "Guardian"
-    elif re.search(r'g\s*e\s*h\s*a', company_name, re.IGNORECASE):
-        return "GEHA"
-    elif re.search(r'principal', company_name, re.IGNORECASE):
-        return "Principal"
-    elif re.search(r'ameritas', company_name, re.IGNORECASE):
-        return "Ameritas"
-    elif re.search(r'physicians\s+mutual', company_name, re.IGNORECASE):
-        return "Physicians Mutual"
-    elif re.search(r'mutual\s+of\s+omaha', company_name, re.IGNORECASE):
-        return "Mutual Omaha"
-    elif re.search(r'sunlife|sun\s+life', company_name, re.IGNORECASE):
-        return "Sunlife"
-    elif re.search(r'liberty(?:\s+dental)?', company_name, re.IGNORECASE):
-        return "Liberty Dental Plan"
-    elif re.search(r'careington', company_name, re.IGNORECASE):
-        return "Careington Benefit Solutions"
-    elif re.search(r'automated\s+benefit', company_name, re.IGNORECASE):
-        return "Automated Benefit Services Inc"
-    elif re.search(r'network\s+health', company_name, re.IGNORECASE):
-        # Check if it has "Wisconsin" in the name
-        if re.search(r'wisconsin', company_name, re.IGNORECASE):
-            return "Network Health Wisconsin"
-        else:
-            return "Network Health Go"
-    elif re.search(r'regence', company_name, re.IGNORECASE):
-        return "REGENCE BCBS"
-    elif re.search(r'united\s+concordia', company_name, re.IGNORECASE):
-        return "United Concordia"
-    elif re.search(r'medical\s+mutual', company_name, re.IGNORECASE):
-        return "Medical Mutual"
-    elif re.search(r'blue\s+care\s+dental', company_name, re.IGNORECASE):
-        return "Blue Care Dental"
-    elif re.search(r'dominion\s+dental', company_name, re.IGNORECASE):
-        return "Dominion Dental"
-    elif re.search(r'carefirst', company_name, re.IGNORECASE):
-        return "CareFirst BCBS"
-    elif re.search(r'health\s*partners', company_name, re.IGNORECASE):
-        # Check if it has "of [State]" pattern
-        if re.search(r'health\s*partners\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'health\s*partners\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            return f"Health Partners {state}"
-        else:
-            return "Health Partners"
-    elif re.search(r'keenan', company_name, re.IGNORECASE):
-        return "Keenan"
-    elif re.search(r'wilson\s+mcshane', company_name, re.IGNORECASE):
-        return "Wilson McShane- Delta Dental"
-    elif re.search(r'standard\s+(?:life\s+)?insurance', company_name, re.IGNORECASE):
-        return "Standard Life Insurance"
-    elif re.search(r'plan\s+for\s+health', company_name, re.IGNORECASE):
-        return "Plan for Health"
-    elif re.search(r'kansas\s+city', company_name, re.IGNORECASE):
-        return "Kansas City"
-    elif re.search(r'the\s+guardian', company_name, re.IGNORECASE):
-        return "The Guardian"
-    elif re.search(r'community\s+dental', company_name, re.IGNORECASE):
-        return "Community Dental Associates"
-    elif re.search(r'northeast\s+delta\s+dental', company_name, re.IGNORECASE):
-        return "Northeast Delta Dental"
-    elif re.search(r'say\s+cheese\s+dental', company_name, re.IGNORECASE):
-        return "Say Cheese Dental Network"
-    elif re.search(r'dentaquest', company_name, re.IGNORECASE):
-        return "Dentaquest"
-    elif re.search(r'umr', company_name, re.IGNORECASE):
-        return "UMR"
-    elif re.search(r'mhbp', company_name, re.IGNORECASE):
-        return "MHBP"
-    elif re.search(r'united\s+states\s+army', company_name, re.IGNORECASE):
-        return "United States Army"
-    elif re.search(r'conversion\s+default', company_name, re.IGNORECASE):
-        return "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!"
-    elif re.search(r'equitable', company_name, re.IGNORECASE):
-        return "Equitable"
-    elif re.search(r'manhattan\s+life', company_name, re.IGNORECASE):
-        return "Manhattan Life"
-    elif re.search(r'ucci', company_name, re.IGNORECASE):
-        return "UCCI"
-    elif re.search(r'ccpoa|cc\s*poa|c\s+c\s+p\s+o\s+a', company_name, re.IGNORECASE):
-        return "CCPOA"
-    elif re.search(r'dd\s+of|dd\s+[a-z]{2}|delta\s+dental|dental\s+dental|denta\s+dental|dleta\s+dental|dektal?\s+dental', company_name, re.IGNORECASE):
-        # Extract state from various Delta Dental patterns
-        # Handle DD OF [State] pattern
-        if re.search(r'dd\s+of\s+([a-z]{2})', company_name, re.IGNORECASE):
-            state_match = re.search(r'dd\s+of\s+([a-z]{2})', company_name, re.IGNORECASE)
-            state = state_match.group(1).upper()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle DD [State] pattern
-        elif re.search(r'dd\s+([a-z]{2})', company_name, re.IGNORECASE):
-            state_match = re.search(r'dd\s+([a-z]{2})', company_name, re.IGNORECASE)
-            state = state_match.group(1).upper()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Delta Dental of [State] pattern
-        elif re.search(r'delta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'delta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Dental Dental Of [State] pattern
-        elif re.search(r'dental\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'dental\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Denta Dental Of [State] pattern
-        elif re.search(r'denta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'denta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Dleta Dental of [State] pattern
-        elif re.search(r'dleta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'dleta\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Dekta Dental of [State] pattern
-        elif re.search(r'dektal?\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'dektal?\s+dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Dental of [State] pattern
-        elif re.search(r'dental\s+of\s+(.+)', company_name, re.IGNORECASE):
-            state_match = re.search(r'dental\s+of\s+(.+)', company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f'DD {state}'
-        # Handle Dental Network of America
-        elif re.search(r'dental\s+network\s+of\s+america', company_name, re.IGNORECASE):
-            return 'DD Network of America'
-        # Default DD
-        else:
-            return 'DD'
-    
-    # If no specific pattern matches, return the cleaned company name
-    return company_name.strip()
-
-# Apply the reformatting
-df['Insurance New'] = df['Insurance'].apply(format_insurance_name)
-
-print("✅ Insurance column reformatted to match expected format!")
-print("Sample of original vs reformatted:")
-sample_df = df[['Insurance', 'Insurance New']].head(15)
-print(sample_df.to_string(index=False))
-print(f"\\nTotal reformatted entries: {df['Insurance New'].notna().sum()}")
-print("\\nUnique reformatted values:")
-print(df['Insurance New'].value_counts().head(25))
-"""
+        return COMMANDS.command('reformat_insurance')
     
     elif "count" in instruction:
         if "insurance" in instruction:
-            return "print('Insurance counts:')\nprint(df['Insurance'].value_counts())"
+            return COMMANDS.command('value_counts', column='Insurance', title='Insurance counts:')
         elif "office" in instruction:
-            return "print('Office counts:')\nprint(df['Office Name'].value_counts())"
+            return COMMANDS.command('value_counts', column='Office Name', title='Office counts:')
         elif "provider" in instruction:
-            return "print('Provider counts:')\nprint(df['Provider Name'].value_counts())"
+            return COMMANDS.command('value_counts', column='Provider Name', title='Provider counts:')
+        elif "month" in instruction:
+            return COMMANDS.command('date_buckets', column='Appoinment Date', freq='M', title='Appointments per month:')
+        elif "day" in instruction or "daily" in instruction:
+            return COMMANDS.command('date_buckets', column='Appoinment Date', freq='D', title='Appointments per day:')
         else:
-            return "print(f'Total records: {len(df)}')"
+            return COMMANDS.command('count_records')
     
     elif "filter" in instruction:
-        if "office" in instruction:
-            return "print('Available offices:')\nprint(df['Office Name'].value_counts().head(10))"
+        column, value, explicit = extract_filter(instruction)
+        dates = extract_dates(instruction)
+        if "date" in instruction and dates:
+            return COMMANDS.command('filter_dates', column='Appoinment Date', start=dates[0], end=dates[-1], n=10)
+        elif value:
+            return COMMANDS.command('filter_rows', column=column, value=value, explicit=explicit, n=10)
+        elif "office" in instruction:
+            return COMMANDS.command('value_counts', column='Office Name', title='Available offices:', top=10)
         elif "insurance" in instruction:
-            return "print('Available insurance types:')\nprint(df['Insurance'].value_counts().head(10))"
+            return COMMANDS.command('value_counts', column='Insurance', title='Available insurance types:', top=10)
         else:
-            return "print('Available columns for filtering:', list(df.columns))"
+            return COMMANDS.command('list_columns', message='Available columns for filtering:')
     
     elif "summary" in instruction or "report" in instruction:
-        return """
-print("=== SUMMARY REPORT ===")
-print(f"Total records: {len(df)}")
-if 'Appoinment Date' in df.columns:
-    print(f"Date range: {df['Appoinment Date'].min()} to {df['Appoinment Date'].max()}")
-if 'Office Name' in df.columns:
-    print(f"Unique offices: {df['Office Name'].nunique()}")
-if 'Provider Name' in df.columns:
-    print(f"Unique providers: {df['Provider Name'].nunique()}")
-if 'Patient ID' in df.columns:
-    print(f"Unique patients: {df['Patient ID'].nunique()}")
-print("\\nTop 5 Insurance types:")
-if 'Insurance' in df.columns:
-    print(df['Insurance'].value_counts().head())
-print("\\nTop 5 Offices:")
-if 'Office Name' in df.columns:
-    print(df['Office Name'].value_counts().head())
-"""
+        return COMMANDS.command('summary_report')
     
     else:
         # Try to handle complex instructions with better error handling
-        return f"""
-try:
-    print("Processing complex instruction: {instruction}")
-    print("Available columns:", list(df.columns))
-    
-    # For complex instructions, show sample data first
-    print("\\nSample data from Insurance column:")
-    if 'Insurance' in df.columns:
-        print(df['Insurance'].head(10).to_string())
-    else:
-        print("Insurance column not found. Available columns:", list(df.columns))
-    
-    print("\\nFor complex data transformations, try these specific commands:")
-    print("- 'reformat insurance column' - Clean up insurance names")
-    print("- 'show first 10 rows' - Display sample data")
-    print("- 'count insurance types' - Count unique insurance types")
-    print("- 'copy Insurance to Insurance New' - Copy column data")
-    
-except Exception as e:
-    print(f"Error processing instruction: {{e}}")
-    print("Please try a simpler instruction or use one of the suggested commands above.")
-"""
-
-def extract_number(text):
-    """Extract number from text"""
-    numbers = re.findall(r'\d+', text)
-    return int(numbers[0]) if numbers else None
+        return COMMANDS.command('complex_instruction', instruction=instruction)
+
+def current_session():
+    """Return the workbook session for this browser, assigning an id if needed"""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not is_valid_session_id(session_id):
+        session_id = new_session_id()
+        g.new_session_id = session_id
+    with stage('session'):
+        return sessions.get(session_id)
+
+@app.after_request
+def set_session_cookie(response):
+    session_id = g.pop('new_session_id', None)
+    if session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+def log_sheet_load(filename):
+    def log(report):
+        print(f"📊 {filename} / {report}")
+        if report.engine == 'cache':
+            stats = workbook_cache.stats()
+            print(f"♻️ Workbook cache hit rate: {stats['hit_rate']:.0%} "
+                  f"({stats['hits']}/{stats['hits'] + stats['misses']})")
+    return log
+
+def render_session(session, output="", job_id=None, profile_url=None):
+    with stage('render'):
+        return render_template_string(HTML_TEMPLATE, 
+                                    job_id=job_id,
+                                    profile_url=profile_url,
+                                    current_data=session.data, 
+                                    sheets=[(name, session.data.shape(name)) for name in session.data],
+                                    current_sheet=session.current_sheet, 
+                                    current_filename=session.filename,
+                                    output=output)
 
 @app.route('/')
 def index():
-    global current_data, current_sheet, current_filename, conversation_history
+    session = current_session()
     
-    return render_template_string(HTML_TEMPLATE, 
-                                current_data=current_data, 
-                                current_sheet=current_sheet, 
-                                current_filename=current_filename,
-                                output="")
+    return render_session(session)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global current_data, current_sheet, current_filename, conversation_history
+    session = current_session()
     
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -807,20 +746,25 @@ def upload_file():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        # Save uploaded file
+        # Queued instructions for the old workbook are dropped; running ones
+        # see the new upload when they finish and discard their results
         filename = secure_filename(file.filename)
-        file.save(filename)
-        
-        # Load Excel file
-        current_data = pd.read_excel(filename, sheet_name=None)
-        current_filename = filename
-        conversation_history = []
+        jobs.cancel(session.session_id)
         
-        # Set the main sheet as current
-        if 'Consolidated' in current_data:
-            current_sheet = 'Consolidated'
-        else:
-            current_sheet = list(current_data.keys())[0]
+        with sessions.lock(session.session_id):
+            # Save uploaded file into a fresh session directory
+            session = sessions.reset(session.session_id)
+            source_path = session.source_path_for(filename)
+            with stage('upload'):
+                file.save(source_path)
+            
+            # Read sheet names and sizes only; sheets are parsed when first used
+            with stage('inspect'):
+                data = LazyWorkbook(source_path, on_load=log_sheet_load(filename), track_memory=TRACK_LOAD_MEMORY,
+                                    workbook_cache=workbook_cache, optimize=OPTIMIZE_DTYPES)
+                session.load_workbook(filename, data)
+            with stage('save'):
+                sessions.save(session)
         
         return redirect(url_for('index'))
         
@@ -829,9 +773,9 @@ def upload_file():
 
 @app.route('/execute', methods=['POST'])
 def execute_instruction():
-    global current_data, current_sheet, conversation_history
+    session = current_session()
     
-    if not current_data:
+    if not session.data:
         return jsonify({'error': 'No file loaded'}), 400
     
     instruction = request.form.get('instruction', '').strip()
@@ -840,53 +784,151 @@ def execute_instruction():
     
     try:
         # Add to conversation history
-        conversation_history.append({
-            'timestamp': datetime.now(),
-            'instruction': instruction,
-            'sheet': current_sheet
-        })
+        with sessions.lock(session.session_id):
+            session.conversation_history.append({
+                'timestamp': datetime.now(),
+                'instruction': instruction,
+                'sheet': session.current_sheet
+            })
+        
+        # Resolve instruction to a built-in command
+        with stage('parse'):
+            command = process_instruction(instruction)
+        sheet_name = session.current_sheet
         
-        # Get current dataframe
-        df = current_data[current_sheet].copy()
+        # Profiled instructions always run in the request
+        profile_format = get_profile_format(request.headers.get('X-Profile') or request.form.get('profile'))
+        if profile_format:
+            return run_profiled(session, sheet_name, command, profile_format)
         
-        # Generate code
-        code = process_instruction(instruction, df)
+        # On big sheets, heavy commands and the first parse of the sheet run
+        # on the job pool; quick ones like showing rows answer directly
+        shape = session.data.shape(sheet_name)
+        big_sheet = shape and shape[0] >= BACKGROUND_JOB_ROWS
+        if request.form.get('background') == '1' or (
+                big_sheet and (command.heavy or not session.data.is_loaded(sheet_name))):
+            try:
+                job = jobs.submit(session.session_id, instruction,
+                                  lambda output: run_job(session, sheet_name, command, output))
+            except QueueFull as e:
+                return jsonify({'error': str(e)}), 503
+            return render_session(session, f"⏳ Running in the background as job {job.job_id}...", job.job_id)
         
-        # Execute code
+        # Execute command
         import io
-        import sys
-        from contextlib import redirect_stdout
         
         output_buffer = io.StringIO()
-        
-        with redirect_stdout(output_buffer):
-            exec(code, {'df': df, 'pd': pd, 'print': print})
-        
+        run_command(session, sheet_name, command, output_buffer)
         output = output_buffer.getvalue()
         
-        # Update data if modified
-        if 'df' in locals():
-            current_data[current_sheet] = df
-        
-        return render_template_string(HTML_TEMPLATE, 
-                                   current_data=current_data, 
-                                   current_sheet=current_sheet, 
-                                   current_filename=current_filename,
-                                   output=output)
+        return render_session(session, output)
         
     except Exception as e:
         error_output = f"Error executing instruction: {str(e)}"
-        return render_template_string(HTML_TEMPLATE, 
-                                   current_data=current_data, 
-                                   current_sheet=current_sheet, 
-                                   current_filename=current_filename,
-                                   output=error_output)
+        return render_session(session, error_output)
+
+def run_command(session, sheet_name, command, output):
+    """Run a resolved command on a session's sheet, printing into output, and save the session
+
+    The session is looked up again under its lock before and after the
+    command runs. If the workbook was re-uploaded or reset in between, or
+    another instruction modified the same sheet while a mutating command
+    ran, the result is discarded instead of overwriting the newer state.
+    """
+    session_id, upload_id = session.session_id, session.upload_id
+    with stage('load'):
+        with sessions.lock(session_id):
+            session = sessions.get(session_id)
+            if session.upload_id != upload_id or sheet_name not in session.data:
+                return discard_result(output, "the workbook was replaced")
+            sheet_version = session.sheet_versions.get(sheet_name, 0)
+        
+        # Read-only commands run on the live frame with its cached statistics;
+        # mutating ones get a shallow copy, and copy-on-write duplicates only
+        # the columns they touch
+        if command.mutates:
+            df, stats = session.data[sheet_name].copy(deep=False), None
+        else:
+            df, stats = session.data.with_stats(sheet_name)
+    
+    with capture_output(output), stage('exec'):
+        command(df, stats)
+    
+    # Update data if modified
+    with stage('save'), sessions.lock(session_id):
+        session = sessions.get(session_id)
+        if session.upload_id != upload_id:
+            return discard_result(output, "the workbook was replaced")
+        if command.mutates:
+            if session.sheet_versions.get(sheet_name, 0) != sheet_version:
+                return discard_result(output, f"'{sheet_name}' was modified by another instruction")
+            session.set_sheet(sheet_name, df)
+        sessions.save(session)
+
+def discard_result(output, reason):
+    with capture_output(output):
+        print(f"⚠️ Result discarded: {reason} while this instruction ran.")
+
+def run_profiled(session, sheet_name, command, profile_format):
+    """Run a command under the profiler and render its output with a link to the profile"""
+    import io
+    
+    directory = os.path.join(session.directory, PROFILE_DIR)
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{command.name}{PROFILE_FORMATS[profile_format]}"
+    output = io.StringIO()
+    with profiled(profile_format, os.path.join(directory, name), name=f"{command!r}") as profile:
+        try:
+            run_command(session, sheet_name, command, output)
+        except Exception as e:
+            output.write(f"Error executing instruction: {str(e)}\n")
+    prune_profiles(directory)
+    
+    output.write(f"\n{profile}\nSlowest functions (cumulative):\n{profile.summary}\n")
+    return render_session(session, output.getvalue(), profile_url=url_for('download_profile', name=name))
+
+def prune_profiles(directory):
+    """Delete all but the newest MAX_PROFILES profiles in directory"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if PROFILE_NAME.match(name))
+    except OSError:
+        return
+    for name in names[:max(0, len(names) - MAX_PROFILES)]:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
+
+@app.route('/profiles/<name>')
+def download_profile(name):
+    session = current_session()
+    
+    # Profiles live in the session's directory, so only its owner can fetch them
+    path = os.path.join(session.directory, PROFILE_DIR, name)
+    if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+        return jsonify({'error': f'Profile "{name}" not found'}), 404
+    
+    return send_file(path, as_attachment=True, download_name=name)
+
+def run_job(session, sheet_name, command, output):
+    """run_command on the job pool, timed in /metrics as a 'job' request"""
+    with metrics.track('job'):
+        run_command(session, sheet_name, command, output)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    
+    # Jobs are only visible to the session that started them
+    if job is None or job.owner != request.cookies.get(SESSION_COOKIE):
+        return jsonify({'error': f'Job "{job_id}" not found'}), 404
+    
+    return jsonify(job.as_dict())
 
 @app.route('/switch_sheet', methods=['POST'])
 def switch_sheet():
-    global current_data, current_sheet
+    session = current_session()
     
-    if not current_data:
+    if not session.data:
         return jsonify({'error': 'No file loaded'}), 400
     
     data = request.get_json()
@@ -895,58 +937,67 @@ def switch_sheet():
     if not sheet_name:
         return jsonify({'error': 'No sheet name provided'}), 400
     
-    if sheet_name in current_data:
-        current_sheet = sheet_name
-        return jsonify({'success': True, 'current_sheet': current_sheet})
+    if sheet_name in session.data:
+        # Parse the sheet now so the next instruction doesn't wait for it
+        with stage('load'):
+            session.data[sheet_name]
+        with stage('save'), sessions.lock(session.session_id):
+            session = sessions.get(session.session_id)
+            if sheet_name not in session.data:
+                return jsonify({'error': f'Sheet "{sheet_name}" not found'}), 400
+            session.current_sheet = sheet_name
+            sessions.save(session)
+        return jsonify({'success': True, 'current_sheet': session.current_sheet})
     else:
         return jsonify({'error': f'Sheet "{sheet_name}" not found'}), 400
 
 @app.route('/export', methods=['POST'])
 def export_data():
-    global current_data, current_filename
+    session = current_session()
     
-    if not current_data:
+    if not session.data:
         return jsonify({'error': 'No file loaded'}), 400
     
+    try:
+        export_format = get_export_format(request.form.get('format', 'xlsx'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     filename = request.form.get('filename', '').strip()
     if not filename:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"processed_data_{timestamp}.xlsx"
+    filename = export_filename(filename, export_format, session.data)
     
     try:
-        # Create a temporary file in memory instead of saving to disk
-        import tempfile
-        import os
-        
-        # Create temporary file
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.xlsx')
-        
-        try:
-            with pd.ExcelWriter(temp_path, engine='openpyxl') as writer:
-                for sheet_name, df in current_data.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-            
-            return send_file(temp_path, as_attachment=True, download_name=filename)
-            
-        finally:
-            # Clean up temporary file
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Stream the export to the client as it is encoded, without a
+        # temporary file. For xlsx, sheets no instruction has modified are
+        # copied as-is from the uploaded file
+        chunks = g.request_timer.timed_iter('export', iter_export(
+            session.data, export_format, source_path=session.source_path,
+            modified_sheets=list(session.modified_sheets),
+            on_complete=lambda report: print(f"📦 {filename} / {report}")))
+        # Encode the first chunk before answering, so a sheet that can't be
+        # read or encoded still gets an error response. Later failures abort
+        # the download and are recorded as errors
+        first_chunk = next(chunks, None)
+        body = itertools.chain([first_chunk], chunks) if first_chunk is not None else []
+        response = Response(body, mimetype=export_mimetype(export_format, session.data))
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/reset', methods=['POST'])
 def reset_app():
-    global current_data, current_sheet, current_filename, conversation_history
+    session = current_session()
     
     try:
-        # Reset all data
-        current_data = {}
-        current_sheet = None
-        current_filename = None
-        conversation_history = []
+        # Reset all data; running jobs discard their results when they finish
+        jobs.cancel(session.session_id)
+        with sessions.lock(session.session_id):
+            sessions.delete(session.session_id)
         
         return jsonify({
             'success': True, 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of parsed workbook sheets
+Uploads are keyed by the SHA-256 of their bytes, so re-uploading the same
+file loads its sheets from disk instead of parsing the Excel XML again.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import pyarrow as pa
+
+from sheet_storage import private_directory, read_sheet_table, sheet_table
+
+HASH_CHUNK = 1 << 20
+
+
+def digest_file(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WorkbookCache:
+    """Parsed sheets on disk, evicted least-recently-used beyond max_bytes
+
+    Sheets are stored as uncompressed Arrow IPC files and memory-mapped on
+    load, so numeric columns are read straight from the page cache instead
+    of being decoded. Several worker processes may share root; each evicts
+    from what it has seen there.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        private_directory(root)
+        self._scan()
+
+    def _scan(self):
+        """Index entries left by earlier runs"""
+        for digest in os.listdir(self.root):
+            directory = os.path.join(self.root, digest)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith('.arrow'):
+                    info = os.stat(os.path.join(directory, name))
+                    self._entries[os.path.join(digest, name)] = (info.st_size, info.st_mtime)
+
+    @staticmethod
+    def _entry(digest, key):
+        return os.path.join(digest, f"{key}.arrow")
+
+    def get(self, digest, key):
+        """Return the cached sheet, or None"""
+        entry = self._entry(digest, key)
+        path = os.path.join(self.root, entry)
+        try:
+            with pa.memory_map(path) as source:
+                df = read_sheet_table(pa.ipc.open_file(source).read_all())
+            size = os.path.getsize(path)
+            os.utime(path)
+        except Exception:
+            with self._lock:
+                self.misses += 1
+                self._entries.pop(entry, None)
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._entries[entry] = (size, time.time())
+        return df
+
+    def put(self, digest, key, df):
+        entry = self._entry(digest, key)
+        path = os.path.join(self.root, entry)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            table = sheet_table(df)
+            with pa.OSFile(path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            # The cache is an optimisation; never fail a load because of it
+            print(f"⚠️ Could not cache parsed sheet: {e}")
+            self._remove(path + '.tmp')
+            return
+
+        with self._lock:
+            self._entries[entry] = (os.path.getsize(path), time.time())
+            self._enforce_budget(keep=entry)
+
+    def _enforce_budget(self, keep):
+        total = sum(size for size, _ in self._entries.values())
+        for entry, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            del self._entries[entry]
+            path = os.path.join(self.root, entry)
+            self._remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(size for size, _ in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Streaming Excel workbook loader
+Streams rows from openpyxl in read-only mode and builds each sheet chunk by
+chunk, or uses the calamine engine when EXCEL_READ_ENGINE=calamine and
+python-calamine is installed.
+"""
+
+import os
+import re
+import threading
+import time
+import tracemalloc
+import warnings
+import zipfile
+from collections import OrderedDict, defaultdict
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from dtype_optimizer import optimize_dtypes
+from sheet_stats import StatsCache
+from workbook_cache import digest_file
+
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+# Rows parsed into a DataFrame at a time by the openpyxl streaming path
+CHUNK_ROWS = 50000
+
+# Parsed, unmodified sheets kept per LazyWorkbook
+PARSED_SHEET_CACHE = int(os.environ.get('PARSED_SHEET_CACHE', 4))
+
+# calamine parses several times faster but reads whitespace-only text cells
+# as empty, so it is opt-in
+READ_ENGINE = os.environ.get('EXCEL_READ_ENGINE', 'openpyxl')
+
+
+class SheetLoadReport:
+    """Parse statistics for one sheet"""
+
+    def __init__(self, sheet_name, engine, rows, columns, seconds, frame_bytes, peak_bytes=None):
+        self.sheet_name = sheet_name
+        self.engine = engine
+        self.rows = rows
+        self.columns = columns
+        self.seconds = seconds
+        self.frame_bytes = frame_bytes
+        self.peak_bytes = peak_bytes
+        # DtypeReport when the sheet went through optimize_dtypes
+        self.dtypes = None
+
+    def as_dict(self):
+        report = dict(vars(self))
+        if self.dtypes is not None:
+            report['dtypes'] = self.dtypes.as_dict()
+        return report
+
+    def __str__(self):
+        text = (f"{self.sheet_name}: {self.rows} rows × {self.columns} columns "
+                f"in {self.seconds:.2f}s ({self.engine}, {self.frame_bytes / 1e6:.1f} MB")
+        if self.peak_bytes is not None:
+            text += f", peak {self.peak_bytes / 1e6:.1f} MB"
+        text += ")"
+        if self.dtypes is not None:
+            text += f", {self.dtypes}"
+        return text
+
+
+def default_engine(path):
+    """Pick the configured engine for a workbook path"""
+    if os.path.splitext(str(path))[1].lower() == '.xls':
+        # Legacy format; let pandas pick its reader
+        return None
+    if READ_ENGINE == 'calamine' and not HAS_CALAMINE:
+        return 'openpyxl'
+    return READ_ENGINE
+
+
+def _convert_cell(cell):
+    """Convert an openpyxl cell the same way pandas' openpyxl reader does"""
+    value = cell.value
+    if value is None:
+        return ""
+    elif cell.data_type == 'e':
+        return np.nan
+    elif cell.data_type == 'n':
+        as_int = int(value)
+        if as_int == value:
+            return as_int
+        return float(value)
+    return value
+
+
+def _parse_chunk(header, rows, width, dtype):
+    """Parse rows with the same TextParser settings pd.read_excel uses"""
+    data = [header + [""] * (width - len(header))]
+    data.extend(row + [""] * (width - len(row)) for row in rows)
+    return TextParser(data, header=0, dtype=dtype, skip_blank_lines=False).read()
+
+
+def _infer_column(name, values):
+    """Run read_excel's type inference over one column of raw values"""
+    return TextParser([[name]] + list(zip(values)), header=0, skip_blank_lines=False).read().iloc[:, 0]
+
+
+def _raw_dtype(dtype):
+    """Parse settings that keep raw cell values for columns without an explicit dtype"""
+    if dtype is not None and not isinstance(dtype, dict):
+        return dtype
+    return defaultdict(lambda: object, dtype or {})
+
+
+def _infer_chunk(chunk, dtype):
+    """Infer the types of a raw chunk's columns as if it were the whole sheet
+
+    Returns the typed chunk and, for columns where inference turned text
+    into numbers or booleans, the raw column, which is needed again if
+    other chunks disagree about the column's type.
+    """
+    texts = {}
+    for position, name in enumerate(chunk.columns):
+        if dtype is not None and name in dtype:
+            continue
+        values = chunk.iloc[:, position].tolist()
+        column = _infer_column(name, values)
+        if column.dtype != object and any(isinstance(value, str) and value for value in values):
+            texts[position] = chunk.iloc[:, position]
+        chunk.isetitem(position, column)
+    return chunk, texts
+
+
+def _cell_value(value):
+    """The value _convert_cell gave for a cell that type inference turned into value"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, pd.Timedelta):
+        return value.to_pytimedelta()
+    return value
+
+
+def _raw_values(chunk, texts, position):
+    """One column of a typed chunk as the raw values it was inferred from"""
+    if position in texts:
+        return texts[position].tolist()
+    column = chunk.iloc[:, position]
+    if column.dtype == object:
+        return column.tolist()
+    return [_cell_value(value) for value in column.astype(object).where(column.notna(), np.nan).tolist()]
+
+
+def _widen(chunk, texts, columns):
+    """Give a chunk parsed before a wider row came along that row's columns, all empty"""
+    return chunk.reindex(columns=columns), texts
+
+
+def _combine_chunks(chunks, dtype):
+    """Concatenate typed chunks, re-inferring columns the chunks disagree on
+
+    Chunks that are all numeric, or all of one type, concatenate to what
+    inference over the whole column gives. Otherwise, e.g. a chunk of
+    numeric-looking text followed by one with words, the column is rebuilt
+    from its raw values, so only such a column is ever held as objects.
+    """
+    with warnings.catch_warnings():
+        # All-empty chunk columns are expected; conflicts are fixed below
+        warnings.simplefilter('ignore', FutureWarning)
+        df = pd.concat([chunk for chunk, _ in chunks], ignore_index=True)
+    if dtype is not None and not isinstance(dtype, dict):
+        return df
+
+    for position, name in enumerate(df.columns):
+        if dtype is not None and name in dtype:
+            continue
+        dtypes = {chunk.dtypes.iloc[position] for chunk, _ in chunks}
+        if len(dtypes) == 1 or dtypes <= {np.dtype('int64'), np.dtype('float64')}:
+            continue
+        values = []
+        for chunk, texts in chunks:
+            values.extend(_raw_values(chunk, texts, position))
+        df.isetitem(position, _infer_column(name, values))
+    return df
+
+
+def _stream_openpyxl_sheet(worksheet, dtype, chunk_rows):
+    """Build a DataFrame from a read-only worksheet without materializing
+    every row at once
+
+    Each chunk of rows is typed as soon as it is parsed, so beyond the
+    typed sheet only one chunk, and any column whose chunks disagree about
+    its type, is held as Python objects.
+    """
+    worksheet.reset_dimensions()
+
+    header = None
+    width = 0
+    chunks = []
+    pending = []
+    blank_rows = []
+
+    def parse_pending():
+        chunk = _parse_chunk(header, pending, width, _raw_dtype(dtype))
+        if dtype is not None and not isinstance(dtype, dict):
+            return chunk, {}
+        return _infer_chunk(chunk, dtype)
+
+    for row in worksheet.iter_rows():
+        converted = [_convert_cell(cell) for cell in row]
+        # Trim trailing empty cells
+        while converted and converted[-1] == "":
+            converted.pop()
+
+        if header is None:
+            header = converted
+            width = len(header)
+            continue
+
+        if not converted:
+            # Only kept if data follows, so trailing empty rows are dropped
+            blank_rows.append(converted)
+            continue
+
+        pending.extend(blank_rows)
+        blank_rows = []
+        pending.append(converted)
+        width = max(width, len(converted))
+
+        if len(pending) >= chunk_rows:
+            chunks.append(parse_pending())
+            pending = []
+
+    if header is None or (not header and not chunks and not pending):
+        raise EmptyDataError("No columns to parse from file")
+
+    if not chunks:
+        # Fits in one chunk: parse exactly like pd.read_excel
+        return _parse_chunk(header, pending, width, dtype)
+
+    if pending:
+        chunks.append(parse_pending())
+    if len(chunks[-1][0].columns) > len(chunks[0][0].columns):
+        # A later row was wider; earlier chunks gain all-empty columns
+        chunks = [_widen(chunk, texts, chunks[-1][0].columns) for chunk, texts in chunks]
+    return _combine_chunks(chunks, dtype)
+
+
+def load_excel(path, sheet_names=None, dtype=None, engine=None, chunk_rows=CHUNK_ROWS, track_memory=False,
+               optimize=False):
+    """Load sheets from an Excel file
+
+    Returns (data, reports): a dict of sheet name to DataFrame in workbook
+    order, and a SheetLoadReport per sheet. dtype is passed through to the
+    parser (a type or a column -> type mapping). With track_memory, peak
+    Python-level allocations per sheet are measured with tracemalloc, which
+    slows parsing down noticeably. With optimize, each sheet goes through
+    optimize_dtypes and its report records the memory saved.
+    """
+    engine = engine or default_engine(path)
+    data = {}
+    reports = []
+
+    started_tracing = False
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+
+    try:
+        if engine == 'openpyxl':
+            from openpyxl import load_workbook
+            book = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+            names = book.sheetnames
+            try:
+                for sheet_name in (sheet_names or names):
+                    data[sheet_name], report = _measure(
+                        sheet_name, engine, track_memory,
+                        lambda: _stream_openpyxl_sheet(book[sheet_name], dtype, chunk_rows),
+                    )
+                    reports.append(report)
+            finally:
+                book.close()
+        else:
+            with pd.ExcelFile(path, engine=engine) as excel_file:
+                engine = engine or excel_file.engine
+                for sheet_name in (sheet_names or excel_file.sheet_names):
+                    data[sheet_name], report = _measure(
+                        sheet_name, engine, track_memory,
+                        lambda: excel_file.parse(sheet_name, dtype=dtype),
+                    )
+                    reports.append(report)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    if optimize:
+        for report in reports:
+            data[report.sheet_name], report.dtypes = optimize_dtypes(data[report.sheet_name])
+    return data, reports
+
+
+def _measure(sheet_name, engine, track_memory, parse):
+    if track_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    try:
+        df = parse()
+    except EmptyDataError:
+        # No Data, return an empty DataFrame
+        df = pd.DataFrame()
+    except Exception as err:
+        err.args = (f"{err.args[0]} (sheet: {sheet_name})", *err.args[1:]) if err.args else err.args
+        raise
+    seconds = time.perf_counter() - start
+
+    peak_bytes = tracemalloc.get_traced_memory()[1] - baseline if track_memory else None
+    report = SheetLoadReport(sheet_name, engine, df.shape[0], df.shape[1], seconds,
+                             int(df.memory_usage(deep=True).sum()), peak_bytes)
+    return df, report
+
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_DIMENSION = re.compile(rb'<(?:\w+:)?dimension\s+ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + (ord(letter) - ord('A') + 1)
+    return number
+
+
+def _declared_shape(archive, member):
+    """(rows, columns) from a worksheet's <dimension> element, header excluded"""
+    with archive.open(member) as f:
+        match = _DIMENSION.search(f.read(65536))
+    if not match or not match.group(3):
+        return None
+    return int(match.group(4)) - 1, _column_number(match.group(3).decode())
+
+
+def sheet_parts(archive):
+    """Map sheet names, in workbook order, to their worksheet parts in an .xlsx zip"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in relations}
+
+    parts = OrderedDict()
+    for sheet in workbook.iter(_MAIN_NS + 'sheet'):
+        target = targets[sheet.get(_REL_NS + 'id')]
+        parts[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return parts
+
+
+def read_sheet_dimensions(path):
+    """Sheet names in workbook order with their declared (rows, columns)
+
+    Reads only workbook metadata, not cells or shared strings. Shapes are
+    None where the file does not declare them. Declared shapes can include
+    trailing empty rows that parsing drops.
+    """
+    if os.path.splitext(str(path))[1].lower() == '.xls':
+        with pd.ExcelFile(path) as excel_file:
+            return OrderedDict((name, None) for name in excel_file.sheet_names)
+
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return OrderedDict(
+                (name, _declared_shape(archive, member)) for name, member in sheet_parts(archive).items()
+            )
+    except (KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+        # Unusual package layout; fall back to openpyxl's view of the workbook
+        from openpyxl import load_workbook
+        book = load_workbook(path, read_only=True, keep_links=False)
+        try:
+            return OrderedDict(
+                (ws.title, (ws.max_row - 1, ws.max_column) if ws.max_row and ws.max_column else None)
+                for ws in book.worksheets
+            )
+        finally:
+            book.close()
+
+
+class LazyWorkbook:
+    """Dict-like workbook that parses each sheet on first access
+
+    Only sheet names and declared dimensions are read up front. Parsed
+    sheets that have not been modified are kept in a bounded LRU and
+    re-parsed if evicted; sheets assigned with workbook[name] = df are kept
+    until the workbook is dropped. With a WorkbookCache, parsed sheets are
+    also looked up and stored by the file's content hash. With optimize,
+    sheets are parsed through optimize_dtypes. Statistics of each sheet are
+    cached per column, surviving eviction and re-parsing; assigning a sheet
+    recomputes only the columns that changed.
+    """
+
+    def __init__(self, path, cache_size=PARSED_SHEET_CACHE, on_load=None, track_memory=False,
+                 workbook_cache=None, optimize=False):
+        self.path = path
+        self.cache_size = cache_size
+        self.on_load = on_load
+        self.track_memory = track_memory
+        self.optimize = optimize
+        self.workbook_cache = workbook_cache
+        self.digest = digest_file(path) if workbook_cache is not None else None
+        self._shapes = read_sheet_dimensions(path)
+        self._loaders = {}
+        self._parsed = OrderedDict()
+        self._modified = {}
+        self._bytes = {}
+        self.statistics = StatsCache()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __iter__(self):
+        return iter(self._shapes)
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._shapes
+
+    def keys(self):
+        return list(self._shapes)
+
+    def items(self):
+        """Yield every sheet, parsing as needed"""
+        for sheet_name in self._shapes:
+            yield sheet_name, self[sheet_name]
+
+    def __getitem__(self, sheet_name):
+        with self._lock:
+            if sheet_name in self._modified:
+                return self._modified[sheet_name]
+            if sheet_name in self._parsed:
+                self._parsed.move_to_end(sheet_name)
+                return self._parsed[sheet_name]
+            if sheet_name not in self._shapes:
+                raise KeyError(sheet_name)
+
+            df = self._load(sheet_name)
+            self._parsed[sheet_name] = df
+            self._bytes[sheet_name] = int(df.memory_usage(deep=True).sum())
+            self._shapes[sheet_name] = df.shape
+            while len(self._parsed) > self.cache_size:
+                evicted, _ = self._parsed.popitem(last=False)
+                del self._bytes[evicted]
+            return df
+
+    def __setitem__(self, sheet_name, df):
+        with self._lock:
+            # Before the old frame is released, so unchanged columns keep their statistics
+            self.statistics.update(sheet_name, df)
+            self._parsed.pop(sheet_name, None)
+            self._modified[sheet_name] = df
+            self._bytes[sheet_name] = int(df.memory_usage(deep=True).sum())
+            self._shapes[sheet_name] = df.shape
+
+    def set_loader(self, sheet_name, loader, shape=None):
+        """Load sheet_name with loader() instead of parsing the source file"""
+        with self._lock:
+            self._loaders[sheet_name] = loader
+            self._shapes[sheet_name] = shape
+
+    def with_stats(self, sheet_name):
+        """(frame, cached SheetStats) for the current version of sheet_name"""
+        with self._lock:
+            df = self[sheet_name]
+            return df, self.statistics.get(sheet_name, df)
+
+    def is_loaded(self, sheet_name):
+        return sheet_name in self._modified or sheet_name in self._parsed
+
+    def shape(self, sheet_name):
+        """Exact shape once parsed, otherwise the declared shape (or None)"""
+        return self._shapes[sheet_name]
+
+    @property
+    def nbytes(self):
+        return sum(self._bytes.values())
+
+    def _load(self, sheet_name):
+        loader = self._loaders.get(sheet_name)
+        if loader is not None:
+            return loader()
+
+        # Cached sheets depend on the engine too (calamine reads whitespace differently)
+        cache_key = f"{list(self._shapes).index(sheet_name)}_{default_engine(self.path) or 'default'}"
+        if self.optimize:
+            cache_key += '_optimized'
+        if self.workbook_cache is not None:
+            start = time.perf_counter()
+            df = self.workbook_cache.get(self.digest, cache_key)
+            if df is not None:
+                if self.on_load:
+                    self.on_load(SheetLoadReport(sheet_name, 'cache', df.shape[0], df.shape[1],
+                                                 time.perf_counter() - start,
+                                                 int(df.memory_usage(deep=True).sum())))
+                return df
+
+        data, reports = load_excel(self.path, sheet_names=[sheet_name], track_memory=self.track_memory,
+                                   optimize=self.optimize)
+        if self.on_load:
+            self.on_load(reports[0])
+        if self.workbook_cache is not None:
+            self.workbook_cache.put(self.digest, cache_key, data[sheet_name])
+        return data[sheet_name]
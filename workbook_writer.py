@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Streaming .xlsx writer
+Writes SpreadsheetML straight into a zip stream a chunk of rows at a time,
+so exports need neither a temporary file nor an in-memory workbook model.
+"""
+
+import datetime
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+
+from workbook_loader import sheet_parts
+
+# Rows rendered and compressed per chunk
+CHUNK_ROWS = 5000
+
+# Bytes copied per read when carrying parts over from an uploaded workbook
+COPY_CHUNK = 1 << 20
+
+# Beyond this many estimated sheet bytes the zip entry needs Zip64 headers,
+# which have to be chosen before a streamed entry's size is known
+ZIP64_THRESHOLD = 1 << 30
+
+_ILLEGAL_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+_EPOCH_NS = pd.Timestamp(_EXCEL_EPOCH).value
+_DAY_NS = 86400 * 10 ** 9
+
+# cellXfs indexes in STYLES
+_STYLE_IDS = {'datetime': 1, 'date': 2, 'header': 3, 'timedelta': 4}
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd\\ hh:mm:ss"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy\\-mm\\-dd"/>'
+    '</numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="top"/></xf>'
+    '<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _content_types(sheet_count):
+    overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{overrides}</Types>'
+    )
+
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+
+
+def _workbook(sheet_names):
+    sheets = ''.join(
+        f'<sheet name={quoteattr(name)} sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets>{sheets}</sheets></workbook>'
+    )
+
+
+def _workbook_rels(sheet_count):
+    relations = ''.join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{relations}<Relationship Id="rId{sheet_count + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/></Relationships>'
+    )
+
+
+def column_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _text_cell(ref, text, style=''):
+    text = escape(_ILLEGAL_XML.sub('', text))
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _value_cell(ref, value, styles):
+    """One cell for an arbitrary Python value, matching what to_excel writes"""
+    if value is None or value is pd.NaT:
+        return ''
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return ''
+        if np.isinf(value):
+            return _text_cell(ref, 'inf' if value > 0 else '-inf')
+        return f'<c r="{ref}"><v>{float(value)!r}</v></c>'
+    if isinstance(value, str):
+        return _text_cell(ref, value)
+    if isinstance(value, datetime.datetime):
+        serial = (value.replace(tzinfo=None) - _EXCEL_EPOCH) / datetime.timedelta(days=1)
+        return f'<c r="{ref}" s="{styles["datetime"]}"><v>{serial!r}</v></c>'
+    if isinstance(value, datetime.date):
+        serial = (value - _EXCEL_EPOCH.date()).days
+        return f'<c r="{ref}" s="{styles["date"]}"><v>{serial}</v></c>'
+    if isinstance(value, datetime.timedelta):
+        # Days, as to_excel writes durations
+        serial = value / datetime.timedelta(days=1)
+        return f'<c r="{ref}" s="{styles["timedelta"]}"><v>{serial!r}</v></c>'
+    return _text_cell(ref, str(value))
+
+
+def _column_cells(series, letter, first_row, styles):
+    """Cell XML for one column of a chunk"""
+    rows = range(first_row, first_row + len(series))
+    dtype = series.dtype
+
+    if dtype == np.bool_:
+        return [f'<c r="{letter}{r}" t="b"><v>{int(v)}</v></c>' for r, v in zip(rows, series.to_numpy().tolist())]
+
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return [f'<c r="{letter}{r}"><v>{v}</v></c>' for r, v in zip(rows, series.to_numpy().tolist())]
+
+    if pd.api.types.is_float_dtype(dtype) and isinstance(dtype, np.dtype):
+        values = series.to_numpy()
+        finite = np.isfinite(values).tolist()
+        return [
+            f'<c r="{letter}{r}"><v>{v!r}</v></c>' if ok else _value_cell(f'{letter}{r}', v, styles)
+            for r, v, ok in zip(rows, values.tolist(), finite)
+        ]
+
+    if pd.api.types.is_datetime64_dtype(dtype) and isinstance(dtype, np.dtype):
+        nanoseconds = series.to_numpy().astype('datetime64[ns]').view('i8')
+        serials = ((nanoseconds - _EPOCH_NS) / _DAY_NS).tolist()
+        missing = series.isna().to_numpy().tolist()
+        style = styles['datetime']
+        return [
+            '' if na else f'<c r="{letter}{r}" s="{style}"><v>{v!r}</v></c>'
+            for r, v, na in zip(rows, serials, missing)
+        ]
+
+    if pd.api.types.is_timedelta64_dtype(dtype) and isinstance(dtype, np.dtype):
+        serials = (series.to_numpy().astype('timedelta64[ns]').view('i8') / _DAY_NS).tolist()
+        missing = series.isna().to_numpy().tolist()
+        style = styles['timedelta']
+        return [
+            '' if na else f'<c r="{letter}{r}" s="{style}"><v>{v!r}</v></c>'
+            for r, v, na in zip(rows, serials, missing)
+        ]
+
+    return [_value_cell(f'{letter}{r}', v, styles) for r, v in zip(rows, series.astype(object).tolist())]
+
+
+def _sheet_xml(df, chunk_rows, styles=_STYLE_IDS):
+    """Yield a worksheet's XML in chunks of rows"""
+    letters = [column_letter(i) for i in range(df.shape[1])]
+    dimension = f"A1:{letters[-1]}{df.shape[0] + 1}" if letters else "A1"
+    header = ''.join(
+        _text_cell(f'{letter}1', str(column), style=f' s="{styles["header"]}"')
+        for letter, column in zip(letters, df.columns)
+    )
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f'<dimension ref="{dimension}"/><sheetData>'
+        + (f'<row r="1">{header}</row>' if letters else '')
+    )
+
+    for start in range(0, df.shape[0], chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        first_row = start + 2
+        columns = [
+            _column_cells(chunk.iloc[:, i], letter, first_row, styles)
+            for i, letter in enumerate(letters)
+        ]
+        yield ''.join(
+            f'<row r="{r}">{"".join(cells)}</row>'
+            for r, cells in zip(range(first_row, first_row + len(chunk)), zip(*columns))
+        )
+
+    yield '</sheetData></worksheet>'
+
+
+class ChunkBuffer:
+    """Write-only file object that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.closed = True
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _new_entry(name, compress_type=zipfile.ZIP_DEFLATED):
+    info = zipfile.ZipInfo(name, date_time=datetime.datetime.now().timetuple()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def _write_sheet(archive, buffer, name, df, chunk_rows, styles=_STYLE_IDS):
+    """Stream one worksheet part into archive, yielding compressed bytes as they are produced"""
+    force_zip64 = df.size * 64 > ZIP64_THRESHOLD
+    with archive.open(_new_entry(name), 'w', force_zip64=force_zip64) as entry:
+        for xml in _sheet_xml(df, chunk_rows, styles):
+            entry.write(xml.encode('utf-8'))
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def _iter_new_xlsx(workbook, chunk_rows):
+    sheet_names = list(workbook)
+    buffer = ChunkBuffer()
+    # zipfile falls back to streaming data descriptors on an unseekable file
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _content_types(len(sheet_names)))
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _workbook(sheet_names))
+        archive.writestr('xl/_rels/workbook.xml.rels', _workbook_rels(len(sheet_names)))
+        archive.writestr('xl/styles.xml', STYLES)
+        yield buffer.drain()
+
+        for i, sheet_name in enumerate(sheet_names, 1):
+            yield from _write_sheet(archive, buffer, f'xl/worksheets/sheet{i}.xml', workbook[sheet_name], chunk_rows)
+    yield buffer.drain()
+
+
+def _append_children(xml, tag, child, items):
+    """Append items to the <tag> collection in styles.xml
+
+    Returns the new XML and the index of the first appended item.
+    """
+    match = re.search(rf'<{tag}(\s[^>]*)?>(.*?)</{tag}>', xml, re.S)
+    if match is None:
+        raise ValueError(f"styles.xml has no <{tag}> element")
+    existing = len(re.findall(rf'<{child}[\s/>]', match.group(2)))
+    attributes = re.sub(r'\s*count="\d*"', '', match.group(1) or '')
+    block = f'<{tag} count="{existing + len(items)}"{attributes}>{match.group(2)}{"".join(items)}</{tag}>'
+    return xml[:match.start()] + block + xml[match.end():], existing
+
+
+def _merge_styles(xml):
+    """Add the writer's date and header styles to an existing styles.xml
+
+    Returns the new XML and the cellXfs indexes to use for re-encoded sheets.
+    """
+    xml = re.sub(r'<numFmts\b[^>]*/>', '', xml)
+    format_ids = [int(value) for value in re.findall(r'<numFmt\b[^>]*numFmtId="(\d+)"', xml)]
+    datetime_format = max(format_ids + [163]) + 1
+    date_format = datetime_format + 1
+    formats = [
+        f'<numFmt numFmtId="{datetime_format}" formatCode="yyyy\\-mm\\-dd\\ hh:mm:ss"/>',
+        f'<numFmt numFmtId="{date_format}" formatCode="yyyy\\-mm\\-dd"/>',
+    ]
+    if '<numFmts' in xml:
+        xml, _ = _append_children(xml, 'numFmts', 'numFmt', formats)
+    else:
+        # numFmts has to be the first child of styleSheet
+        opening = re.search(r'<styleSheet\b[^>]*>', xml)
+        if opening is None:
+            raise ValueError("styles.xml has no <styleSheet> element")
+        xml = xml[:opening.end()] + f'<numFmts count="2">{"".join(formats)}</numFmts>' + xml[opening.end():]
+
+    xml, bold_font = _append_children(xml, 'fonts', 'font', ['<font><b/><sz val="11"/><name val="Calibri"/></font>'])
+    xml, thin_border = _append_children(xml, 'borders', 'border', [
+        '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    ])
+    xml, first_xf = _append_children(xml, 'cellXfs', 'xf', [
+        f'<xf numFmtId="{datetime_format}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>',
+        f'<xf numFmtId="{date_format}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>',
+        f'<xf numFmtId="0" fontId="{bold_font}" fillId="0" borderId="{thin_border}" xfId="0" '
+        'applyFont="1" applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="top"/></xf>',
+        '<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>',
+    ])
+    ElementTree.fromstring(xml.encode('utf-8'))
+    return xml, {'datetime': first_xf, 'date': first_xf + 1, 'header': first_xf + 2, 'timedelta': first_xf + 3}
+
+
+def _rels_part(part):
+    """The relationships part of a package part ('' for the package itself)"""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+def _related_parts(source, part, names):
+    """Parts inside the package that part has relationships to"""
+    rels = _rels_part(part)
+    if rels not in names:
+        return []
+    related = []
+    for relationship in ElementTree.fromstring(source.read(rels)):
+        target = relationship.get('Target', '')
+        if relationship.get('TargetMode') == 'External' or not target:
+            continue
+        if target.startswith('/'):
+            related.append(target[1:])
+        else:
+            related.append(posixpath.normpath(posixpath.join(posixpath.dirname(part), target)))
+    return related
+
+
+def _dropped_parts(source, replaced):
+    """Parts to leave out when the sheets in replaced are re-encoded
+
+    Re-encoded sheets keep no tables, drawings or comments, whose ranges
+    would no longer match the rows written and make Excel repair the file.
+    Their relationships go, along with every part nothing else still uses.
+    """
+    if not replaced:
+        return set()
+    names = set(source.namelist())
+
+    def reachable(parts):
+        seen = set()
+        stack = list(parts)
+        while stack:
+            part = stack.pop()
+            if part in seen or part not in names:
+                continue
+            seen.add(part)
+            if part not in replaced:
+                stack.extend(_related_parts(source, part, names))
+        return seen
+
+    kept = reachable(_related_parts(source, '', names))
+    orphaned = reachable(
+        related for sheet in replaced for related in _related_parts(source, sheet, names)
+    ) - kept
+    dropped = {_rels_part(part) for part in set(replaced) | orphaned} | orphaned
+    return dropped & names
+
+
+def _iter_updated_xlsx(source_path, workbook, modified_sheets, chunk_rows):
+    """Copy source_path part by part, re-encoding only modified_sheets
+
+    Raises ValueError before yielding anything if the source can't be
+    updated in place (not an .xlsx, or its sheets differ from workbook).
+    """
+    source = zipfile.ZipFile(source_path)
+    try:
+        parts = sheet_parts(source)
+        if list(parts) != list(workbook):
+            raise ValueError("Workbook sheets no longer match the uploaded file")
+        replaced = {parts[sheet_name]: sheet_name for sheet_name in modified_sheets}
+        styles_xml, styles = _merge_styles(source.read('xl/styles.xml').decode('utf-8')) if replaced else (None, None)
+        dropped = _dropped_parts(source, replaced)
+    except Exception:
+        source.close()
+        raise
+
+    return _copy_parts(source, workbook, replaced, dropped, styles_xml, styles, chunk_rows)
+
+
+def _copy_parts(source, workbook, replaced, dropped, styles_xml, styles, chunk_rows):
+    buffer = ChunkBuffer()
+    with source, zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for item in source.infolist():
+            name = item.filename
+            if name in replaced:
+                yield from _write_sheet(archive, buffer, name, workbook[replaced[name]], chunk_rows, styles)
+                continue
+
+            if name in dropped:
+                continue
+            if replaced and name == 'xl/styles.xml':
+                archive.writestr(_new_entry(name), styles_xml)
+            elif replaced and name == 'xl/calcChain.xml':
+                # Cell positions in re-encoded sheets changed; Excel rebuilds the chain
+                continue
+            elif replaced and name in ('[Content_Types].xml', 'xl/_rels/workbook.xml.rels'):
+                xml = source.read(name).decode('utf-8')
+                xml = re.sub(r'<(?:Override|Relationship)\b[^>]*calcChain[^>]*/>', '', xml)
+                xml = re.sub(
+                    r'<Override\b[^>]*PartName="/?([^"]*)"[^>]*/>',
+                    lambda match: '' if match.group(1) in dropped else match.group(0),
+                    xml,
+                )
+                archive.writestr(_new_entry(name), xml)
+            else:
+                with source.open(item) as src, \
+                        archive.open(_new_entry(name, item.compress_type), 'w',
+                                     force_zip64=item.file_size > ZIP64_THRESHOLD) as dst:
+                    for data in iter(lambda: src.read(COPY_CHUNK), b''):
+                        dst.write(data)
+                        yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def iter_xlsx(workbook, chunk_rows=CHUNK_ROWS, source_path=None, modified_sheets=()):
+    """Yield an .xlsx file for a mapping of sheet name -> DataFrame as byte chunks
+
+    Sheets are fetched from the mapping one at a time, so a lazily parsed
+    workbook is never fully resident. Memory use is bounded by chunk_rows.
+
+    With source_path, the workbook's original .xlsx is copied part by part
+    and only modified_sheets are re-encoded, so untouched sheets are never
+    parsed and keep their original formatting. Falls back to writing every
+    sheet when the source can't be reused.
+    """
+    if source_path is not None:
+        try:
+            chunks = _iter_updated_xlsx(source_path, workbook, modified_sheets, chunk_rows)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+            print(f"⚠️ Re-encoding every sheet, could not reuse {source_path}: {e}")
+        else:
+            yield from chunks
+            return
+
+    yield from _iter_new_xlsx(workbook, chunk_rows)
+
+
+def write_xlsx(workbook, path, chunk_rows=CHUNK_ROWS, source_path=None, modified_sheets=()):
+    """Write an .xlsx file with iter_xlsx, returning the number of bytes written"""
+    written = 0
+    with open(path, 'wb') as f:
+        for chunk in iter_xlsx(workbook, chunk_rows, source_path, modified_sheets):
+            f.write(chunk)
+            written += len(chunk)
+    return written